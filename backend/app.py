@@ -1,25 +1,114 @@
 # Flask web application for compatibility chatbot demo
 # Handles Dialogflow webhook integration and matching logic
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
+import hmac
 import json
+import math
 import os
-from models import UserProfile, SurveyData
+from models import UserProfile, CompactProfile, SurveyData, GOAL_VOCABULARY, STYLE_VOCABULARY, TIMELINE_VOCABULARY
 from matching import CompatibilityEngine
 from explain import ExplainabilityEngine
+from pool import CandidatePool
+from storage import ProfileStore
+from shared import SharedPool
+from cache import MatchCache
+from precompute import RecommendationStore
+from sessions import SessionStore, SQLiteBackend
+from normalize import EntityNormalizer
+from metrics import REGISTRY, CONTENT_TYPE, timed, instrument
+from profiler import SamplingProfiler
+from bulk import rank_many
+from serialization import JSONProvider, match_line, error_line
 
 # Initialize Flask app with template folder pointing to frontend
 app = Flask(__name__, template_folder='../frontend')
+app.json = JSONProvider(app)  # jsonify() through orjson when it's installed
 CORS(app)  # Enable Cross-Origin Resource Sharing for frontend
 
 # Initialize matching and explanation engines
-compatibility_engine = CompatibilityEngine()
+# ANN_PROBES > 0 enables approximate search on pools of a million or more;
+# VALUES_MODE=cross scores values through data/values_matrix.csv
+compatibility_engine = CompatibilityEngine(ann_probes=int(os.environ.get('ANN_PROBES', 0)),
+                                           values_mode=os.environ.get('VALUES_MODE', 'aligned'))
 explainability_engine = ExplainabilityEngine()
 
+# Maps goal, style and timeline parameters to survey vocabulary codes
+entity_normalizer = EntityNormalizer.from_agent()
+
 # In-memory storage for demo purposes (would use database in production)
 users_db = {}          # Stores user profiles by ID
-current_session = {}   # Tracks current conversation sessions
+
+# Tracks current conversation sessions. Idle sessions expire after
+# SESSION_TTL seconds and at most SESSION_MAX are kept in memory; with
+# SESSION_DB they're saved to that SQLite file, surviving restarts and
+# shared between worker processes.
+SESSION_DB = os.environ.get('SESSION_DB')
+current_session = SessionStore(max_entries=int(os.environ.get('SESSION_MAX', 10000)),
+                               ttl=float(os.environ.get('SESSION_TTL', 1800)),
+                               backend=SQLiteBackend(SESSION_DB) if SESSION_DB else None)
+
+# Profiles survive restarts when PROFILE_STORE_DIR points at a profile store.
+# With SHARED_POOL=1 every worker process maps the same store instead of
+# loading its own copy (see gunicorn.conf.py).
+PROFILE_STORE_DIR = os.environ.get('PROFILE_STORE_DIR')
+if PROFILE_STORE_DIR and os.environ.get('SHARED_POOL') == '1':
+    profile_store = None  # SharedPool logs its own writes through the store
+    candidate_pool = SharedPool(ProfileStore(PROFILE_STORE_DIR))
+else:
+    profile_store = ProfileStore(PROFILE_STORE_DIR) if PROFILE_STORE_DIR else None
+    candidate_pool = profile_store.load() if profile_store else CandidatePool()  # Every profile available for matching
+
+# Ranked matches per session, reused by follow-up intents until the user's
+# profile or the candidate pool changes
+match_cache = MatchCache()
+profile_versions = {}   # Bumped each time a session's profile is (re)built
+MATCH_CACHE_DEPTH = 12  # Matches ranked (and cached) per search
+MATCHES_PER_PAGE = 3    # Matches shown per reply
+
+# Nightly top matches written by precompute.py, used instead of a live
+# search for users they cover
+RECOMMENDATIONS_DIR = os.environ.get('RECOMMENDATIONS_DIR')
+recommendations = None
+
+# Hot-path latency histograms and state gauges, served at /metrics.
+# METRICS=0 leaves the timed functions unwrapped.
+WEBHOOK_SECONDS = REGISTRY.histogram('webhook_request_seconds', 'Time to answer a /webhook request')
+INTENT_SECONDS = REGISTRY.histogram('intent_handler_seconds', 'Time spent in each intent handler', label='intent')
+MATCH_SECONDS = REGISTRY.histogram('find_top_matches_seconds', 'Time to rank the pool for one user')
+DIMENSION_SECONDS = REGISTRY.histogram('score_dimension_seconds', 'Time to score one dimension against a batch',
+                                       label='dimension')
+EXPLAIN_SECONDS = REGISTRY.histogram('explain_match_seconds', 'Time to explain one match')
+
+instrument(compatibility_engine, 'find_top_matches', MATCH_SECONDS)
+for dimension in ('values', 'goals', 'communication', 'timeline'):
+    instrument(compatibility_engine, f'_batch_{dimension}_scores', DIMENSION_SECONDS, dimension)
+instrument(explainability_engine, 'explain_match', EXPLAIN_SECONDS)
+
+REGISTRY.gauge('candidate_pool_profiles', 'Profiles available for matching', lambda: len(candidate_pool))
+REGISTRY.gauge('sessions_in_memory', 'Conversation sessions held in memory', lambda: len(current_session))
+REGISTRY.gauge('session_evictions_total', 'Sessions evicted to stay within SESSION_MAX',
+               lambda: current_session.evictions, kind='counter')
+REGISTRY.gauge('session_expirations_total', 'Sessions expired after SESSION_TTL idle seconds',
+               lambda: current_session.expirations, kind='counter')
+REGISTRY.gauge('match_cache_hits_total', 'Match searches answered from the cache',
+               lambda: match_cache.hits, kind='counter')
+REGISTRY.gauge('match_cache_misses_total', 'Match searches that missed the cache',
+               lambda: match_cache.misses, kind='counter')
+REGISTRY.gauge('match_cache_hit_ratio', 'Share of match searches answered from the cache',
+               lambda: match_cache.hits / max(match_cache.hits + match_cache.misses, 1))
+
+# Sampling profiler for live traffic, kept to stacks through this backend's
+# code (intent handlers, CompatibilityEngine). POST /admin/profile?seconds=N
+# with an X-Profiler-Token header equal to PROFILER_TOKEN returns N seconds of
+# samples; PROFILE_SECONDS profiles that long from startup into PROFILE_OUTPUT.
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+PROFILE_MAX_SECONDS = 60
+profiler = SamplingProfiler(focus=(os.path.dirname(os.path.abspath(__file__)),))
+if os.environ.get('PROFILE_SECONDS'):
+    profiler.start(float(os.environ['PROFILE_SECONDS']),
+                   os.environ.get('PROFILE_OUTPUT', 'profile-{pid}.txt').format(pid=os.getpid()))
 
 @app.route('/')
 def index():
@@ -27,6 +116,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/webhook', methods=['POST'])
+@timed(WEBHOOK_SECONDS)
 def dialogflow_webhook():
     """
     Handle incoming webhook requests from Dialogflow
@@ -34,12 +124,7 @@ def dialogflow_webhook():
     Processes user intents and returns appropriate responses
     based on the conversation flow and user data collection
     """
-    req = request.get_json()
-    
-    # Extract intent and parameters from Dialogflow request
-    intent_name = req.get('queryResult', {}).get('intent', {}).get('displayName', '')
-    parameters = req.get('queryResult', {}).get('parameters', {})
-    session_id = req.get('session', '').split('/')[-1]  # Get unique session identifier
+    intent_name, parameters, session_id = parse_webhook_request(request.get_json())
     
     # Process the intent and generate response
     response_text = handle_intent(intent_name, parameters, session_id)
@@ -49,6 +134,32 @@ def dialogflow_webhook():
         'fulfillmentText': response_text
     })
 
+def parse_webhook_request(req):
+    """Extract (intent name, parameters, session id) from a Dialogflow webhook request"""
+    query = req.get('queryResult') or {}
+    intent = query.get('intent') or {}
+    session_id = req.get('session', '').rpartition('/')[2]  # Last segment of the session path
+    return intent.get('displayName', ''), query.get('parameters') or {}, session_id
+
+# Intent display name -> handler(parameters, session_id), filled in by @intent
+INTENT_HANDLERS = {}
+
+def intent(name, uses_parameters=True):
+    """
+    Register the decorated function as the handler for a Dialogflow intent
+    
+    Handlers that don't take parameters are called with the session id only.
+    Each handler's run time is recorded under its intent name.
+    """
+    def register(handler):
+        if uses_parameters:
+            dispatch = handler
+        else:
+            dispatch = lambda parameters, session_id: handler(session_id)
+        INTENT_HANDLERS[name] = timed(INTENT_SECONDS, name)(dispatch)
+        return handler
+    return register
+
 def handle_intent(intent_name, parameters, session_id):
     """
     Route different intents to their appropriate handler functions
@@ -61,27 +172,15 @@ def handle_intent(intent_name, parameters, session_id):
     Returns:
         String response to send back to user
     """
-    
-    # Route to specific intent handlers
-    if intent_name == 'welcome':
-        return handle_welcome(session_id)
-    elif intent_name == 'collect.basic.info':
-        return handle_basic_info(parameters, session_id)
-    elif intent_name == 'collect.values':
-        return handle_values(parameters, session_id)
-    elif intent_name == 'collect.family.goals':
-        return handle_family_goals(parameters, session_id)
-    elif intent_name == 'collect.communication.style':
-        return handle_communication_style(parameters, session_id)
-    elif intent_name == 'collect.timeline':
-        return handle_timeline(parameters, session_id)
-    elif intent_name == 'find.matches':
-        return handle_find_matches(session_id)
-    elif intent_name == 'explain.match':
-        return handle_explain_match(parameters, session_id)
-    else:
+    handler = INTENT_HANDLERS.get(intent_name)
+    if handler is None:
         return "I'm sorry, I didn't understand that. Could you please rephrase?"
+    current_session.refresh(session_id)
+    response = handler(parameters, session_id)
+    current_session.save(session_id)
+    return response
 
+@intent('welcome', uses_parameters=False)
 def handle_welcome(session_id):
     """
     Initialize a new conversation session and welcome the user
@@ -95,6 +194,7 @@ def handle_welcome(session_id):
             "to find compatible matches. Let's start with some basic information. "
             "What's your name?")
 
+@intent('collect.basic.info')
 def handle_basic_info(parameters, session_id):
     """
     Collect and store basic user information (name, age, location)
@@ -127,6 +227,7 @@ def handle_basic_info(parameters, session_id):
     
     return "Could you please provide that information so we can continue?"
 
+@intent('collect.values')
 def handle_values(parameters, session_id):
     """Collect user values and priorities"""
     if session_id not in current_session:
@@ -165,6 +266,7 @@ def handle_values(parameters, session_id):
     
     return "Please provide a number from 1 to 5 for how important this is to you."
 
+@intent('collect.family.goals')
 def handle_family_goals(parameters, session_id):
     """Collect family planning goals"""
     if session_id not in current_session:
@@ -172,17 +274,14 @@ def handle_family_goals(parameters, session_id):
     
     session_data = current_session[session_id]
     
-    # Extract family goals from parameters (this could be more advanced with proper entity extraction)
-    goals = []
-    if 'family-goals' in parameters:
-        goals = parameters['family-goals']
-    
+    goals = [GOAL_VOCABULARY.decode(code) for code in entity_normalizer.extract(parameters, 'family_goals')]
     session_data['family_goals'] = goals if goals else ['biological_children']  # Default
     
     return ("Got it! Now, how would you describe your communication style? "
             "Are you more direct and honest, gentle and supportive, analytical and logical, "
             "emotional and expressive, or collaborative and consensus-building?")
 
+@intent('collect.communication.style')
 def handle_communication_style(parameters, session_id):
     """Collect communication style preference"""
     if session_id not in current_session:
@@ -190,26 +289,13 @@ def handle_communication_style(parameters, session_id):
     
     session_data = current_session[session_id]
     
-    # Map communication style (would use proper entity recognition in production)
-    style_mapping = {
-        'direct': 'direct_honest',
-        'gentle': 'gentle_supportive',
-        'analytical': 'analytical_logical',
-        'emotional': 'emotional_expressive',
-        'collaborative': 'collaborative_consensus'
-    }
-    
-    style = 'direct_honest'  # Default
-    for key, value in style_mapping.items():
-        if key in str(parameters).lower():
-            style = value
-            break
-    
-    session_data['communication_style'] = style
+    styles = entity_normalizer.extract(parameters, 'communication_style')
+    session_data['communication_style'] = STYLE_VOCABULARY.decode(styles[0]) if styles else 'direct_honest'  # Default
     
     return ("Perfect! Finally, what's your preferred timeline for starting a family? "
             "Within 1 year, 1-3 years, 3-5 years, 5+ years, or are you flexible?")
 
+@intent('collect.timeline')
 def handle_timeline(parameters, session_id):
     """Collect timeline preference and create user profile"""
     if session_id not in current_session:
@@ -217,22 +303,8 @@ def handle_timeline(parameters, session_id):
     
     session_data = current_session[session_id]
     
-    # Map timeline (simplified for demo)
-    timeline_mapping = {
-        '1 year': 'within_1_year',
-        '1-3': '1_to_3_years',
-        '3-5': '3_to_5_years',
-        '5+': '5_plus_years',
-        'flexible': 'flexible_timing'
-    }
-    
-    timeline = 'flexible_timing'  # Default
-    timeline_text = str(parameters).lower()
-    for key, value in timeline_mapping.items():
-        if key in timeline_text:
-            timeline = value
-            break
-    
+    timelines = entity_normalizer.extract(parameters, 'timeline')
+    timeline = TIMELINE_VOCABULARY.decode(timelines[0]) if timelines else 'flexible_timing'  # Default
     session_data['timeline'] = timeline
     
     # Create user profile
@@ -248,50 +320,138 @@ def handle_timeline(parameters, session_id):
         timeline=timeline
     )
     
-    # Store user profile
+    # Store user profile and make it available as a candidate
     users_db[session_id] = user_profile
+    profile_versions[session_id] = profile_versions.get(session_id, 0) + 1
+    match_cache.invalidate(session_id)
+    try:
+        if profile_store:
+            profile_store.add(candidate_pool, user_profile)
+        else:
+            candidate_pool.add(user_profile)
+    except ValueError:
+        # Can't be encoded for batch scoring; the user can still search for matches
+        store = open_recommendations()
+        if store is not None:
+            store.remove(session_id)
+    else:
+        # Merge the new profile into the precomputed lists (one pass over the pool)
+        store = open_recommendations()
+        if store is not None:
+            store.add_profile(user_profile)
     
     return ("Perfect! I've collected all your information. Your profile is now complete. "
             "Would you like me to find some compatible matches for you?")
 
+def get_user_profile(session_id):
+    """Look up a completed profile, including ones loaded from the profile store"""
+    return users_db.get(session_id) or candidate_pool.get(session_id)
+
+def get_ranked_matches(user):
+    """Ranked matches for a user, from the match cache while still valid"""
+    # Read the version before ranking: if the pool changes meanwhile, the
+    # entry is stored under the old version and simply misses next time
+    version = (profile_versions.get(user.user_id, 0), candidate_pool.generation)
+    matches = match_cache.get(user.user_id, version)
+    if matches is None:
+        matches = get_precomputed_matches(user)
+        if matches is None:
+            matches = compatibility_engine.find_top_matches(user, candidate_pool, top_n=MATCH_CACHE_DEPTH)
+        match_cache.put(user.user_id, version, matches)
+    return matches
+
+def open_recommendations():
+    """The precomputed recommendations, reopened after each new run; None if there are none"""
+    global recommendations
+    if not RECOMMENDATIONS_DIR:
+        return None
+    if recommendations is None or recommendations.is_stale():
+        try:
+            recommendations = RecommendationStore(RECOMMENDATIONS_DIR)
+        except FileNotFoundError:
+            return None
+    return recommendations
+
+def get_precomputed_matches(user):
+    """
+    Matches from the precomputed recommendations, or None if they don't cover the user
+    
+    Only the listed candidates are rescored (for current explanations);
+    ones that have since left the pool are skipped.
+    """
+    store = open_recommendations()
+    listed = store.get(user.user_id) if store is not None else None
+    if listed is None:
+        return None
+    matches = []
+    for candidate_id, _ in listed[:MATCH_CACHE_DEPTH]:
+        candidate = candidate_pool.get(candidate_id)
+        if candidate is not None:
+            matches.append(compatibility_engine.calculate_compatibility(user, candidate))
+    matches.sort(key=lambda match: match.overall_score, reverse=True)
+    return matches
+
+def format_matches(matches, start=1):
+    """List matches with candidate details, numbered from start"""
+    response = ""
+    for i, match in enumerate(matches, start):
+        candidate = candidate_pool.get(match.user2_id)
+        response += f"{i}. {candidate.name} (Age {candidate.age}) - {int(match.overall_score * 100)}% compatibility\n"
+        response += f"   Location: {candidate.location}\n"
+        response += f"   Why it's a good match: {match.explanation}\n\n"
+    return response
+
+@intent('find.matches', uses_parameters=False)
 def handle_find_matches(session_id):
     """Find and return compatible matches"""
-    if session_id not in users_db:
+    user = get_user_profile(session_id)
+    if user is None:
         return "I need to collect your information first. Let's start with your name."
     
-    user = users_db[session_id]
-    
-    # Create sample candidates for demo
-    candidates = create_sample_candidates()
-    
     # Find top matches
-    matches = compatibility_engine.find_top_matches(user, candidates, top_n=3)
+    matches = get_ranked_matches(user)[:MATCHES_PER_PAGE]
     
     if not matches:
         return "I couldn't find any matches right now. Try expanding your criteria or check back later!"
+    current_session.setdefault(session_id, {})['match_offset'] = len(matches)
     
     # Format response
     response = "Great! I found some compatible matches for you:\n\n"
+    response += format_matches(matches)
+    response += "Would you like me to explain any of these matches in more detail?"
     
-    for i, match in enumerate(matches, 1):
-        candidate = next(c for c in candidates if c.user_id == match.user2_id)
-        response += f"{i}. {candidate.name} (Age {candidate.age}) - {int(match.overall_score * 100)}% compatibility\n"
-        response += f"   Location: {candidate.location}\n"
-        response += f"   Why it's a good match: {match.explanation}\n\n"
+    return response
+
+@intent('more.matches', uses_parameters=False)
+def handle_more_matches(session_id):
+    """Show the next page of matches after the ones already shown"""
+    user = get_user_profile(session_id)
+    if user is None:
+        return "I need to collect your information first. Let's start with your name."
+    
+    session_data = current_session.setdefault(session_id, {})
+    offset = session_data.get('match_offset', 0)
+    matches = get_ranked_matches(user)[offset:offset + MATCHES_PER_PAGE]
+    
+    if not matches:
+        return "That's everyone I found for now. Check back later as new people join!"
+    session_data['match_offset'] = offset + len(matches)
     
+    response = "Here are more compatible matches:\n\n"
+    response += format_matches(matches, start=offset + 1)
     response += "Would you like me to explain any of these matches in more detail?"
     
     return response
 
+@intent('explain.match')
 def handle_explain_match(parameters, session_id):
     """Provide detailed explanation for a specific match"""
-    if session_id not in users_db:
+    user = get_user_profile(session_id)
+    if user is None:
         return "Let me collect your information first."
     
     # For demo, explain the first match
-    user = users_db[session_id]
-    candidates = create_sample_candidates()
-    matches = compatibility_engine.find_top_matches(user, candidates, top_n=1)
+    matches = get_ranked_matches(user)[:1]
     
     if not matches:
         return "No matches to explain."
@@ -385,6 +545,101 @@ def create_sample_candidates():
     ]
     return candidates
 
+# Seed the pool with the demo candidates once at startup
+for sample_candidate in create_sample_candidates():
+    if sample_candidate.user_id not in candidate_pool:
+        candidate_pool.add(sample_candidate)
+
+@app.route('/api/sessions/stats', methods=['GET'])
+def session_stats():
+    """Session counts and estimated memory use"""
+    return jsonify(current_session.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Latency histograms, pool size, sessions and cache hit rates in the Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.route('/admin/profile', methods=['POST'])
+def profile_traffic():
+    """Sample live request threads for ?seconds=N; returns collapsed stacks for flamegraph tools"""
+    if not PROFILER_TOKEN:
+        return 'Not Found', 404  # Profiling is off unless a token is configured
+    if not hmac.compare_digest(request.headers.get('X-Profiler-Token', '').encode(), PROFILER_TOKEN.encode()):
+        return 'Forbidden', 403
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        seconds = math.nan
+    if not (math.isfinite(seconds) and seconds > 0):
+        return 'seconds must be a positive number', 400
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    try:
+        stacks = profiler.profile(seconds)
+    except RuntimeError as error:
+        return str(error), 409
+    return Response(stacks, content_type='text/plain; charset=utf-8', headers={
+        'X-Profile-Samples': str(profiler.samples),
+        'X-Profile-Overhead': f'{profiler.overhead:.4f}'
+    })
+
+# POST /api/matches/batch ranks many users against the whole pool in one
+# tiled pass (bulk.py), streaming one NDJSON line per user as it's ready
+MAX_BATCH_QUERIES = 10000
+MAX_BATCH_TOP_N = 100
+
+@app.route('/api/matches/batch', methods=['POST'])
+def batch_matches():
+    """
+    Top matches for many users at once, as newline-delimited JSON
+    
+    Body: {"user_ids": [...], "profiles": [UserProfile dicts], "top_n": 5,
+    "explain": false}. Each output line is {"user_id", "matches"} for one
+    query, in request order (user_ids first), or {"user_id", "error"} for
+    an unknown id or invalid profile.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    user_ids, profiles = body.get('user_ids') or [], body.get('profiles') or []
+    if not isinstance(user_ids, list) or not isinstance(profiles, list):
+        return jsonify({'error': 'user_ids and profiles must be lists'}), 400
+    if len(user_ids) + len(profiles) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} users per batch'}), 400
+    try:
+        top_n = min(int(body.get('top_n', 5)), MAX_BATCH_TOP_N)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_n must be a number'}), 400
+    explain = bool(body.get('explain'))
+    
+    queries = []    # (user_id, UserProfile or None, error)
+    for user_id in user_ids:
+        profile = candidate_pool.get(user_id) if isinstance(user_id, str) else None
+        queries.append((user_id, profile, None if profile else 'Unknown user_id'))
+    for data in profiles:
+        user_id = data.get('user_id') if isinstance(data, dict) else None
+        try:
+            profile = UserProfile.from_dict(data)
+            labels = [(STYLE_VOCABULARY, profile.communication_style), (TIMELINE_VOCABULARY, profile.timeline)]
+            labels += [(GOAL_VOCABULARY, goal) for goal in profile.family_goals]
+            if any(vocabulary.lookup(label) is None for vocabulary, label in labels):
+                raise ValueError("Unknown option")  # Inline profiles must use survey answers
+            CompactProfile.from_profile(profile)
+            queries.append((user_id, profile, None))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            queries.append((user_id, None, 'Invalid profile'))
+    
+    def generate():
+        ranked = rank_many(compatibility_engine, [profile for _, profile, _ in queries if profile], candidate_pool, top_n)
+        for user_id, profile, error in queries:
+            if error:
+                yield error_line(user_id, error)
+                continue
+            _, matches = next(ranked)
+            details = [explainability_engine.explain_match(match) for match in matches] if explain else None
+            yield match_line(user_id, matches, details)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/test', methods=['GET'])
 def test_api():
     """Test endpoint to verify API is working"""
@@ -0,0 +1,180 @@
+"""
+ASGI serving mode for the Dialogflow webhook
+
+Runs the same intent handlers as app.py, but from an asyncio event loop:
+each webhook call is handed to a bounded thread pool and awaited with a
+deadline, so one slow match search no longer holds up other callbacks.
+Dialogflow gives up on a webhook after about 5 seconds; when a call is
+about to run past WEBHOOK_DEADLINE, the user gets a "still searching"
+reply instead. The handler keeps running and fills the match cache, so
+asking again picks up the result. Only read-only intents get that
+reply: intents that record answers are always waited for, since asking
+the user to repeat one would record the answer twice. Every other route
+is passed through to the Flask app by uvicorn's WSGI middleware, which
+streams responses (such as /api/matches/batch) as they are produced.
+
+    cd backend && uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import logging
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from app import app as flask_app, handle_intent, parse_webhook_request, WEBHOOK_SECONDS
+from metrics import REGISTRY
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_DEADLINE = float(os.environ.get('WEBHOOK_DEADLINE', 4.0))        # Seconds before the fallback reply
+HANDLER_THREADS = int(os.environ.get('HANDLER_THREADS', os.cpu_count() or 1))
+MAX_PENDING = int(os.environ.get('MAX_PENDING', 4 * HANDLER_THREADS))   # Calls running or queued at once
+
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 10))                   # Threads serving the other routes
+
+# Replies sent when a call misses its deadline, by intent. Only these
+# read-only intents are answered early; the rest always wait for their handler.
+SEARCHING_REPLY = ("I'm still searching for your best matches - this is taking a little longer than usual. "
+                   "Ask me again in a moment and they'll be ready!")
+FALLBACK_REPLIES = {
+    'find.matches': SEARCHING_REPLY,
+    'more.matches': SEARCHING_REPLY,
+    'explain.match': SEARCHING_REPLY,
+}
+BUSY_REPLY = "I'm a bit busy right now. Could you say that again in a moment?"
+
+class WebhookServer:
+    """
+    ASGI application: asynchronous /webhook, everything else via WSGI
+    
+    Intent handlers share module state in app.py (sessions, caches, the
+    candidate pool), so they run on threads rather than processes; the
+    scoring itself spends most of its time in NumPy. At most max_pending
+    calls hold a slot at once. Callers past that wait for a slot until
+    their deadline, then get the busy reply, which keeps the queue from
+    growing without bound under load.
+    """
+    
+    def __init__(self, wsgi_app, threads: int = HANDLER_THREADS, max_pending: int = MAX_PENDING,
+                 deadline: float = WEBHOOK_DEADLINE):
+        """Wrap a WSGI app, running intent handlers on `threads` threads"""
+        self.wsgi_app = wsgi_app
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)  # Uvicorn suggests a2wsgi, which it uses when installed
+            self._wsgi = WSGIMiddleware(wsgi_app, workers=WSGI_THREADS)
+        self.deadline = deadline
+        self.max_pending = max_pending
+        self.timeouts = 0      # Calls answered with a fallback reply
+        self.rejected = 0      # Calls that never got a slot
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='intent')
+        self._slots = None     # asyncio.Semaphore, created on the server's event loop
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = await self._read_body(receive)
+        if scope['path'] != '/webhook' or scope['method'] != 'POST':
+            await self._pass_through(scope, body, send)
+            return
+        started = time.perf_counter()
+        try:
+            status, headers, payload = await self.webhook(body)
+        finally:
+            if REGISTRY.enabled:
+                WEBHOOK_SECONDS.observe(time.perf_counter() - started)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+    
+    async def webhook(self, body: bytes):
+        """Answer one Dialogflow call, within the deadline if its intent is read-only; returns (status, headers, body)"""
+        started = time.monotonic()
+        try:
+            intent_name, parameters, session_id = parse_webhook_request(loads(body))
+        except (ValueError, AttributeError):
+            return 400, [(b'content-type', b'text/plain')], b'Expected a Dialogflow webhook request'
+        
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.deadline - (time.monotonic() - started))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return self._reply(BUSY_REPLY)
+        
+        # The slot is held until the handler finishes, even if we stop waiting for it
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, handle_intent, intent_name, parameters, session_id
+        )
+        future.add_done_callback(self._handler_done)
+        try:
+            if intent_name in FALLBACK_REPLIES:
+                text = await asyncio.wait_for(asyncio.shield(future), self.deadline - (time.monotonic() - started))
+            else:
+                text = await future
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            text = FALLBACK_REPLIES[intent_name]
+        except Exception:
+            return 500, [(b'content-type', b'text/plain')], b'Internal Server Error'
+        return self._reply(text)
+    
+    def _handler_done(self, future):
+        """Free the handler's slot and log its failure, if any"""
+        self._slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Intent handler failed', exc_info=future.exception())
+    
+    @staticmethod
+    def _reply(text: str):
+        """Dialogflow webhook response for a reply"""
+        payload = dumps({'fulfillmentText': text})
+        return 200, [(b'content-type', b'application/json'),
+                     (b'content-length', str(len(payload)).encode())], payload
+    
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+    
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    async def _pass_through(self, scope, body: bytes, send):
+        """
+        Serve a request from the WSGI app, streaming its response
+        
+        The body has been read in full, so it's handed on with its
+        actual length: a chunked upload has no Content-Length, and the
+        WSGI app would otherwise read it as empty.
+        """
+        headers = [(name, value) for name, value in scope.get('headers', [])
+                   if name not in (b'content-length', b'transfer-encoding')]
+        scope = dict(scope, headers=headers + [(b'content-length', str(len(body)).encode())])
+        
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await self._wsgi(scope, receive, send)
+
+app = WebhookServer(flask_app)
+
+REGISTRY.gauge('webhook_deadline_timeouts_total', 'Webhook calls answered with a fallback reply',
+               lambda: app.timeouts, kind='counter')
+REGISTRY.gauge('webhook_rejected_total', 'Webhook calls that never got a handler slot',
+               lambda: app.rejected, kind='counter')
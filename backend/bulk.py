@@ -0,0 +1,58 @@
+"""
+Top matches for many users in one pass over the candidates
+
+find_top_matches scans the whole pool once per user. Here the users'
+profiles are encoded as one query batch and scored against the pool a
+tile (QUERY_TILE queries x CANDIDATE_TILE candidates) at a time with
+CompatibilityEngine.score_tile, keeping a running top N per query, so
+each candidate column is read once per block of queries and memory is
+bounded by the tile size. Ranking matches find_top_matches exactly
+(without location filtering or approximate search): same rounded
+scores, same tie order, and the user's own profile is never a match.
+"""
+
+import numpy as np
+from typing import Iterator, List, Tuple
+from matching import CompatibilityEngine
+from models import UserProfile, CompatibilityScore, CompactProfile
+from precompute import QUERY_TILE, CANDIDATE_TILE, rank_keys, unpack_keys, merge_top_k, rounded_scores, compact_columns
+
+def rank_many(engine: CompatibilityEngine, users: List[UserProfile], candidates,
+              top_n: int = 5) -> Iterator[Tuple[UserProfile, List[CompatibilityScore]]]:
+    """
+    Yield (user, ranked matches) for every user, in order
+    
+    Candidates are anything find_top_matches accepts. Results for a
+    block of QUERY_TILE users are yielded as soon as the block is done.
+    Raises ValueError if a user's profile can't be encoded.
+    """
+    segments = engine.as_batches(candidates)
+    offsets = np.cumsum([0] + [len(segment) for segment in segments])
+    top_n = max(top_n, 0)
+    for start in range(0, len(users), QUERY_TILE):
+        block = users[start:start + QUERY_TILE]
+        queries = compact_columns([CompactProfile.from_profile(user) for user in block])
+        best = np.full((len(block), top_n), -1, dtype=np.int64)
+        if top_n:
+            for segment, offset in zip(segments, offsets):
+                for tile_start in range(0, len(segment), CANDIDATE_TILE):
+                    rows = np.arange(tile_start, min(len(segment), tile_start + CANDIDATE_TILE))
+                    keys = rank_keys(rounded_scores(engine, queries, segment.take_columns(rows)), rows[None, :] + offset)
+                    eligible = np.stack([segment.eligible_mask(user.user_id, rows) for user in block])
+                    best = merge_top_k(best, np.where(eligible, keys, -1), top_n)
+        ranked_rows, _ = unpack_keys(-np.sort(-best, axis=1))
+        for user, rows in zip(block, ranked_rows):
+            yield user, _scores_for_rows(engine, user, segments, offsets, rows[rows >= 0])
+
+def _scores_for_rows(engine: CompatibilityEngine, user: UserProfile, segments, offsets: np.ndarray,
+                     rows: np.ndarray) -> List[CompatibilityScore]:
+    """CompatibilityScores of a user against logical candidate rows, in the given order"""
+    segment_of = np.searchsorted(offsets, rows, side='right') - 1
+    matches = [None] * len(rows)
+    for index in np.unique(segment_of):
+        positions = np.flatnonzero(segment_of == index)
+        segment, local_rows = segments[index], rows[positions] - offsets[index]
+        scores = engine.score_batch(user, segment.take_columns(local_rows))
+        for i, (position, row) in enumerate(zip(positions, local_rows)):
+            matches[position] = engine._score_from_batch(user.user_id, segment.user_ids[row], scores, i)
+    return matches
@@ -0,0 +1,66 @@
+"""
+Per-session cache of ranked match lists
+
+Lets follow-up intents (explain, see more, asking again) reuse the
+ranking computed for a session instead of scoring the pool again.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional
+from models import CompatibilityScore
+
+class MatchCache:
+    """
+    LRU cache of ranked matches with a time-to-live
+    
+    Holds one entry per session, tagged with the version it was computed
+    for (profile version, pool generation). A lookup with any other
+    version is a miss and drops the entry, so edits to the user's profile
+    or to the candidate pool invalidate it without explicit bookkeeping.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        """Create an empty cache holding up to max_entries sessions for ttl seconds each"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # session_id -> (version, expiry time, matches)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, session_id: str, version: Hashable) -> Optional[List[CompatibilityScore]]:
+        """Cached matches for a session at this version, or None"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] != version or entry[1] < self._clock():
+                if entry is not None:
+                    del self._entries[session_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[2]
+    
+    def put(self, session_id: str, version: Hashable, matches: List[CompatibilityScore]):
+        """Store a session's matches, evicting the least recently used sessions if full"""
+        with self._lock:
+            self._entries[session_id] = (version, self._clock() + self.ttl, matches)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, session_id: str):
+        """Drop a session's cached matches"""
+        with self._lock:
+            self._entries.pop(session_id, None)
+    
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
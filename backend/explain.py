@@ -6,19 +6,79 @@ class ExplainabilityEngine:
     Critical for trust-building in family planning contexts
     """
     
+    # Overall score thresholds used by the assessment and next steps
+    OVERALL_THRESHOLDS = (0.8, 0.7, 0.65, 0.5)
+    
+    def __init__(self):
+        """Initialize the engine with an empty explanation table"""
+        # Explanation text for each combination of score bands, filled in on
+        # first use. Only the numeric scores in the breakdown vary within
+        # a combination.
+        self._templates = {}
+    
     def explain_match(self, score: CompatibilityScore) -> dict:
         """Generate detailed explanation for a compatibility match"""
+        key = self._band_key(score)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates.setdefault(key, self._build_template(score))
+        overall_assessment, strengths, considerations, interpretations, next_steps = template
         
+        # Fresh lists and dicts, so callers can't alter the shared template
         explanation = {
-            'overall_assessment': self._get_overall_assessment(score.overall_score),
-            'strengths': self._identify_strengths(score),
-            'considerations': self._identify_considerations(score),
-            'detailed_breakdown': self._create_detailed_breakdown(score),
-            'next_steps': self._suggest_next_steps(score)
+            'overall_assessment': overall_assessment,
+            'strengths': list(strengths),
+            'considerations': list(considerations),
+            'detailed_breakdown': {
+                'values_compatibility': {
+                    'score': score.values_score,
+                    'interpretation': interpretations[0]
+                },
+                'family_goals_alignment': {
+                    'score': score.goals_score,
+                    'interpretation': interpretations[1]
+                },
+                'communication_compatibility': {
+                    'score': score.communication_score,
+                    'interpretation': interpretations[2]
+                },
+                'timeline_alignment': {
+                    'score': score.timeline_score,
+                    'interpretation': interpretations[3]
+                }
+            },
+            'next_steps': list(next_steps)
         }
         
         return explanation
     
+    def _band_key(self, score: CompatibilityScore) -> tuple:
+        """
+        Everything the explanation text depends on
+        
+        The band (high/medium/low) of each dimension, the overall band,
+        and, when no dimension is high but one is medium, which dimension
+        scores best (it becomes the fallback strength).
+        """
+        dimensions = (score.values_score, score.goals_score, score.communication_score, score.timeline_score)
+        bands = tuple(0 if value >= 0.7 else 1 if value >= 0.5 else 2 for value in dimensions)
+        overall_band = sum(score.overall_score >= threshold for threshold in self.OVERALL_THRESHOLDS)
+        best_area = dimensions.index(max(dimensions)) if 0 not in bands and 1 in bands else None
+        return bands + (overall_band, best_area)
+    
+    def _build_template(self, score: CompatibilityScore) -> tuple:
+        """Explanation text for the band combination of this score"""
+        return (
+            self._get_overall_assessment(score.overall_score),
+            tuple(self._identify_strengths(score)),
+            tuple(self._identify_considerations(score)),
+            (self._interpret_score(score.values_score, 'values'),
+             self._interpret_score(score.goals_score, 'goals'),
+             self._interpret_score(score.communication_score, 'communication'),
+             self._interpret_score(score.timeline_score, 'timeline')),
+            tuple(self._suggest_next_steps(score))
+        )
+    
     def _get_overall_assessment(self, score: float) -> str:
         """Provide overall compatibility assessment"""
         if score >= 0.8:
@@ -84,27 +144,6 @@ class ExplainabilityEngine:
         
         return considerations
     
-    def _create_detailed_breakdown(self, score: CompatibilityScore) -> dict:
-        """Create detailed breakdown of each compatibility dimension"""
-        return {
-            'values_compatibility': {
-                'score': score.values_score,
-                'interpretation': self._interpret_score(score.values_score, 'values')
-            },
-            'family_goals_alignment': {
-                'score': score.goals_score,
-                'interpretation': self._interpret_score(score.goals_score, 'goals')
-            },
-            'communication_compatibility': {
-                'score': score.communication_score,
-                'interpretation': self._interpret_score(score.communication_score, 'communication')
-            },
-            'timeline_alignment': {
-                'score': score.timeline_score,
-                'interpretation': self._interpret_score(score.timeline_score, 'timeline')
-            }
-        }
-    
     def _interpret_score(self, score: float, dimension: str) -> str:
         """Interpret individual dimension scores"""
         interpretations = {
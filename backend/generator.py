@@ -0,0 +1,270 @@
+"""
+Synthetic profile generator for load testing
+
+Profiles are sampled with NumPy straight into the pool's column layout,
+a chunk at a time:
+
+    values      Ratings correlated through the values compatibility
+                matrix (data/values_matrix.csv): a profile that rates
+                family_first highly tends to rate shared_parenting highly
+                too. Latent normals are cut into a skewed 1-5 scale, and a
+                few values are left unrated.
+    goals       One or more family goals with realistic co-occurrence
+                (adoption with blended families, single parent support
+                with co-parenting), at least one per profile.
+    styles      Weighted choice of communication style.
+    timelines   Weighted choice of timeline; ages depend on it.
+    locations   location_count cities with Zipf-like popularity, so a
+                few large cities hold most profiles.
+
+Chunks can be built into a CandidatePool, or streamed to JSON lines
+(UserProfile.to_dict shape, for the import path) or to a ProfileStore
+directory that PROFILE_STORE_DIR and precompute.py open directly. Memory
+is bounded by the chunk size, so 10M profiles can be written on a laptop:
+
+    python generator.py 10000000 profiles.jsonl --format jsonl
+    python generator.py 10000000 store/ --format store --locations 5000
+
+The same seed, settings and chunk size always give the same profiles.
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from statistics import NormalDist
+from typing import Iterator
+from matching import load_values_kernel
+from models import SurveyData, GOAL_VOCABULARY, STYLE_VOCABULARY, TIMELINE_VOCABULARY, decode_goals
+from pool import CandidatePool
+from storage import COLUMN_DTYPES, INDEX_DTYPE, id_hash, _encode_lines
+
+CHUNK_SIZE = 100000
+
+# Share of ratings 1-5 among rated values (people rate most values as important)
+RATING_WEIGHTS = [0.04, 0.09, 0.22, 0.33, 0.32]
+
+# Share of profiles holding each family goal, in FAMILY_GOALS order
+GOAL_RATES = [0.55, 0.25, 0.15, 0.10, 0.12, 0.35]
+
+# Latent correlation between family goals, in FAMILY_GOALS order
+GOAL_CORRELATION = [
+    [1.0, -0.3, -0.1, -0.2, -0.1, 0.3],
+    [-0.3, 1.0, 0.4, 0.2, 0.1, 0.0],
+    [-0.1, 0.4, 1.0, 0.3, 0.4, 0.1],
+    [-0.2, 0.2, 0.3, 1.0, 0.5, 0.0],
+    [-0.1, 0.1, 0.4, 0.5, 1.0, 0.0],
+    [0.3, 0.0, 0.1, 0.0, 0.0, 1.0],
+]
+
+STYLE_WEIGHTS = [0.25, 0.25, 0.15, 0.15, 0.20]              # COMMUNICATION_STYLES order
+TIMELINE_WEIGHTS = [0.15, 0.30, 0.20, 0.10, 0.25]           # TIMELINES order
+TIMELINE_AGES = [34.0, 31.0, 29.0, 27.0, 31.0]              # Mean age for each timeline
+AGE_SPREAD = 4.5
+AGE_RANGE = (21, 55)
+
+FIRST_NAMES = ['Alex', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn', 'Harper',
+               'Rowan', 'Elliot', 'Sam', 'Charlie', 'Dana', 'Robin', 'Skyler', 'Reese', 'Emerson', 'Finley']
+
+def nearest_correlation(matrix: np.ndarray) -> np.ndarray:
+    """A valid correlation matrix near a symmetric one (negative eigenvalues clipped, unit diagonal)"""
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    fixed = (eigenvectors * np.maximum(eigenvalues, 1e-3)) @ eigenvectors.T
+    scale = 1 / np.sqrt(np.diag(fixed))
+    return fixed * scale[:, None] * scale[None, :]
+
+def thresholds(weights) -> np.ndarray:
+    """Cut points that split a standard normal into categories with the given shares"""
+    cumulative = np.cumsum(weights) / np.sum(weights)
+    return np.array([NormalDist().inv_cdf(share) for share in cumulative[:-1]])
+
+class ProfileGenerator:
+    """
+    Seeded, vectorized sampler of synthetic profiles in column form
+    
+    value_correlation scales how strongly the values matrix couples
+    ratings (0 gives independent ratings). location_skew is the Zipf
+    exponent of city popularity (0 gives uniform cities).
+    """
+    
+    def __init__(self, seed: int = 0, location_count: int = 200, location_skew: float = 1.0,
+                 value_correlation: float = 0.6, unrated_rate: float = 0.05, id_prefix: str = 'synthetic'):
+        """Precompute the sampling tables; no profiles are drawn until asked for"""
+        if location_count < 1:
+            raise ValueError("location_count must be at least 1")
+        self.seed = seed
+        self.unrated_rate = unrated_rate
+        self.id_prefix = id_prefix
+        
+        kernel = load_values_kernel()
+        identity = np.eye(len(kernel))
+        self._values_factor = np.linalg.cholesky(nearest_correlation(identity + value_correlation * (kernel - identity)))
+        self._rating_cuts = thresholds(RATING_WEIGHTS)
+        self._goals_factor = np.linalg.cholesky(nearest_correlation(np.array(GOAL_CORRELATION)))
+        self._goal_cuts = np.array([NormalDist().inv_cdf(1 - rate) for rate in GOAL_RATES])
+        
+        popularity = 1 / np.arange(1, location_count + 1) ** location_skew
+        self._location_weights = popularity / popularity.sum()
+        self.location_labels = [f'City {code}, ST' for code in range(location_count)]
+        
+        self._first_names = np.array(FIRST_NAMES, dtype=object)
+        # Label lookups used when writing JSON lines
+        self._styles = np.array(SurveyData.COMMUNICATION_STYLES, dtype=object)
+        self._timelines = np.array(SurveyData.TIMELINES, dtype=object)
+        self._goal_lists = [decode_goals(mask) for mask in range(1 << len(SurveyData.FAMILY_GOALS))]
+    
+    def columns(self, start: int, count: int, rng: np.random.Generator) -> dict:
+        """Columns for rows start..start+count-1, as passed to CandidatePool.from_columns"""
+        latent = rng.standard_normal((count, len(SurveyData.CORE_VALUES))) @ self._values_factor.T
+        values = (np.searchsorted(self._rating_cuts, latent) + 1).astype(np.int8)
+        values[rng.random(values.shape) < self.unrated_rate] = 0
+        
+        latent = rng.standard_normal((count, len(GOAL_RATES))) @ self._goals_factor.T
+        chosen = latent > self._goal_cuts
+        # Everyone has at least one goal: give goal-less profiles their strongest leaning
+        none = ~chosen.any(axis=1)
+        chosen[none, np.argmax(latent[none] - self._goal_cuts, axis=1)] = True
+        goals = (chosen.astype(np.uint64) << np.arange(len(GOAL_RATES), dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+        
+        timelines = rng.choice(len(TIMELINE_WEIGHTS), size=count, p=np.array(TIMELINE_WEIGHTS) / sum(TIMELINE_WEIGHTS))
+        ages = np.clip(np.rint(np.array(TIMELINE_AGES)[timelines] + AGE_SPREAD * rng.standard_normal(count)),
+                       *AGE_RANGE)
+        
+        rows = np.arange(start, start + count)
+        return {
+            'user_ids': np.array([f'{self.id_prefix}-{row}' for row in rows], dtype=object),
+            'names': self._first_names[rows % len(self._first_names)] + ' ' + rows.astype(str).astype(object),
+            'preferences': np.full(count, None, dtype=object),
+            'values': values,
+            'goals': goals,
+            'styles': rng.choice(len(STYLE_WEIGHTS), size=count,
+                                 p=np.array(STYLE_WEIGHTS) / sum(STYLE_WEIGHTS)).astype(np.uint8),
+            'timelines': timelines.astype(np.uint8),
+            'ages': ages.astype(np.int16),
+            'locations': rng.choice(len(self._location_weights), size=count, p=self._location_weights).astype(np.int32),
+        }
+    
+    def chunks(self, total: int, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+        """Yield the columns of `total` profiles, chunk_size rows at a time"""
+        rng = np.random.default_rng(self.seed)
+        for start in range(0, total, chunk_size):
+            yield self.columns(start, min(chunk_size, total - start), rng)
+    
+    def pool(self, size: int) -> CandidatePool:
+        """A pool of `size` profiles, generated as a single chunk"""
+        columns = self.columns(0, size, np.random.default_rng(self.seed))  # Same rows as chunks(size, size)
+        return CandidatePool.from_columns(location_labels=self.location_labels, **columns)
+    
+    def profile_dicts(self, columns: dict) -> Iterator[dict]:
+        """Rows of a chunk in UserProfile.to_dict shape"""
+        core_values = SurveyData.CORE_VALUES
+        locations = np.array(self.location_labels, dtype=object)[columns['locations']]
+        styles = self._styles[columns['styles']]
+        timelines = self._timelines[columns['timelines']]
+        for row, ratings in enumerate(columns['values'].tolist()):
+            yield {
+                'user_id': columns['user_ids'][row],
+                'name': columns['names'][row],
+                'age': int(columns['ages'][row]),
+                'location': locations[row],
+                'values': {value: rating for value, rating in zip(core_values, ratings) if rating},
+                'preferences': {},
+                'communication_style': styles[row],
+                'family_goals': self._goal_lists[int(columns['goals'][row])],
+                'timeline': timelines[row]
+            }
+    
+    def write_jsonl(self, path: str, total: int, chunk_size: int = CHUNK_SIZE) -> int:
+        """Write `total` profiles to path as JSON lines; returns the count"""
+        with open(path, 'w') as f:
+            for columns in self.chunks(total, chunk_size):
+                f.writelines(json.dumps(profile) + '\n' for profile in self.profile_dicts(columns))
+        return total
+    
+    def write_store(self, directory: str, total: int, chunk_size: int = CHUNK_SIZE) -> int:
+        """
+        Write `total` profiles as a new ProfileStore in directory
+        
+        Columns are appended to the snapshot files chunk by chunk. The id
+        index is written unsorted and then sorted in place through a
+        memory map, so it never has to fit in memory either.
+        """
+        if os.path.exists(os.path.join(directory, 'CURRENT')):
+            raise ValueError(f"{directory} already holds a profile store")
+        name = 'snap-000001'
+        path = os.path.join(directory, name)
+        os.makedirs(path, exist_ok=True)
+        
+        files = {column: open(os.path.join(path, column + '.bin'), 'wb') for column in COLUMN_DTYPES}
+        for column in ('user_ids', 'names', 'index'):
+            files[column] = open(os.path.join(path, column + ('.bin' if column == 'index' else '.txt')), 'wb')
+        offsets = {column: open(os.path.join(path, column + '.off'), 'wb') for column in ('user_ids', 'names')}
+        line_start = {'user_ids': 0, 'names': 0}
+        try:
+            for start, columns in zip(range(0, total, chunk_size), self.chunks(total, chunk_size)):
+                for column, dtype in COLUMN_DTYPES.items():
+                    files[column].write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+                for column in ('user_ids', 'names'):
+                    data, line_offsets = _encode_lines(columns[column])
+                    files[column].write(b'\n' + data if start else data)  # Newline-separated, none at the end
+                    offsets[column].write((line_offsets[:-1] + line_start[column]).tobytes())
+                    line_start[column] += int(line_offsets[-1])
+                
+                index = np.zeros(len(columns['user_ids']), dtype=INDEX_DTYPE)
+                index['hash'] = [id_hash(user_id) for user_id in columns['user_ids']]
+                index['row'] = np.arange(start, start + len(index))
+                files['index'].write(index.tobytes())
+            for column in ('user_ids', 'names'):
+                offsets[column].write(np.array([line_start[column]], dtype='<i8').tobytes())
+        finally:
+            for f in list(files.values()) + list(offsets.values()):
+                f.close()
+        
+        if total:
+            index = np.memmap(os.path.join(path, 'index.bin'), dtype=INDEX_DTYPE, mode='r+')
+            index.sort(order=['hash', 'row'])
+            index.flush()
+            del index
+        
+        data, _ = _encode_lines(self.location_labels)
+        with open(os.path.join(path, 'locations.txt'), 'wb') as f:
+            f.write(data)
+        with open(os.path.join(path, 'preferences.json'), 'w') as f:
+            f.write('{}')
+        open(os.path.join(path, 'writes.log'), 'wb').close()
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                'rows': total,
+                'location_count': len(self.location_labels),
+                'vocabularies': {
+                    'goals': list(GOAL_VOCABULARY.labels),
+                    'styles': list(STYLE_VOCABULARY.labels),
+                    'timelines': list(TIMELINE_VOCABULARY.labels)
+                }
+            }, f)
+        with open(os.path.join(directory, 'CURRENT'), 'w') as f:
+            f.write(name)
+        return total
+
+def main():
+    """Generate profiles from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('count', type=int, help='Number of profiles')
+    parser.add_argument('output', help='JSON lines file, or ProfileStore directory with --format store')
+    parser.add_argument('--format', default='jsonl', choices=('jsonl', 'store'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--locations', type=int, default=200, help='Number of distinct cities')
+    parser.add_argument('--location-skew', type=float, default=1.0, help='Zipf exponent of city popularity')
+    parser.add_argument('--value-correlation', type=float, default=0.6)
+    args = parser.parse_args()
+    
+    generator = ProfileGenerator(args.seed, args.locations, args.location_skew, args.value_correlation)
+    started = time.perf_counter()
+    write = generator.write_store if args.format == 'store' else generator.write_jsonl
+    count = write(args.output, args.count, args.chunk_size)
+    print(f"Wrote {count} profiles to {args.output} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# Gunicorn configuration for multi-process serving
+# Start with: cd backend && gunicorn -c gunicorn.conf.py app:app
+#
+# Workers share one memory-mapped candidate pool through the profile store
+# (see shared.py); profile writes are serialized by the store's writer lock.
+
+import multiprocessing
+import os
+import tempfile
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 5000))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Set before workers fork so every worker attaches to the same store
+os.environ.setdefault('PROFILE_STORE_DIR', os.path.join(tempfile.gettempdir(), 'chatbot-profile-store'))
+os.environ['SHARED_POOL'] = '1'
+
+# Each worker maps the store itself after forking
+preload_app = False
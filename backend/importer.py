@@ -0,0 +1,277 @@
+"""
+Streaming bulk import of existing member profiles
+
+Reads JSON lines (UserProfile.to_dict shape, as written by generator.py)
+or CSV, a chunk at a time, validates every row against the SurveyData
+options and the constraints in data/sample_survey.json (age range,
+rating scale), and encodes the valid rows straight into pool columns
+with CandidatePool.extend; no UserProfile is built per row. Rejected
+rows are counted and reported with their row number and reason.
+
+CSV files have one column per basic field and core value, with family
+goals separated by '|':
+
+    user_id,name,age,location,family_first,...,spiritual_connection,communication_style,family_goals,timeline
+    u1,Alex,31,"Chicago, IL",4,...,2,collaborative_consensus,biological_children|adoption,1_to_3_years
+
+An empty value column means the value is unrated. An optional
+preferences column holds a JSON object.
+
+    python importer.py members.jsonl --store $PROFILE_STORE_DIR --rejects rejects.jsonl
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+from models import SurveyData, GOAL_VOCABULARY, STYLE_VOCABULARY, TIMELINE_VOCABULARY
+from pool import CandidatePool
+from storage import ProfileStore
+
+SURVEY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'sample_survey.json')
+
+CHUNK_SIZE = 50000
+MAX_REPORTED = 1000     # Rejected rows kept in an ImportReport (all are counted)
+
+BASIC_FIELDS = ['user_id', 'name', 'location']
+CHOICE_FIELDS = ['communication_style', 'timeline']
+
+def load_constraints(path: str = SURVEY_PATH) -> dict:
+    """Age range and rating scale from the survey definition"""
+    with open(path) as f:
+        questions = json.load(f)['survey_questions']
+    age = next(question for question in questions['basic_info'] if question['id'] == 'age')
+    scales = {tuple(question['scale']) for question in questions['values']}
+    if len(scales) != 1:
+        raise ValueError(f"{path}: every value question must use the same scale")
+    return {'age': (age['min'], age['max']), 'scale': scales.pop()}
+
+def _missing(value) -> bool:
+    """Whether a cell is empty (None, or NaN where a chunk has no value)"""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+@dataclass
+class ImportReport:
+    """Outcome of an import"""
+    imported: int = 0           # Rows added to (or replaced in) the pool
+    rejected: int = 0           # Rows that failed validation
+    rejections: List[dict] = field(default_factory=list)   # First MAX_REPORTED rejected rows: row, user_id, reason
+    seconds: float = 0.0
+    
+    def to_dict(self):
+        return {'imported': self.imported, 'rejected': self.rejected,
+                'rejections': self.rejections, 'seconds': round(self.seconds, 3)}
+
+class ProfileImporter:
+    """
+    Validates and encodes chunks of profile rows into pool columns
+    
+    Chunks are DataFrames with a 'row' column (1-based record number in
+    the file), the basic fields, one column per core value and the
+    choice fields; an 'error' column marks rows that already failed to
+    parse.
+    """
+    
+    def __init__(self, constraints: Optional[dict] = None):
+        """Use the survey's constraints unless others are given"""
+        constraints = constraints or load_constraints()
+        self.age_range = constraints['age']
+        self.scale = np.array(constraints['scale'])
+        self._codes = {
+            'communication_style': {label: STYLE_VOCABULARY.lookup(label) for label in SurveyData.COMMUNICATION_STYLES},
+            'timeline': {label: TIMELINE_VOCABULARY.lookup(label) for label in SurveyData.TIMELINES},
+        }
+        self._goal_bits = {label: 1 << GOAL_VOCABULARY.lookup(label) for label in SurveyData.FAMILY_GOALS}
+        self._goal_masks = {}   # Goals as read (string or tuple) -> bitmask, or None if invalid
+    
+    def read_jsonl(self, path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yield chunks of a JSON lines file; blank lines are skipped"""
+        core_values = set(SurveyData.CORE_VALUES)
+        with open(path, 'rb') as f:
+            numbered = ((number, line) for number, line in enumerate(f, 1) if line.strip())
+            while True:
+                lines = list(itertools.islice(numbered, chunk_size))
+                if not lines:
+                    return
+                records = []
+                for number, line in lines:
+                    try:
+                        record = json.loads(line)
+                        values = record.pop('values', None) or {}
+                        unknown = set(values) - core_values
+                        record.update(values)
+                        if unknown:
+                            record['error'] = f"unknown value {sorted(unknown)[0]!r}"
+                    except (ValueError, TypeError, AttributeError):
+                        record = {'error': 'not a JSON object'}
+                    record['row'] = number
+                    records.append(record)
+                yield pd.DataFrame.from_records(records)
+    
+    def read_csv(self, path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yield chunks of a CSV file"""
+        text_columns = {name: str for name in BASIC_FIELDS + CHOICE_FIELDS + ['family_goals', 'preferences']}
+        rows = 0
+        for frame in pd.read_csv(path, chunksize=chunk_size, dtype=text_columns, keep_default_na=False,
+                                 na_values={value: [''] for value in SurveyData.CORE_VALUES + ['age']}):
+            frame['row'] = np.arange(rows + 1, rows + len(frame) + 1)
+            rows += len(frame)
+            if 'preferences' in frame:
+                frame['preferences'] = [json.loads(text) if text else None for text in frame['preferences']]
+            yield frame
+    
+    def encode(self, frame: pd.DataFrame) -> Tuple[dict, List[dict]]:
+        """
+        Columns for CandidatePool.extend from a chunk's valid rows
+        
+        Returns the columns and the rejected rows as {row, user_id, reason}.
+        Each rejected row gets the first problem found.
+        """
+        count = len(frame)
+        reasons = np.full(count, None, dtype=object)
+        rejected = np.zeros(count, dtype=bool)
+        
+        def reject(mask, reason):
+            new = mask & ~rejected
+            reasons[new] = reason
+            rejected[new] = True
+        
+        def column(name):
+            return frame[name] if name in frame else pd.Series([None] * count, index=frame.index, dtype=object)
+        
+        if 'error' in frame:
+            errors = frame['error'].to_numpy(dtype=object)
+            rejected[:] = frame['error'].notna().to_numpy()
+            reasons[rejected] = errors[rejected]
+        
+        strings = {}
+        for name in BASIC_FIELDS:
+            values = column(name)
+            valid = values.map(lambda value: isinstance(value, str) and bool(value.strip())).to_numpy(dtype=bool)
+            reject(~valid, f'missing {name}')
+            strings[name] = values.to_numpy(dtype=object)
+        
+        ages = pd.to_numeric(column('age'), errors='coerce').to_numpy(dtype=np.float64)
+        low, high = self.age_range
+        reject(~((ages >= low) & (ages <= high) & (ages == np.floor(ages))),
+               f'age must be a whole number from {low} to {high}')
+        
+        values = np.zeros((count, len(SurveyData.CORE_VALUES)), dtype=np.int8)
+        for i, name in enumerate(SurveyData.CORE_VALUES):
+            raw = column(name)
+            ratings = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=np.float64)
+            unrated = raw.isna().to_numpy()
+            valid = unrated | np.isin(ratings, self.scale)
+            reject(~valid, f'{name} must be one of {self.scale.tolist()}')
+            values[:, i] = np.where(valid & ~unrated, np.nan_to_num(ratings), 0)
+        
+        codes = {}
+        for name in CHOICE_FIELDS:
+            options = self._codes[name]
+            mapped = column(name).map(lambda value: options.get(value) if isinstance(value, str) else None)
+            reject(mapped.isna().to_numpy(), f'{name} must be one of the survey options')
+            codes[name] = mapped.fillna(0).to_numpy().astype(np.uint8)
+        
+        masks = [self._goal_mask(goals) for goals in column('family_goals').tolist()]
+        reject(np.array([mask is None for mask in masks], dtype=bool), 'family_goals must be survey options')
+        goals = np.array([mask or 0 for mask in masks], dtype=np.uint64)
+        
+        preferences = np.array([None if _missing(prefs) or prefs == {} else prefs
+                                for prefs in column('preferences').tolist()], dtype=object)
+        reject(np.array([prefs is not None and not isinstance(prefs, dict) for prefs in preferences], dtype=bool),
+               'preferences must be an object')
+        
+        accepted = ~rejected
+        columns = {
+            'user_ids': strings['user_id'][accepted],
+            'names': strings['name'][accepted],
+            'preferences': preferences[accepted],
+            'values': values[accepted],
+            'goals': goals[accepted],
+            'styles': codes['communication_style'][accepted],
+            'timelines': codes['timeline'][accepted],
+            'ages': ages[accepted].astype(np.int16),
+            'locations': strings['location'][accepted],
+        }
+        rejections = [{'row': int(row), 'user_id': user_id if isinstance(user_id, str) else None, 'reason': reason}
+                      for row, user_id, reason in zip(column('row').to_numpy()[rejected],
+                                                      strings['user_id'][rejected], reasons[rejected])]
+        return columns, rejections
+    
+    def _goal_mask(self, goals) -> Optional[int]:
+        """Bitmask of a row's family goals: a list, or a '|'-separated string; None if any is unknown"""
+        if _missing(goals):
+            return 0
+        if isinstance(goals, str):
+            key = goals
+        elif isinstance(goals, list) and all(isinstance(label, str) for label in goals):
+            key = tuple(goals)
+        else:
+            return None
+        mask = self._goal_masks.get(key, -1)
+        if mask == -1:
+            labels = [label.strip() for label in key.split('|') if label.strip()] if isinstance(key, str) else key
+            bits = [self._goal_bits.get(label) for label in labels]
+            mask = None if None in bits else sum(set(bits))
+            if len(self._goal_masks) < 4096:
+                self._goal_masks[key] = mask
+        return mask
+    
+    def import_file(self, pool: CandidatePool, path: str, file_format: Optional[str] = None,
+                    chunk_size: int = CHUNK_SIZE, rejects_path: Optional[str] = None) -> ImportReport:
+        """
+        Stream a JSONL or CSV file into the pool; returns the report
+        
+        The format is taken from the file extension unless given. With
+        rejects_path, every rejected row is also written there as JSON
+        lines.
+        """
+        file_format = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        chunks = self.read_csv(path, chunk_size) if file_format == 'csv' else self.read_jsonl(path, chunk_size)
+        report = ImportReport()
+        started = time.perf_counter()
+        rejects = open(rejects_path, 'w') if rejects_path else None
+        try:
+            for frame in chunks:
+                columns, rejections = self.encode(frame)
+                if len(columns['user_ids']):
+                    pool.extend(**columns)
+                report.imported += len(columns['user_ids'])
+                report.rejected += len(rejections)
+                report.rejections += rejections[:MAX_REPORTED - len(report.rejections)]
+                if rejects:
+                    rejects.writelines(json.dumps(rejection) + '\n' for rejection in rejections)
+        finally:
+            if rejects:
+                rejects.close()
+        report.seconds = time.perf_counter() - started
+        return report
+
+def main():
+    """Import a file from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('path', help='JSON lines or CSV file')
+    parser.add_argument('--store', help='ProfileStore directory to import into (checkpointed when done)')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='Default: from the file extension')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--rejects', help='Write every rejected row here as JSON lines')
+    args = parser.parse_args()
+    
+    store = ProfileStore(args.store) if args.store else None
+    pool = store.load() if store else CandidatePool()
+    report = ProfileImporter().import_file(pool, args.path, args.format, args.chunk_size, args.rejects)
+    if store:
+        store.checkpoint(pool)
+    print(f"Imported {report.imported} profiles, rejected {report.rejected}, "
+          f"in {report.seconds:.1f}s ({report.imported / max(report.seconds, 1e-9) * 60:,.0f} rows/minute)")
+    for rejection in report.rejections[:20]:
+        print(f"  row {rejection['row']} ({rejection['user_id']}): {rejection['reason']}")
+
+if __name__ == '__main__':
+    main()
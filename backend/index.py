@@ -0,0 +1,109 @@
+"""
+Inverted index over candidate rows for pre-filtering match searches
+
+Groups candidate rows by timeline bucket, by each family goal bit and by
+normalized location. CompatibilityEngine uses it to bound the best score
+a whole group of candidates could reach, and skips groups that cannot
+enter the top N before doing any full scoring.
+"""
+
+import numpy as np
+from typing import Dict, List
+from models import SurveyData, CompactProfile
+
+def normalize_location(location: str) -> str:
+    """City part of a location, case-folded with whitespace collapsed ("Seattle, WA" -> "seattle")"""
+    return ' '.join(str(location).split(',')[0].casefold().split())
+
+def location_ids(vocabulary, location: str) -> List[int]:
+    """Location ids in a vocabulary that normalize to the same city as `location`"""
+    key = normalize_location(location)
+    return [code for code, label in enumerate(vocabulary.labels) if normalize_location(label) == key]
+
+class Postings:
+    """Growable array of row numbers for one index key"""
+
+    def __init__(self, rows: np.ndarray = None):
+        self._rows = np.asarray(rows if rows is not None else np.zeros(16), dtype=np.int32)
+        self._count = len(rows) if rows is not None else 0
+
+    def append(self, row: int):
+        if self._count == len(self._rows):
+            grown = np.zeros(max(16, 2 * len(self._rows)), dtype=np.int32)
+            grown[:self._count] = self._rows
+            self._rows = grown
+        self._rows[self._count] = row
+        self._count += 1
+
+    def rows(self, limit: int) -> np.ndarray:
+        """Rows below `limit` (rows appended after a view was taken are left out)"""
+        rows = self._rows[:self._count]
+        return rows[rows < limit] if self._count and rows[-1] >= limit else rows
+
+class CandidateIndex:
+    """
+    Inverted index from timeline bucket, goal bit and city to candidate rows
+
+    Timeline codes outside SurveyData share one sentinel bucket. Rows are
+    only ever added, so callers intersect results with their alive mask;
+    a pool rebuilds its index when it compacts.
+    """
+
+    TIMELINE_BUCKETS = len(SurveyData.TIMELINES) + 1   # Known timelines plus the sentinel
+
+    def __init__(self):
+        self.timeline_rows = [Postings() for _ in range(self.TIMELINE_BUCKETS)]
+        self.goal_rows: Dict[int, Postings] = {}        # Goal bit -> rows with that goal
+        self.no_goal_rows = Postings()                  # Rows with no goals at all
+        self.location_rows: Dict[str, Postings] = {}    # Normalized city -> rows
+
+    @classmethod
+    def build(cls, batch) -> 'CandidateIndex':
+        """Index a batch's existing columns in one vectorized pass per key"""
+        index = cls()
+        timelines, goals, locations = batch.timelines, batch.goals, batch.locations
+        location_labels = batch.location_vocabulary.labels
+        buckets = np.minimum(timelines, cls.TIMELINE_BUCKETS - 1)
+        for bucket in range(cls.TIMELINE_BUCKETS):
+            index.timeline_rows[bucket] = Postings(np.flatnonzero(buckets == bucket))
+
+        index.no_goal_rows = Postings(np.flatnonzero(goals == 0))
+        present = np.bitwise_or.reduce(goals) if len(goals) else 0
+        for bit in range(64):
+            if int(present) >> bit & 1:
+                index.goal_rows[bit] = Postings(np.flatnonzero(goals & np.uint64(1 << bit)))
+
+        # Group rows by city: map location ids to city codes, then split a stable sort
+        cities = list(dict.fromkeys(normalize_location(label) for label in location_labels))
+        city_code = {city: code for code, city in enumerate(cities)}
+        row_cities = np.array([city_code[normalize_location(label)] for label in location_labels],
+                              dtype=np.int32)[locations] if len(location_labels) else np.zeros(0, dtype=np.int32)
+        order = np.argsort(row_cities, kind='stable')
+        boundaries = np.flatnonzero(np.diff(row_cities[order])) + 1
+        for group in np.split(order, boundaries) if len(order) else []:
+            index.location_rows[cities[row_cities[group[0]]]] = Postings(group)
+        return index
+
+    def add(self, row: int, compact: CompactProfile):
+        """Index one appended row"""
+        self.timeline_rows[min(compact.timeline, self.TIMELINE_BUCKETS - 1)].append(row)
+        if not compact.goals:
+            self.no_goal_rows.append(row)
+        for bit in range(compact.goals.bit_length()):
+            if compact.goals >> bit & 1:
+                self.goal_rows.setdefault(bit, Postings()).append(row)
+        self.location_rows.setdefault(normalize_location(compact.location), Postings()).append(row)
+
+    def rows_sharing_goals(self, goals: int, limit: int) -> np.ndarray:
+        """Rows with at least one goal in the `goals` bitmask"""
+        postings = [self.goal_rows[bit].rows(limit) for bit in range(goals.bit_length())
+                    if goals >> bit & 1 and bit in self.goal_rows]
+        return np.unique(np.concatenate(postings)) if postings else np.zeros(0, dtype=np.int32)
+
+    def location_mask(self, location: str, limit: int) -> np.ndarray:
+        """Boolean mask of rows in the same city as `location`"""
+        mask = np.zeros(limit, dtype=bool)
+        postings = self.location_rows.get(normalize_location(location))
+        if postings is not None:
+            mask[postings.rows(limit)] = True
+        return mask
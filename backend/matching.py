@@ -6,10 +6,243 @@ between users based on values, goals, communication styles, and timelines.
 Uses weighted scoring for explainable AI recommendations.
 """
 
+import itertools
+import os
 import numpy as np
 import pandas as pd
-from typing import List, Tuple
-from models import UserProfile, CompatibilityScore
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from models import (UserProfile, CompatibilityScore, SurveyData, GOAL_VOCABULARY, STYLE_VOCABULARY,
+                    TIMELINE_VOCABULARY, VALUE_INDEX, Vocabulary, encode_values, encode_goals, label_extras)
+from index import CandidateIndex, normalize_location
+from ann import ValueIndex
+
+# Value-to-value affinity matrix used by the 'cross' values mode
+VALUES_MATRIX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'values_matrix.csv')
+
+@lru_cache(maxsize=None)
+def load_values_kernel(path: str = VALUES_MATRIX_PATH) -> np.ndarray:
+    """
+    Load the values compatibility matrix as a read-only 8 x 8 array
+    
+    Rows and columns are reordered to CORE_VALUES order. Raises
+    ValueError unless the file covers exactly the core values with a
+    symmetric matrix of scores between 0 and 1. Cached per path.
+    """
+    frame = pd.read_csv(path, comment='#', index_col=0)
+    core_values = SurveyData.CORE_VALUES
+    if sorted(frame.index) != sorted(core_values) or sorted(frame.columns) != sorted(core_values):
+        raise ValueError(f"{path} must have one row and one column per core value")
+    
+    kernel = frame.loc[core_values, core_values].to_numpy(dtype=np.float64)
+    if np.isnan(kernel).any() or (kernel < 0).any() or (kernel > 1).any():
+        raise ValueError(f"{path} scores must be numbers between 0 and 1")
+    if not np.allclose(kernel, kernel.T):
+        raise ValueError(f"{path} must be symmetric")
+    kernel.setflags(write=False)
+    return kernel
+
+RATING_MIDPOINT = 3     # Neutral rating; cross mode scores ratings relative to it
+_KERNEL_STEP = 2.0 ** -20
+
+def scoring_kernel(kernel: np.ndarray) -> np.ndarray:
+    """
+    The nearest positive semi-definite matrix to a values kernel, for scoring
+    
+    The shipped matrix has a negative eigenvalue (about -0.135), so some
+    rating vectors would have a negative "norm" under it; those
+    eigenvalues are clipped to zero. Entries are then rounded to
+    multiples of 2**-20, which keeps every product of small integer
+    ratings with the kernel exact in float64: scores come out the same
+    whatever order a matrix product sums in, so pairwise, batch and tile
+    scoring agree to the last bit.
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(kernel)
+    projected = (eigenvectors * np.maximum(eigenvalues, 0.0)) @ eigenvectors.T
+    projected = np.round((projected + projected.T) / 2 / _KERNEL_STEP) * _KERNEL_STEP
+    projected.setflags(write=False)
+    return projected
+
+def _centered(values: np.ndarray) -> np.ndarray:
+    """Ratings relative to the midpoint as float64; unrated (0) counts as neutral"""
+    return np.where(values > 0, values.astype(np.float64) - RATING_MIDPOINT, 0.0)
+
+# Number of set bits in every byte value, used to popcount goal bitmasks
+_POPCOUNT_8 = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+def _popcount(masks: np.ndarray) -> np.ndarray:
+    """Count set bits in each element of a uint64 array"""
+    if hasattr(np, 'bitwise_count'):  # NumPy 2.0+
+        return np.bitwise_count(masks)
+    masks = np.ascontiguousarray(masks)
+    return _POPCOUNT_8[masks.view(np.uint8)].reshape(masks.shape + (8,)).sum(axis=-1)
+
+def _unlisted_goals(extras: dict, count: int) -> Tuple[np.ndarray, dict]:
+    """Each row's number of family goals outside SurveyData, and the rows giving each such goal"""
+    counts = np.zeros(count, dtype=np.int64)
+    rows_by_goal = {}
+    for row, labels in extras.items():
+        for goal in labels.get('family_goals', ()):
+            counts[row] += 1
+            rows_by_goal.setdefault(goal, []).append(row)
+    return counts, rows_by_goal
+
+def _band(score) -> int:
+    """Explanation band of a dimension score: 0 high (>= 0.7), 1 medium (>= 0.5), 2 low"""
+    return 0 if score >= 0.7 else 1 if score >= 0.5 else 2
+
+def _round_scores(scores: np.ndarray, numpy_rounding: np.ndarray) -> np.ndarray:
+    """
+    Round scores to 2 decimals exactly as round() would on each element
+    
+    Rows flagged in numpy_rounding were NumPy scalars in the scalar path and
+    get np.round. The rest were plain floats, whose round() is correctly
+    rounded; np.round only disagrees with it when scores * 100 lands within
+    rounding error of a half, so just those rows are redone exactly.
+    """
+    rounded = np.round(scores, 2)
+    scaled = scores * 100
+    near_half = ~numpy_rounding & (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    if near_half.any():
+        rows = np.flatnonzero(near_half)
+        rounded[rows] = _round_near_half(scores[rows], np.floor(scaled[rows]))
+    return rounded
+
+def _round_near_half(scores: np.ndarray, cents: np.ndarray) -> np.ndarray:
+    """
+    round(score, 2) for scores just around (cents + 0.5) / 100, vectorized
+    
+    round() is correctly rounded, so the result only depends on which
+    side of the midpoint (2 * cents + 1) / 200 the score lies, with exact
+    ties (0.125, 0.375, ...) going to the even cent. The comparison of
+    200 * score with 2 * cents + 1 is made exact: a Veltkamp split gives
+    score = high + low with few enough bits in each part that 25 * high
+    and 25 * low are exact, the difference to the midpoint is exact
+    (Sterbenz), and the final float sum keeps the exact sign.
+    """
+    split = scores * 134217729.0             # 2**27 + 1
+    high = split - (split - scores)
+    low = scores - high
+    side = (25 * high - (2 * cents + 1) / 8) + 25 * low
+    return (cents + np.where(side == 0, cents % 2, side > 0)) / 100
+
+def _select_top(keys: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    Positions of the top_n largest keys, highest first
+    
+    Ties keep their original order, like a stable sort would. Uses a
+    partial partition, so the cost is O(N) plus sorting the survivors.
+    """
+    top_n = max(top_n, 0)
+    if top_n < len(keys):
+        threshold = np.partition(keys, len(keys) - top_n)[len(keys) - top_n] if top_n else np.inf
+        above = np.flatnonzero(keys > threshold)
+        tied = np.flatnonzero(keys == threshold)[:top_n - len(above)]
+        positions = np.concatenate([above, tied])
+    else:
+        positions = np.arange(len(keys))
+    return positions[np.lexsort((positions, -keys[positions]))]
+
+class CandidateBatch:
+    """
+    Candidate profiles encoded once into NumPy arrays for batch scoring
+    
+    Holds an N x 8 int8 value matrix in CORE_VALUES order (0 marks an
+    unrated value), uint64 family goal bitmasks, and communication style
+    and timeline codes from the shared vocabularies in models.py. Rows
+    with answers outside SurveyData also have their label_extras in
+    `extras`, keyed by row.
+    """
+    
+    _indexes = None   # Index class -> index over this batch, built on first use
+    
+    def __init__(self, candidates: List[UserProfile]):
+        """Encode the candidate profiles; raises ValueError if one can't be encoded"""
+        count = len(candidates)
+        self.profiles = list(candidates)   # Original profiles, kept for lookups and fallback
+        self.user_ids = np.array([c.user_id for c in candidates], dtype=object)
+        self.values = np.zeros((count, len(SurveyData.CORE_VALUES)), dtype=np.int8)
+        self.goals = np.zeros(count, dtype=np.uint64)
+        self.styles = np.zeros(count, dtype=np.uint8)
+        self.timelines = np.zeros(count, dtype=np.uint8)
+        self.locations = np.zeros(count, dtype=np.int32)
+        self.location_vocabulary = Vocabulary([])  # Batch-local location ids
+        self.extras = {}                           # Row -> answers outside SurveyData, for rows that have any
+        
+        for row, candidate in enumerate(candidates):
+            self.values[row] = encode_values(candidate.values)
+            self.goals[row] = encode_goals(candidate.family_goals)
+            self.styles[row] = STYLE_VOCABULARY.encode(candidate.communication_style)
+            self.timelines[row] = TIMELINE_VOCABULARY.encode(candidate.timeline)
+            self.locations[row] = self.location_vocabulary.encode(candidate.location)
+            extras = label_extras(candidate)
+            if extras:
+                self.extras[row] = extras
+    
+    def __len__(self):
+        return len(self.user_ids)
+    
+    def eligible_rows(self, user_id: str) -> np.ndarray:
+        """Rows that may be matched with user_id (everyone but that user)"""
+        return np.flatnonzero(self.user_ids != user_id)
+    
+    def eligible_mask(self, user_id: str, rows: np.ndarray) -> np.ndarray:
+        """Which of `rows` may be matched with user_id"""
+        return self.user_ids[rows] != user_id
+    
+    def to_profiles(self) -> List[UserProfile]:
+        """Candidates as UserProfile objects, in row order"""
+        return self.profiles
+    
+    def index(self, index_class):
+        """Index of index_class (CandidateIndex, ValueIndex) over this batch, built on first use"""
+        if self._indexes is None:
+            self._indexes = {}
+        if index_class not in self._indexes:
+            self._indexes[index_class] = index_class.build(self)
+        return self._indexes[index_class]
+    
+    @classmethod
+    def from_arrays(cls, values: np.ndarray, goals: np.ndarray, styles: np.ndarray, timelines: np.ndarray,
+                    extras: Optional[Dict[int, dict]] = None) -> 'CandidateBatch':
+        """Batch of scoring columns only (no ids or profiles), from encoded arrays and rows' extras"""
+        batch = cls.__new__(cls)
+        batch.values = values
+        batch.goals = goals
+        batch.styles = styles
+        batch.timelines = timelines
+        batch.extras = extras or {}
+        return batch
+    
+    def take_columns(self, rows) -> 'CandidateBatch':
+        """Scoring columns for a subset of rows (an index array or slice)"""
+        batch = CandidateBatch.from_arrays(self.values[rows], self.goals[rows], self.styles[rows], self.timelines[rows])
+        if self.extras:
+            original = range(len(self.values))[rows] if isinstance(rows, slice) else np.asarray(rows)
+            batch.extras = {int(i): self.extras[int(original[i])] for i in np.flatnonzero(batch.outside_survey())}
+        return batch
+    
+    def outside_survey(self) -> np.ndarray:
+        """Which rows have an answer outside SurveyData (and so an entry in extras)"""
+        return (((self.goals >> np.uint64(GOAL_VOCABULARY.other_code)) & np.uint64(1)).astype(bool) |
+                (self.styles == STYLE_VOCABULARY.other_code) | (self.timelines == TIMELINE_VOCABULARY.other_code))
+
+@dataclass
+class BatchScores:
+    """
+    Dimension scores for one user against every candidate in a batch
+    
+    Arrays are unrounded and aligned with the batch rows. values_averaged
+    marks rows whose values score came from averaging common ratings
+    (as opposed to the 0.5/0.3 fallbacks).
+    """
+    overall: np.ndarray
+    values: np.ndarray
+    goals: np.ndarray
+    communication: np.ndarray
+    timeline: np.ndarray
+    values_averaged: np.ndarray
 
 class CompatibilityEngine:
     """
@@ -20,8 +253,42 @@ class CompatibilityEngine:
     communication (20%), and timeline (15%).
     """
     
-    def __init__(self):
-        """Initialize the engine with scoring weights"""
+    # Compatible communication style pairs (either order); other mismatches score 0.4
+    COMPATIBLE_STYLE_PAIRS = {
+        ('direct_honest', 'analytical_logical'): 0.8,
+        ('gentle_supportive', 'emotional_expressive'): 0.8,
+        ('collaborative_consensus', 'gentle_supportive'): 0.7,
+        ('direct_honest', 'collaborative_consensus'): 0.6,
+        ('analytical_logical', 'collaborative_consensus'): 0.6
+    }
+    
+    # Segments at least this large are searched through their CandidateIndex
+    PRUNE_MIN_ROWS = 8192
+    # Segments at least this large use approximate search when ann_probes is set
+    ANN_MIN_ROWS = 1000000
+    
+    # How the values dimension is scored: rating distance on shared values,
+    # or affinity across all values through the values_matrix.csv kernel
+    VALUES_MODES = ('aligned', 'cross')
+    
+    def __init__(self, ann_probes: int = 0, values_mode: str = 'aligned'):
+        """
+        Initialize the engine with scoring weights
+        
+        ann_probes > 0 enables approximate search on very large segments:
+        candidates are shortlisted from that many ValueIndex cells nearest
+        the user's values, then ranked with exact scores. Use
+        ann.recall_at_k to pick a value for a deployment.
+        
+        values_mode 'cross' scores values with the kernel from
+        data/values_matrix.csv instead of comparing identical keys only.
+        """
+        if values_mode not in self.VALUES_MODES:
+            raise ValueError(f"values_mode must be one of {self.VALUES_MODES}")
+        self.ann_probes = ann_probes
+        self.values_mode = values_mode
+        self.values_kernel = scoring_kernel(load_values_kernel()) if values_mode == 'cross' else None
+        
         # Weights for different compatibility factors (must sum to 1.0)
         self.weights = {
             'values': 0.35,        # Values alignment weight
@@ -29,6 +296,17 @@ class CompatibilityEngine:
             'communication': 0.20, # Communication style match weight
             'timeline': 0.15       # Timeline alignment weight
         }
+        
+        # Pairwise communication and timeline scores, compiled once into
+        # dense symmetric tables indexed by SurveyData position. The extra
+        # last row/column is the sentinel for labels outside SurveyData.
+        self.communication_table = self._compile_communication_table()
+        self.timeline_table = self._compile_timeline_table()
+        self._communication_rows = self.communication_table.tolist()  # Plain floats for the scalar path
+        self._timeline_rows = self.timeline_table.tolist()
+        self._style_index = {style: i for i, style in enumerate(SurveyData.COMMUNICATION_STYLES)}
+        self._timeline_index = {timeline: i for i, timeline in enumerate(SurveyData.TIMELINES)}
+        self._explanations = self._compile_explanations()  # Band tuple -> explanation text
     
     def calculate_compatibility(self, user1: UserProfile, user2: UserProfile) -> CompatibilityScore:
         """
@@ -37,7 +315,7 @@ class CompatibilityEngine:
         Args:
             user1: First user's profile
             user2: Second user's profile
-            
+        
         Returns:
             CompatibilityScore object with overall score and breakdown
         """
@@ -73,6 +351,8 @@ class CompatibilityEngine:
     
     def _calculate_values_score(self, user1: UserProfile, user2: UserProfile) -> float:
         """Calculate compatibility based on shared values"""
+        if self.values_mode == 'cross':
+            return self._calculate_cross_values_score(user1, user2)
         if not user1.values or not user2.values:
             return 0.5
         
@@ -90,6 +370,16 @@ class CompatibilityEngine:
         
         return np.mean(alignment_scores)
     
+    def _calculate_cross_values_score(self, user1: UserProfile, user2: UserProfile) -> float:
+        """Kernel affinity between two users' ratings across all core values"""
+        vectors = np.zeros((2, len(SurveyData.CORE_VALUES)), dtype=np.int8)
+        for row, user in enumerate((user1, user2)):
+            for value, rating in user.values.items():
+                if value in VALUE_INDEX:
+                    vectors[row, VALUE_INDEX[value]] = rating
+        # Same arithmetic as the batch path, so both round identically
+        return float(self._batch_cross_values_scores(vectors[0], vectors[1:])[0][0])
+    
     def _calculate_goals_score(self, user1: UserProfile, user2: UserProfile) -> float:
         """Calculate compatibility based on family goals"""
         if not user1.family_goals or not user2.family_goals:
@@ -109,86 +399,509 @@ class CompatibilityEngine:
     
     def _calculate_communication_score(self, user1: UserProfile, user2: UserProfile) -> float:
         """Calculate compatibility based on communication styles"""
-        if user1.communication_style == user2.communication_style:
+        style1, style2 = user1.communication_style, user2.communication_style
+        if style1 == style2:
             return 1.0
         
-        # Define compatible communication style pairs
-        compatible_pairs = {
-            ('direct_honest', 'analytical_logical'): 0.8,
-            ('gentle_supportive', 'emotional_expressive'): 0.8,
-            ('collaborative_consensus', 'gentle_supportive'): 0.7,
-            ('direct_honest', 'collaborative_consensus'): 0.6,
-            ('analytical_logical', 'collaborative_consensus'): 0.6
-        }
-        
-        pair = (user1.communication_style, user2.communication_style)
-        reverse_pair = (user2.communication_style, user1.communication_style)
-        
-        return compatible_pairs.get(pair, compatible_pairs.get(reverse_pair, 0.4))
+        sentinel = len(SurveyData.COMMUNICATION_STYLES)
+        return self._communication_rows[self._style_index.get(style1, sentinel)][self._style_index.get(style2, sentinel)]
     
     def _calculate_timeline_score(self, user1: UserProfile, user2: UserProfile) -> float:
         """Calculate compatibility based on family planning timeline"""
-        timeline_order = [
-            "within_1_year",
-            "1_to_3_years", 
-            "3_to_5_years",
-            "5_plus_years",
-            "flexible_timing"
+        sentinel = len(SurveyData.TIMELINES)
+        return self._timeline_rows[self._timeline_index.get(user1.timeline, sentinel)][self._timeline_index.get(user2.timeline, sentinel)]
+    
+    def _compile_communication_table(self) -> np.ndarray:
+        """Communication style scores indexed by style code, plus an unknown-style sentinel"""
+        styles = SurveyData.COMMUNICATION_STYLES
+        table = np.full((len(styles) + 1, len(styles) + 1), 0.4)
+        # Not the sentinel's own cell: two unlisted styles match only if they are the same string
+        known = np.arange(len(styles))
+        table[known, known] = 1.0
+        for (style1, style2), score in self.COMPATIBLE_STYLE_PAIRS.items():
+            table[styles.index(style1), styles.index(style2)] = score
+            table[styles.index(style2), styles.index(style1)] = score
+        return table
+    
+    def _compile_timeline_table(self) -> np.ndarray:
+        """Timeline scores indexed by timeline code, plus an unknown-timeline sentinel"""
+        timelines = SurveyData.TIMELINES
+        table = np.full((len(timelines) + 1, len(timelines) + 1), 0.5)
+        for idx1, timeline1 in enumerate(timelines):
+            for idx2, timeline2 in enumerate(timelines):
+                # Flexible timing is compatible with everything
+                if timeline1 == "flexible_timing" or timeline2 == "flexible_timing":
+                    table[idx1, idx2] = 0.9
+                else:
+                    # Calculate score based on timeline proximity
+                    diff = abs(idx1 - idx2)
+                    table[idx1, idx2] = max(0.2, 1 - (diff * 0.3))
+        return table
+    
+    def _generate_explanation(self, values_score, goals_score, communication_score, timeline_score) -> str:
+        """Generate human-readable explanation of compatibility"""
+        return self._explanations[(
+            _band(values_score), _band(goals_score), _band(communication_score), timeline_score >= 0.7
+        )]
+    
+    def _compile_explanations(self) -> dict:
+        """Explanation for every combination of score bands (3 x 3 x 3 x 2)"""
+        values_phrases = ("Strong alignment on core values", "Moderate values compatibility",
+                          "Different value priorities")
+        goals_phrases = ("highly compatible family goals", "some shared family aspirations",
+                         "different family planning approaches")
+        communication_phrases = ("complementary communication styles", "workable communication differences",
+                                 "potentially challenging communication dynamics")
+        
+        explanations = {}
+        for values_band, goals_band, communication_band in itertools.product(range(3), repeat=3):
+            for timeline_aligned in (True, False):
+                explanations[(values_band, goals_band, communication_band, timeline_aligned)] = "; ".join([
+                    values_phrases[values_band],
+                    goals_phrases[goals_band],
+                    communication_phrases[communication_band],
+                    "aligned timing preferences" if timeline_aligned else "different timeline expectations"
+                ]) + "."
+        return explanations
+    
+    def score_batch(self, user: UserProfile, batch: CandidateBatch) -> BatchScores:
+        """
+        Score one user against every candidate in a batch
+        
+        Computes the same four dimensions as calculate_compatibility in a
+        few vectorized passes. Raises ValueError if the user's profile
+        can't be encoded.
+        """
+        values_scores, values_averaged = self._batch_values_scores(
+            encode_values(user.values), batch.values
+        )
+        goals_scores = self._batch_goals_scores(encode_goals(user.family_goals), batch.goals,
+                                                (label_extras(user) or {}).get('family_goals', ()), batch.extras)
+        communication_scores = self._batch_communication_scores(user.communication_style, batch.styles, batch.extras)
+        timeline_scores = self._batch_timeline_scores(user.timeline, batch.timelines)
+        
+        # Same weighted sum as the scalar path, term by term
+        overall_scores = (
+            values_scores * self.weights['values'] +
+            goals_scores * self.weights['goals'] +
+            communication_scores * self.weights['communication'] +
+            timeline_scores * self.weights['timeline']
+        )
+        
+        return BatchScores(
+            overall=overall_scores,
+            values=values_scores,
+            goals=goals_scores,
+            communication=communication_scores,
+            timeline=timeline_scores,
+            values_averaged=values_averaged
+        )
+    
+    def _batch_values_scores(self, user_values: np.ndarray, value_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Values alignment for every candidate row, plus which rows were averaged"""
+        if self.values_mode == 'cross':
+            return self._batch_cross_values_scores(user_values, value_matrix)
+        count = len(value_matrix)
+        if not user_values.any():
+            return np.full(count, 0.5), np.zeros(count, dtype=bool)
+        
+        rated = value_matrix > 0
+        common = rated & (user_values > 0)
+        common_counts = common.sum(axis=1)
+        
+        # Alignments are multiples of 0.25, so these sums are exact and the
+        # division matches np.mean over the common values
+        diffs = np.abs(value_matrix.astype(np.int16) - user_values.astype(np.int16))
+        alignment_sums = np.where(common, 1 - (diffs / 4), 0.0).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = alignment_sums / common_counts
+        
+        averaged = common_counts > 0
+        scores = np.where(averaged, scores, 0.3)
+        has_values = rated.any(axis=1)
+        return np.where(has_values, scores, 0.5), averaged & has_values
+    
+    def _batch_cross_values_scores(self, user_values: np.ndarray, value_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Kernel affinity of the user's ratings with every row's
+        
+        Ratings are centered on the scale midpoint, so agreeing above or
+        below neutral counts for a pair and disagreeing against it. The
+        cosine u'Kv / sqrt(u'Ku * v'Kv) under the kernel K is mapped from
+        [-1, 1] to [0, 1]. Rows (or users) whose ratings are all neutral
+        or unrated score 0.5, as unrated profiles do in the aligned mode.
+        """
+        scores = self._cross_values_tile(user_values[None, :], value_matrix)[0]
+        return scores, np.zeros(len(value_matrix), dtype=bool)
+    
+    def _cross_values_tile(self, query_values: np.ndarray, candidate_values: np.ndarray) -> np.ndarray:
+        """Cross-mode values scores, queries x candidates, as Q K C' over centered ratings"""
+        kernel = self.values_kernel
+        queries, candidates = _centered(query_values), _centered(candidate_values)
+        projected = queries @ kernel
+        affinity = projected @ candidates.T
+        query_norms = (projected * queries).sum(axis=1)
+        candidate_norms = ((candidates @ kernel) * candidates).sum(axis=1)
+        norms = query_norms[:, None] * candidate_norms[None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = np.clip(affinity / np.sqrt(norms), -1.0, 1.0)
+        return np.where(norms > 0, (cosine + 1) / 2, 0.5)
+    
+    def _batch_goals_scores(self, user_goals: int, goal_masks: np.ndarray, user_unlisted=(),
+                            extras: dict = None) -> np.ndarray:
+        """
+        Jaccard overlap of family goals for every candidate row
+        
+        SurveyData goals are counted from the bitmasks. Goals outside it
+        only set the shared other bit, so they are counted as the strings
+        kept in the user's user_unlisted and the rows' extras.
+        """
+        if not user_goals:
+            return np.full(len(goal_masks), 0.5)
+        
+        known = ~(np.uint64(1) << np.uint64(GOAL_VOCABULARY.other_code))
+        user_mask = np.uint64(user_goals) & known
+        overlap = _popcount(goal_masks & known & user_mask).astype(np.int64)
+        total_unique = _popcount((goal_masks & known) | user_mask).astype(np.int64) + len(user_unlisted)
+        if extras:
+            counts, rows_by_goal = _unlisted_goals(extras, len(goal_masks))
+            total_unique = total_unique + counts
+            for goal in user_unlisted:
+                rows = rows_by_goal.get(goal)
+                if rows:
+                    overlap[rows] += 1
+                    total_unique[rows] -= 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(goal_masks == 0, 0.5, overlap / total_unique)
+    
+    def _batch_communication_scores(self, style: str, style_codes: np.ndarray, extras: dict = None) -> np.ndarray:
+        """
+        Communication scores for every candidate row via the compiled table
+        
+        An unlisted style scores 0.4 against the sentinel column, except
+        for rows whose own style (kept in extras) is the same string.
+        """
+        sentinel = len(SurveyData.COMMUNICATION_STYLES)
+        code = self._style_index.get(style, sentinel)
+        scores = self.communication_table[code, np.minimum(style_codes, sentinel)]
+        if code == sentinel and extras:
+            same = [row for row, labels in extras.items() if labels.get('communication_style') == style]
+            scores[same] = 1.0
+        return scores
+    
+    def _batch_timeline_scores(self, timeline: str, timeline_codes: np.ndarray) -> np.ndarray:
+        """Timeline scores for every candidate row via the compiled table"""
+        sentinel = len(SurveyData.TIMELINES)
+        return self.timeline_table[
+            self._timeline_index.get(timeline, sentinel), np.minimum(timeline_codes, sentinel)
         ]
+    
+    def score_tile(self, queries: CandidateBatch, candidates: CandidateBatch) -> BatchScores:
+        """
+        Score every query row against every candidate row
         
+        Queries are encoded rows (e.g. a pool's own rows, via
+        take_columns); the returned arrays are queries x candidates, and
+        each row equals what score_batch gives for that query's profile.
+        Memory grows with the tile area, so callers bound both sides.
+        """
+        if self.values_mode == 'cross':
+            values_scores = self._cross_values_tile(queries.values, candidates.values)
+            values_averaged = np.zeros(values_scores.shape, dtype=bool)
+        else:
+            values_scores, values_averaged = self._tile_values_scores(queries.values, candidates.values)
+        
+        # As in _batch_goals_scores: bitmasks for SurveyData goals, extras for the rest
+        query_goals, candidate_goals = queries.goals[:, None], candidates.goals[None, :]
+        known = ~(np.uint64(1) << np.uint64(GOAL_VOCABULARY.other_code))
+        overlap = _popcount(query_goals & candidate_goals & known).astype(np.int64)
+        total_unique = _popcount((query_goals | candidate_goals) & known).astype(np.int64)
+        if queries.extras or candidates.extras:
+            query_counts, _ = _unlisted_goals(queries.extras, len(queries.goals))
+            candidate_counts, rows_by_goal = _unlisted_goals(candidates.extras, len(candidates.goals))
+            total_unique += query_counts[:, None] + candidate_counts[None, :]
+            for query, labels in queries.extras.items():
+                for goal in labels.get('family_goals', ()):
+                    rows = rows_by_goal.get(goal)
+                    if rows:
+                        overlap[query, rows] += 1
+                        total_unique[query, rows] -= 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            goals_scores = np.where((query_goals == 0) | (candidate_goals == 0), 0.5, overlap / total_unique)
+        
+        # Same table lookups as the batch path
+        style_sentinel = len(SurveyData.COMMUNICATION_STYLES)
+        communication_scores = self.communication_table[
+            np.minimum(queries.styles, style_sentinel)[:, None],
+            np.minimum(candidates.styles, style_sentinel)[None, :]
+        ]
+        if queries.extras and candidates.extras:
+            self._match_unlisted_styles(communication_scores, queries.extras, candidates.extras)
+        timeline_sentinel = len(SurveyData.TIMELINES)
+        timeline_scores = self.timeline_table[
+            np.minimum(queries.timelines, timeline_sentinel)[:, None],
+            np.minimum(candidates.timelines, timeline_sentinel)[None, :]
+        ]
+        
+        overall_scores = (
+            values_scores * self.weights['values'] +
+            goals_scores * self.weights['goals'] +
+            communication_scores * self.weights['communication'] +
+            timeline_scores * self.weights['timeline']
+        )
+        
+        return BatchScores(
+            overall=overall_scores,
+            values=values_scores,
+            goals=goals_scores,
+            communication=communication_scores,
+            timeline=timeline_scores,
+            values_averaged=values_averaged
+        )
+    
+    def _match_unlisted_styles(self, communication_scores: np.ndarray, query_extras: dict, candidate_extras: dict):
+        """Score 1.0 in a tile where a query and candidate give the same unlisted style"""
+        rows_by_style = {}
+        for row, labels in candidate_extras.items():
+            if 'communication_style' in labels:
+                rows_by_style.setdefault(labels['communication_style'], []).append(row)
+        for query, labels in query_extras.items():
+            rows = rows_by_style.get(labels.get('communication_style'))
+            if rows:
+                communication_scores[query, rows] = 1.0
+    
+    def _tile_values_scores(self, query_values: np.ndarray, value_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Values alignment for every query x candidate pair, as in _batch_values_scores"""
+        shape = (len(query_values), len(value_matrix))
+        common_counts = np.zeros(shape, dtype=np.int16)
+        diff_sums = np.zeros(shape, dtype=np.int16)
+        
+        # One 2-D pass per value keeps temporaries at tile size; integer
+        # sums make count - diffs / 4 the exact sum of alignments
+        for value in range(value_matrix.shape[1]):
+            query_column = query_values[:, value, None].astype(np.int16)
+            column = value_matrix[None, :, value].astype(np.int16)
+            common = (query_column > 0) & (column > 0)
+            common_counts += common
+            diff_sums += np.abs(column - query_column) * common
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (common_counts - diff_sums / 4) / common_counts
+        
+        averaged = common_counts > 0
+        scores = np.where(averaged, scores, 0.3)
+        has_values = (value_matrix > 0).any(axis=1)[None, :] & (query_values > 0).any(axis=1)[:, None]
+        return np.where(has_values, scores, 0.5), averaged & has_values
+    
+    def _score_from_batch(self, user_id: str, user2_id: str, scores: BatchScores, row: int) -> CompatibilityScore:
+        """Build the CompatibilityScore for one row of a BatchScores"""
+        values_score = scores.values[row]
+        overall_score = scores.overall[row]
+        if not scores.values_averaged[row]:
+            # The scalar path only produces NumPy scalars (and so NumPy
+            # rounding) when it averages values; mirror that exactly
+            values_score = float(values_score)
+            overall_score = float(overall_score)
+        goals_score = float(scores.goals[row])
+        communication_score = float(scores.communication[row])
+        timeline_score = float(scores.timeline[row])
+        
+        explanation = self._generate_explanation(
+            values_score, goals_score, communication_score, timeline_score
+        )
+        
+        return CompatibilityScore(
+            user1_id=user_id,
+            user2_id=user2_id,
+            overall_score=round(overall_score, 2),
+            values_score=round(values_score, 2),
+            goals_score=round(goals_score, 2),
+            communication_score=round(communication_score, 2),
+            timeline_score=round(timeline_score, 2),
+            explanation=explanation
+        )
+    
+    def as_batches(self, candidates) -> List[CandidateBatch]:
+        """
+        Resolve candidates to the CandidateBatch segments to score
+        
+        Accepts a batch as-is, uses the segments or snapshot of pools that
+        provide them (SharedPool, CandidatePool), and encodes plain
+        profile lists. Segments are ordered as one logical row sequence.
+        """
+        if isinstance(candidates, CandidateBatch):
+            return [candidates]
+        if hasattr(candidates, 'segments'):
+            return candidates.segments()
+        if hasattr(candidates, 'snapshot'):
+            return [candidates.snapshot()]
+        return [CandidateBatch(candidates)]
+    
+    def find_top_matches(self, user: UserProfile, candidates, top_n=5, location: str = None) -> List[CompatibilityScore]:
+        """
+        Find top N compatible matches for a user
+        
+        Candidates may be a list of profiles, a CandidateBatch encoded
+        ahead of time, or a candidate pool. Lists are encoded on the fly;
+        profiles the batch encoding can't represent fall back to pairwise
+        scoring. If location is given, only candidates in the same city
+        are considered.
+        """
         try:
-            idx1 = timeline_order.index(user1.timeline)
-            idx2 = timeline_order.index(user2.timeline)
-            
-            # Flexible timing is compatible with everything
-            if user1.timeline == "flexible_timing" or user2.timeline == "flexible_timing":
-                return 0.9
-            
-            # Calculate score based on timeline proximity
-            diff = abs(idx1 - idx2)
-            return max(0.2, 1 - (diff * 0.3))
-            
+            batches = self.as_batches(candidates)
         except ValueError:
-            return 0.5
+            return self._find_top_matches_pairwise(user, candidates, top_n, location)
+        
+        try:
+            ranked = self._rank_segments(user, batches, top_n, location)
+        except ValueError:
+            profiles = [profile for batch in batches for profile in batch.to_profiles()]
+            return self._find_top_matches_pairwise(user, profiles, top_n, location)
+        
+        return [
+            self._score_from_batch(user.user_id, user2_id, scores, row)
+            for _, user2_id, scores, row in ranked
+        ]
     
-    def _generate_explanation(self, values_score, goals_score, communication_score, timeline_score) -> str:
-        """Generate human-readable explanation of compatibility"""
-        explanations = []
+    def rank_batch(self, user: UserProfile, batch: CandidateBatch, scores: BatchScores, top_n=5) -> np.ndarray:
+        """
+        Batch rows of the user's top N matches, best first
         
-        if values_score >= 0.7:
-            explanations.append("Strong alignment on core values")
-        elif values_score >= 0.5:
-            explanations.append("Moderate values compatibility") 
-        else:
-            explanations.append("Different value priorities")
+        Only overall scores are ranked; callers build CompatibilityScore
+        objects (and explanations) for the returned rows alone.
+        """
+        eligible = batch.eligible_rows(user.user_id)
+        keys = _round_scores(scores.overall[eligible], scores.values_averaged[eligible])
+        return eligible[_select_top(keys, top_n)]
+    
+    def _rank_segments(self, user: UserProfile, batches: List[CandidateBatch], top_n=5,
+                       location: str = None) -> List[Tuple[float, str, BatchScores, int]]:
+        """Rank each segment, then merge the per-segment top N (earlier segments win ties)"""
+        if len(batches) == 1:
+            return self._rank_segment(user, batches[0], top_n, location)
         
-        if goals_score >= 0.7:
-            explanations.append("highly compatible family goals")
-        elif goals_score >= 0.5:
-            explanations.append("some shared family aspirations")
-        else:
-            explanations.append("different family planning approaches")
+        ranked = [match for batch in batches for match in self._rank_segment(user, batch, top_n, location)]
         
-        if communication_score >= 0.7:
-            explanations.append("complementary communication styles")
-        elif communication_score >= 0.5:
-            explanations.append("workable communication differences")
-        else:
-            explanations.append("potentially challenging communication dynamics")
+        # Candidates arrive segment by segment in rank order, so a stable
+        # sort on the key alone keeps row order within ties
+        order = np.argsort([-match[0] for match in ranked], kind='stable')
+        return [ranked[i] for i in order[:max(top_n, 0)]]
+    
+    def _rank_segment(self, user: UserProfile, batch: CandidateBatch, top_n=5,
+                      location: str = None) -> List[Tuple[float, str, BatchScores, int]]:
+        """Top N of one segment as (rounded score, candidate id, scores, row), best first"""
+        if self.ann_probes > 0 and len(batch) >= self.ANN_MIN_ROWS and user.values:
+            return self._rank_approximate(user, batch, top_n, location)
+        if location is None and len(batch) < self.PRUNE_MIN_ROWS:
+            scores = self.score_batch(user, batch)
+            rows = self.rank_batch(user, batch, scores, top_n)
+            keys = _round_scores(scores.overall[rows], scores.values_averaged[rows])
+            return [(key, batch.user_ids[row], scores, row) for key, row in zip(keys, rows)]
+        return self._rank_pruned(user, batch, top_n, location)
+    
+    def _rank_pruned(self, user: UserProfile, batch: CandidateBatch, top_n=5,
+                     location: str = None) -> List[Tuple[float, str, BatchScores, int]]:
+        """
+        Top N of one segment, skipping candidate groups that can't make it
+        
+        The batch's CandidateIndex splits eligible rows into groups by
+        timeline bucket and by whether their goals overlap the user's.
+        Within a group the timeline score is fixed and the goals score is
+        capped (0 with no shared goal), so each group has an upper bound on
+        its overall score. Groups are scored best bound first, and the rest
+        are skipped once their bound rounds below the current N-th score.
+        Results are identical to scoring every row.
+        """
+        index = batch.index(CandidateIndex)
+        count = len(batch)
+        eligible = np.zeros(count, dtype=bool)
+        eligible[batch.eligible_rows(user.user_id)] = True
+        if location is not None:
+            eligible &= index.location_mask(location, count)
         
-        if timeline_score >= 0.7:
-            explanations.append("aligned timing preferences")
+        # Goal class per row: 0 no shared goal, 1 either side has none (0.5), 2 shared goal
+        user_goals = encode_goals(user.family_goals)
+        if user_goals:
+            goal_class = np.zeros(count, dtype=np.int8)
+            goal_class[index.no_goal_rows.rows(count)] = 1
+            goal_class[index.rows_sharing_goals(user_goals, count)] = 2
         else:
-            explanations.append("different timeline expectations")
+            goal_class = np.ones(count, dtype=np.int8)
+        
+        sentinel = len(SurveyData.TIMELINES)
+        timeline_row = self.timeline_table[self._timeline_index.get(user.timeline, sentinel)]
+        fixed_bound = (
+            (1.0 if encode_values(user.values).any() else 0.5) * self.weights['values'] +
+            1.0 * self.weights['communication']
+        )
+        groups = []
+        for bucket, postings in enumerate(index.timeline_rows):
+            rows = postings.rows(count)
+            rows = rows[eligible[rows]]
+            classes = goal_class[rows]
+            for goals_class, goals_bound in enumerate((0.0, 0.5, 1.0)):
+                group = rows[classes == goals_class]
+                if len(group):
+                    bound = (fixed_bound + goals_bound * self.weights['goals'] +
+                             timeline_row[bucket] * self.weights['timeline'])
+                    groups.append((bound, group))
+        groups.sort(key=lambda group: -group[0])
+        
+        scored, positions, keys = [], [], []
+        threshold = -1    # N-th best rounded score so far, in hundredths
+        for bound, rows in groups:
+            if int(np.ceil(bound * 100 + 1e-6)) < threshold:
+                break
+            scores = self.score_batch(user, batch.take_columns(rows))
+            scored.append((rows, scores))
+            keys.append(_round_scores(scores.overall, scores.values_averaged))
+            positions.append(np.arange(len(rows)))
+            all_keys = np.concatenate(keys)
+            if top_n > 0 and len(all_keys) >= top_n:
+                threshold = int(np.rint(np.partition(all_keys, len(all_keys) - top_n)[len(all_keys) - top_n] * 100))
+        if not scored:
+            return []
+        
+        # Rank over original row order so ties resolve as a full scan would
+        group_of = np.concatenate([np.full(len(rows), i) for i, (rows, _) in enumerate(scored)])
+        rows = np.concatenate([rows for rows, _ in scored])
+        positions = np.concatenate(positions)
+        keys = np.concatenate(keys)
+        order = np.argsort(rows, kind='stable')
+        winners = order[_select_top(keys[order], top_n)]
+        return [
+            (keys[i], batch.user_ids[rows[i]], scored[group_of[i]][1], positions[i])
+            for i in winners
+        ]
+    
+    def _rank_approximate(self, user: UserProfile, batch: CandidateBatch, top_n=5,
+                          location: str = None) -> List[Tuple[float, str, BatchScores, int]]:
+        """
+        Approximate top N of one segment via its ValueIndex
+        
+        Scores only the shortlist from the ann_probes cells nearest the
+        user's value vector, with the full weighted score; candidates
+        outside those cells are missed, so results can differ from an
+        exact search.
+        """
+        count = len(batch)
+        rows = batch.index(ValueIndex).shortlist(encode_values(user.values), self.ann_probes, count)
+        rows = rows[batch.eligible_mask(user.user_id, rows)]
+        if location is not None:
+            rows = rows[batch.index(CandidateIndex).location_mask(location, count)[rows]]
         
-        return "; ".join(explanations) + "."
+        scores = self.score_batch(user, batch.take_columns(rows))
+        keys = _round_scores(scores.overall, scores.values_averaged)
+        return [(keys[i], batch.user_ids[rows[i]], scores, i) for i in _select_top(keys, top_n)]
     
-    def find_top_matches(self, user: UserProfile, candidates: List[UserProfile], top_n=5) -> List[CompatibilityScore]:
-        """Find top N compatible matches for a user"""
+    def _find_top_matches_pairwise(self, user: UserProfile, candidates: List[UserProfile], top_n=5,
+                                   location: str = None) -> List[CompatibilityScore]:
+        """Find top N matches by scoring each candidate individually"""
         scores = []
+        city = normalize_location(location) if location is not None else None
         
         for candidate in candidates:
-            if candidate.user_id != user.user_id:
+            if candidate.user_id != user.user_id and (city is None or normalize_location(candidate.location) == city):
                 score = self.calculate_compatibility(user, candidate)
                 scores.append(score)
         
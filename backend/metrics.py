@@ -0,0 +1,168 @@
+"""
+Latency histograms and gauges in the Prometheus text format
+
+Hot paths are timed by wrapping them once, at import time, with timed()
+or instrument(). Each thread records into its own histogram shard, so
+an observation takes no lock and never contends with other threads; the
+shards are only summed when /metrics is scraped. With METRICS=0 the
+wrappers are never installed and the hot paths run exactly as if this
+module didn't exist. Gauges are read from callbacks at scrape time.
+"""
+
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional
+
+METRICS_ENABLED = os.environ.get('METRICS', '1') != '0'
+
+# Upper bounds (seconds) of the latency buckets; +Inf is implicit
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _label_value(value) -> str:
+    """Escape a label value for the text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """
+    Latency histogram, optionally split by one label
+    
+    Each thread's counts live in its own shard: {label value: [count per
+    bucket, +Inf count, sum of observations]}. Shards of threads that
+    have exited are folded into a retired total when collected, so
+    thread-per-request servers don't leak them.
+    """
+    
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []       # (thread, shard) for every thread that has observed
+        self._retired = {}      # Summed shards of exited threads
+        self._lock = threading.Lock()   # Guards _shards and _retired; never taken by observe() after a thread's first call
+    
+    def _new_shard(self) -> dict:
+        shard = self._local.shard = {}
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+    
+    def observe(self, seconds: float, label_value: str = ''):
+        """Record one duration"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        counts = shard.get(label_value)
+        if counts is None:
+            counts = shard[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+    
+    def collect(self) -> Dict[str, list]:
+        """Counts summed over every thread, by label value"""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _add_counts(self._retired, shard)
+            self._shards = live
+            totals = {}
+            _add_counts(totals, self._retired)
+            for _, shard in live:
+                _add_counts(totals, shard)
+        return totals
+    
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_value, counts in sorted(self.collect().items()):
+            prefix = f'{self.label}="{_label_value(label_value)}",' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            labels = '{' + prefix.rstrip(',') + '}' if prefix else ''
+            lines.append(f'{self.name}_sum{labels} {_number(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+def _add_counts(totals: dict, shard: dict):
+    """Add a shard's counts into totals"""
+    for label_value, counts in list(shard.items()):  # list() copies atomically while the owner writes
+        counts = list(counts)
+        if label_value in totals:
+            totals[label_value] = [a + b for a, b in zip(totals[label_value], counts)]
+        else:
+            totals[label_value] = counts
+
+class Registry:
+    """The metrics served at /metrics"""
+    
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = []
+        self._values = []   # (name, help, type, label, callback)
+    
+    def histogram(self, name: str, help_text: str, label: Optional[str] = None, buckets=DEFAULT_BUCKETS) -> Histogram:
+        """Register a latency histogram"""
+        histogram = Histogram(name, help_text, label, buckets)
+        self._histograms.append(histogram)
+        return histogram
+    
+    def gauge(self, name: str, help_text: str, callback: Callable, label: Optional[str] = None, kind: str = 'gauge'):
+        """
+        Register a value read from callback at scrape time
+        
+        With a label, callback returns {label value: number}. Use
+        kind='counter' for values that only ever increase.
+        """
+        self._values.append((name, help_text, kind, label, callback))
+    
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, help_text, kind, label, callback in self._values:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            value = callback()
+            if label:
+                lines += [f'{name}{{{label}="{_label_value(key)}"}} {_number(item)}' for key, item in value.items()]
+            else:
+                lines.append(f'{name} {_number(value)}')
+        for histogram in self._histograms:
+            lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def timed(histogram: Histogram, label_value: str = '', registry: Registry = REGISTRY):
+    """Decorator recording each call's duration; returns the function untouched when metrics are disabled"""
+    def decorate(function):
+        if not registry.enabled:
+            return function
+        observe, clock = histogram.observe, time.perf_counter
+        
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(clock() - started, label_value)
+        return wrapper
+    return decorate
+
+def instrument(obj, method: str, histogram: Histogram, label_value: str = '', registry: Registry = REGISTRY):
+    """Time one object's method (e.g. an engine instance), leaving its class and other instances alone"""
+    if registry.enabled:
+        setattr(obj, method, timed(histogram, label_value, registry)(getattr(obj, method)))
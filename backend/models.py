@@ -8,6 +8,9 @@ used throughout the matching and explanation system.
 from dataclasses import dataclass
 from typing import List, Dict, Optional, Any
 import json
+import sys
+import threading
+import numpy as np
 
 @dataclass
 class UserProfile:
@@ -110,3 +113,181 @@ class SurveyData:
         "5_plus_years",     # Long-term planning (5+ years)
         "flexible_timing"   # Open to various timelines
     ]
+
+
+class Vocabulary:
+    """
+    Interns category labels as small integer codes
+    
+    Codes 0..n-1 are the known labels in SurveyData order. An open
+    vocabulary appends any other label on first use. A closed one encodes
+    every other label as the one reserved code n (other_code) and never
+    grows, so callers keep such labels themselves (see CompactProfile.extras).
+    """
+    
+    def __init__(self, known: List[str], closed: bool = False):
+        """Seed the vocabulary with the known labels"""
+        self.labels = list(known)                 # Code -> label
+        self.known_count = len(self.labels)       # Codes below this are SurveyData labels
+        self.other_code = self.known_count if closed else None  # Code of every unknown label, if closed
+        self._codes = {label: code for code, label in enumerate(self.labels)}
+        self._lock = threading.Lock()
+    
+    def encode(self, label: str) -> int:
+        """Return the code for a label: interned if new, or other_code if the vocabulary is closed"""
+        code = self._codes.get(label)
+        if code is None:
+            if self.other_code is not None:
+                return self.other_code
+            with self._lock:
+                code = self._codes.get(label)
+                if code is None:
+                    code = len(self.labels)
+                    self.labels.append(label)
+                    self._codes[label] = code
+        return code
+    
+    def lookup(self, label: str) -> Optional[int]:
+        """Return the code for a label without interning it (None if unknown)"""
+        return self._codes.get(label)
+    
+    def decode(self, code: int) -> str:
+        """Return the label for a code (not other_code, which stands for many)"""
+        return self.labels[code]
+
+
+# Shared vocabularies used to encode profiles for batch scoring. They are
+# closed: answers outside SurveyData share each vocabulary's other_code
+GOAL_VOCABULARY = Vocabulary(SurveyData.FAMILY_GOALS, closed=True)       # Bit positions in a uint64 mask
+STYLE_VOCABULARY = Vocabulary(SurveyData.COMMUNICATION_STYLES, closed=True)
+TIMELINE_VOCABULARY = Vocabulary(SurveyData.TIMELINES, closed=True)
+
+# Column of each core value in encoded value vectors
+VALUE_INDEX = {value: index for index, value in enumerate(SurveyData.CORE_VALUES)}
+
+def encode_values(values: Dict[str, int]) -> np.ndarray:
+    """
+    Encode a values dict as an int8 vector in CORE_VALUES order
+    
+    0 marks an unrated value. Raises ValueError for keys outside
+    CORE_VALUES or ratings that don't fit the encoding.
+    """
+    vector = np.zeros(len(SurveyData.CORE_VALUES), dtype=np.int8)
+    for value, rating in values.items():
+        if value not in VALUE_INDEX:
+            raise ValueError(f"Unknown value {value!r}")
+        if int(rating) != rating or not 1 <= rating <= 127:
+            raise ValueError(f"Rating {rating!r} for {value!r} cannot be encoded")
+        vector[VALUE_INDEX[value]] = rating
+    return vector
+
+def encode_goals(goals: List[str]) -> int:
+    """Encode a list of family goals as a bitmask over GOAL_VOCABULARY"""
+    mask = 0
+    for goal in goals:
+        mask |= 1 << GOAL_VOCABULARY.encode(goal)
+    return mask
+
+def decode_goals(mask: int) -> List[str]:
+    """Decode a family goal bitmask back into its SurveyData goals, in vocabulary order"""
+    return [GOAL_VOCABULARY.decode(bit) for bit in range(min(mask.bit_length(), GOAL_VOCABULARY.known_count))
+            if mask >> bit & 1]
+
+def label_extras(profile: UserProfile) -> Optional[Dict[str, Any]]:
+    """
+    A profile's answers outside SurveyData, by field, or None
+    
+    These encode as the closed vocabularies' other_code, so they are kept
+    verbatim alongside the codes: family goals as a list without
+    duplicates, communication style and timeline as strings.
+    """
+    extras = {}
+    if STYLE_VOCABULARY.lookup(profile.communication_style) is None:
+        extras['communication_style'] = profile.communication_style
+    if TIMELINE_VOCABULARY.lookup(profile.timeline) is None:
+        extras['timeline'] = profile.timeline
+    goals = [goal for goal in dict.fromkeys(profile.family_goals) if GOAL_VOCABULARY.lookup(goal) is None]
+    if goals:
+        extras['family_goals'] = goals
+    return extras or None
+
+class CompactProfile:
+    """
+    Memory-compact form of a UserProfile
+    
+    Slotted record with integer-coded fields: values are an int8 vector in
+    CORE_VALUES order packed into bytes (0 = unrated), family goals a
+    bitmask over GOAL_VOCABULARY, and communication style and timeline
+    vocabulary codes. Locations are interned so repeated cities share one
+    string. Answers outside SurveyData encode as the vocabularies'
+    other_code and are kept verbatim in extras (see label_extras).
+    Converts losslessly to and from the UserProfile dict shape; goals
+    come back in vocabulary order without duplicates, which scoring
+    already treats as a set.
+    """
+    
+    __slots__ = ('user_id', 'name', 'age', 'location', 'values', 'goals',
+                 'style', 'timeline', 'preferences', 'extras')
+    
+    def __init__(self, user_id: str, name: str, age: int, location: str, values: bytes,
+                 goals: int, style: int, timeline: int, preferences: Optional[Dict[str, Any]] = None,
+                 extras: Optional[Dict[str, Any]] = None):
+        self.user_id = user_id
+        self.name = name
+        self.age = age
+        self.location = sys.intern(location)
+        self.values = values                # int8 ratings in CORE_VALUES order
+        self.goals = goals                  # Bitmask over GOAL_VOCABULARY
+        self.style = style                  # STYLE_VOCABULARY code
+        self.timeline = timeline            # TIMELINE_VOCABULARY code
+        self.preferences = preferences or None  # Empty preferences aren't stored
+        self.extras = extras or None            # Answers outside SurveyData (label_extras)
+    
+    def value_vector(self) -> np.ndarray:
+        """Values as an int8 vector in CORE_VALUES order (read-only view)"""
+        return np.frombuffer(self.values, dtype=np.int8)
+    
+    @classmethod
+    def from_profile(cls, profile: UserProfile) -> 'CompactProfile':
+        """Encode a UserProfile; raises ValueError if a field can't be encoded"""
+        return cls(
+            user_id=profile.user_id,
+            name=profile.name,
+            age=profile.age,
+            location=profile.location,
+            values=encode_values(profile.values).tobytes(),
+            goals=encode_goals(profile.family_goals),
+            style=STYLE_VOCABULARY.encode(profile.communication_style),
+            timeline=TIMELINE_VOCABULARY.encode(profile.timeline),
+            preferences=profile.preferences,
+            extras=label_extras(profile)
+        )
+    
+    def to_profile(self) -> UserProfile:
+        """Decode back into a UserProfile"""
+        return UserProfile.from_dict(self.to_dict())
+    
+    @classmethod
+    def from_dict(cls, data) -> 'CompactProfile':
+        """Create a CompactProfile from UserProfile dictionary data"""
+        return cls.from_profile(UserProfile.from_dict(data))
+    
+    def to_dict(self):
+        """Convert to the same dictionary shape as UserProfile.to_dict"""
+        extras = self.extras or {}
+        return {
+            'user_id': self.user_id,
+            'name': self.name,
+            'age': self.age,
+            'location': self.location,
+            'values': {
+                value: int(rating)
+                for value, rating in zip(SurveyData.CORE_VALUES, self.values)
+                if rating
+            },
+            'preferences': dict(self.preferences) if self.preferences else {},
+            'communication_style': (extras['communication_style'] if 'communication_style' in extras
+                                    else STYLE_VOCABULARY.decode(self.style)),
+            'family_goals': decode_goals(self.goals) + extras.get('family_goals', []),
+            'timeline': extras['timeline'] if 'timeline' in extras else TIMELINE_VOCABULARY.decode(self.timeline)
+        }
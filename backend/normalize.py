@@ -0,0 +1,113 @@
+"""
+Normalization of Dialogflow entity parameters to survey vocabulary codes
+
+Synonyms for family goals, communication styles and timelines (the
+SurveyData labels themselves, the entity synonyms in the Dialogflow
+agent export and a few legacy keywords) are compiled into one regular
+expression. Extraction runs it once over the entity's own parameter
+field and returns codes in the shared vocabularies (GOAL_VOCABULARY,
+STYLE_VOCABULARY, TIMELINE_VOCABULARY), ready for CompactProfile.
+"""
+
+import json
+import os
+import re
+from typing import Dict, List
+from models import SurveyData, GOAL_VOCABULARY, STYLE_VOCABULARY, TIMELINE_VOCABULARY
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dialogflow_agent', 'agent.json')
+
+# Entity name -> (vocabulary, labels, parameter field holding it)
+ENTITIES = {
+    'family_goals': (GOAL_VOCABULARY, SurveyData.FAMILY_GOALS, 'family-goals'),
+    'communication_style': (STYLE_VOCABULARY, SurveyData.COMMUNICATION_STYLES, 'communication-style'),
+    'timeline': (TIMELINE_VOCABULARY, SurveyData.TIMELINES, 'timeline'),
+}
+
+# Keywords the handlers matched before the agent's synonyms were used
+EXTRA_SYNONYMS = {
+    'timeline': {
+        '1 year': 'within_1_year',
+        '1-3': '1_to_3_years',
+        '3-5': '3_to_5_years',
+        '5+': '5_plus_years',
+    }
+}
+
+def normalize_text(text: str) -> str:
+    """Case-folded text with underscores as spaces and whitespace collapsed"""
+    return ' '.join(str(text).replace('_', ' ').casefold().split())
+
+def load_synonyms(agent_path: str = AGENT_PATH) -> Dict[str, Dict[str, str]]:
+    """
+    Entity name -> {normalized phrase: label}
+    
+    Every label is its own synonym. The agent export is optional: without
+    it only the labels and EXTRA_SYNONYMS are known. Agent entries for
+    values outside SurveyData are ignored.
+    """
+    synonyms = {entity: {normalize_text(label): label for label in labels}
+                for entity, (_, labels, _) in ENTITIES.items()}
+    for entity, extra in EXTRA_SYNONYMS.items():
+        synonyms[entity].update((normalize_text(phrase), label) for phrase, label in extra.items())
+    if os.path.exists(agent_path):
+        with open(agent_path) as f:
+            agent = json.load(f)
+        for entity in agent.get('entities', []):
+            if entity['name'] not in synonyms:
+                continue
+            labels = ENTITIES[entity['name']][1]
+            for entry in entity['entries']:
+                if entry['value'] in labels:
+                    for phrase in [entry['value']] + entry.get('synonyms', []):
+                        synonyms[entity['name']].setdefault(normalize_text(phrase), entry['value'])
+    return synonyms
+
+class EntityNormalizer:
+    """
+    Extracts entity values from parameters with one precompiled pattern
+    
+    Phrases match whole words only, and at any position the longest
+    phrase wins ("within 1 year" over "1 year"). Values come back as
+    vocabulary codes in the order they appear in the text.
+    """
+    
+    def __init__(self, synonyms: Dict[str, Dict[str, str]]):
+        """Compile entity name -> {phrase: label} tables"""
+        self._codes = {}   # Phrase -> {entity name: vocabulary code}
+        for entity, phrases in synonyms.items():
+            vocabulary = ENTITIES[entity][0]
+            for phrase, label in phrases.items():
+                self._codes.setdefault(phrase, {})[entity] = vocabulary.encode(label)
+        alternatives = '|'.join(re.escape(phrase) for phrase in sorted(self._codes, key=len, reverse=True))
+        self._pattern = re.compile(r'(?<![a-z0-9])(?:' + alternatives + r')(?![a-z0-9])')
+    
+    @classmethod
+    def from_agent(cls, agent_path: str = AGENT_PATH) -> 'EntityNormalizer':
+        """Normalizer for the synonyms in a Dialogflow agent export"""
+        return cls(load_synonyms(agent_path))
+    
+    def find(self, entity: str, text: str) -> List[int]:
+        """Codes of an entity's values mentioned in text, in order, without repeats"""
+        found = []
+        for match in self._pattern.finditer(normalize_text(text)):
+            code = self._codes[match.group()].get(entity)
+            if code is not None and code not in found:
+                found.append(code)
+        return found
+    
+    def extract(self, parameters: dict, entity: str) -> List[int]:
+        """
+        Codes of an entity's values in its parameter field
+        
+        The field may hold a string or a list of strings (list entities).
+        Only when the field is missing are the other string parameters
+        searched instead.
+        """
+        field = ENTITIES[entity][2]
+        value = parameters.get(field)
+        if value is None:
+            value = [other for other in parameters.values() if isinstance(other, str)]
+        if isinstance(value, (list, tuple)):
+            value = ' | '.join(str(item) for item in value)
+        return self.find(entity, value)
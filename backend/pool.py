@@ -0,0 +1,377 @@
+"""
+Columnar candidate pool backing the matching engine
+
+Holds every registered profile in NumPy columns (values matrix, goal
+bitmask, style, timeline, age, location id) so CompatibilityEngine can
+score against the whole pool without building per-request objects.
+"""
+
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+from models import UserProfile, CompactProfile, SurveyData, Vocabulary
+from matching import CandidateBatch
+
+class PoolView(CandidateBatch):
+    """
+    Point-in-time view of a CandidatePool's columns
+    
+    Column arrays are shared with the pool, not copied. Appends only
+    write rows past the end of the view and compaction swaps in new
+    arrays, so a view stays consistent while a request scores against it.
+    The live-row mask is the one column the pool writes in place, so the
+    view takes its own copy: removals after the snapshot don't show.
+    """
+    
+    _pool = None   # Pool whose index this view can share, if any
+    
+    def __init__(self, pool: 'CandidatePool'):
+        """Capture the pool's current columns up to its current size"""
+        size = pool._size
+        self.user_ids = pool._user_ids[:size]
+        self.names = pool._names[:size]
+        self.preferences = pool._preferences[:size]
+        self.values = pool._values[:size]
+        self.goals = pool._goals[:size]
+        self.styles = pool._styles[:size]
+        self.timelines = pool._timelines[:size]
+        self.ages = pool._ages[:size]
+        self.locations = pool._locations[:size]
+        self.alive = pool._alive[:size].copy()
+        self.extras = dict(pool._extras)
+        self.location_vocabulary = pool.location_vocabulary
+        self.generation = pool.generation
+        self._row_of = pool._row_of
+        self._pool = pool
+        self._compactions = pool._compactions
+    
+    def eligible_rows(self, user_id: str) -> np.ndarray:
+        """Live rows other than user_id's own"""
+        alive = self.alive.copy()
+        row = self._own_row(user_id)
+        if row is not None:
+            alive[row] = False
+        return np.flatnonzero(alive)
+    
+    def eligible_mask(self, user_id: str, rows: np.ndarray) -> np.ndarray:
+        """Which of `rows` are live and not user_id's own"""
+        mask = self.alive[rows]
+        own = self._own_row(user_id)
+        if own is not None:
+            mask &= rows != own
+        return mask
+    
+    def _own_row(self, user_id: str) -> Optional[int]:
+        """user_id's live row in this view, if any"""
+        row = self._row_of.get(user_id)
+        if row is None or row < len(self.alive):
+            return row
+        # Re-added since the snapshot: its row here is the one the pool tombstoned
+        rows = np.flatnonzero(self.alive & (self.user_ids == user_id))
+        return int(rows[0]) if len(rows) else None
+    
+    def compact_profile(self, row: int) -> CompactProfile:
+        """Decode one row into a CompactProfile"""
+        return CompactProfile(
+            user_id=self.user_ids[row],
+            name=self.names[row],
+            age=int(self.ages[row]),
+            location=self.location_vocabulary.decode(int(self.locations[row])),
+            values=self.values[row].tobytes(),
+            goals=int(self.goals[row]),
+            style=int(self.styles[row]),
+            timeline=int(self.timelines[row]),
+            preferences=self.preferences[row],
+            extras=self.extras.get(row)
+        )
+    
+    def to_profiles(self) -> List[UserProfile]:
+        """Live rows as UserProfile objects, in row order"""
+        return [self.compact_profile(row).to_profile() for row in np.flatnonzero(self.alive)]
+    
+    def index(self, index_class):
+        """
+        The pool's index of index_class while row numbers still match this view
+        
+        Rows appended since the view was taken are filtered out by row
+        number. Once the pool has compacted, the view indexes its own
+        columns instead.
+        """
+        if self._pool is not None:
+            index = self._pool.index(index_class, self._compactions)
+            if index is not None:
+                return index
+            self._pool = None
+        return super().index(index_class)
+
+class CandidatePool:
+    """
+    Columnar in-memory store of candidate profiles
+    
+    Rows are appended in amortized O(1) by doubling column capacity.
+    Removing or replacing a profile tombstones its row; once enough rows
+    are dead the pool compacts itself. Every change bumps `generation` so
+    callers can tell when cached results are stale.
+    """
+    
+    MIN_CAPACITY = 1024          # Rows allocated up front
+    COMPACT_RATIO = 0.25         # Compact once this fraction of rows are tombstones
+    
+    # Column attributes, all indexed by row
+    COLUMNS = ['_user_ids', '_names', '_preferences', '_values', '_goals', '_styles',
+               '_timelines', '_ages', '_locations', '_alive']
+    
+    def __init__(self, capacity: int = MIN_CAPACITY):
+        """Create an empty pool with room for `capacity` rows"""
+        self.location_vocabulary = Vocabulary([])  # Location id -> city string
+        self.generation = 0              # Incremented on every change
+        self._extras = {}                # Row -> label_extras, for rows with answers outside SurveyData
+        self._lock = threading.RLock()
+        self._row_of: Dict[str, int] = {}  # user_id -> live row
+        self._size = 0                   # Rows in use, live or dead
+        self._dead = 0                   # Tombstoned rows
+        self._indexes = {}               # Index class -> index, built on first search and kept up to date
+        self._compactions = 0            # Row renumberings so far
+        self._allocate(max(capacity, 1))
+    
+    @classmethod
+    def from_columns(cls, user_ids: np.ndarray, names: np.ndarray, preferences: np.ndarray,
+                     values: np.ndarray, goals: np.ndarray, styles: np.ndarray, timelines: np.ndarray,
+                     ages: np.ndarray, locations: np.ndarray, location_labels: List[str],
+                     extras: Optional[Dict[int, dict]] = None, row_of=None) -> 'CandidatePool':
+        """
+        Build a pool directly on top of existing column arrays
+        
+        The arrays (memory-mapped ones included) are used as-is rather
+        than copied; the pool only moves to fresh arrays when it next
+        grows or compacts. Codes must already match the shared
+        vocabularies, location ids index into location_labels, and
+        extras holds label_extras by row for rows outside SurveyData.
+        
+        The object columns may also be lazy snapshot columns (see
+        storage.SnapshotColumn), given with a row_of that finds ids
+        without decoding them all; ids must then be unique.
+        """
+        pool = cls.__new__(cls)
+        pool.location_vocabulary = Vocabulary(location_labels)
+        pool.generation = 0
+        pool._extras = dict(extras or {})
+        pool._lock = threading.RLock()
+        pool._user_ids = user_ids
+        pool._names = names
+        pool._preferences = preferences
+        pool._values = values
+        pool._goals = goals
+        pool._styles = styles
+        pool._timelines = timelines
+        pool._ages = ages
+        pool._locations = locations
+        pool._alive = np.ones(len(user_ids), dtype=bool)
+        if row_of is None:
+            row_of = {user_id: row for row, user_id in enumerate(user_ids)}
+        pool._row_of = row_of
+        pool._size = len(user_ids)
+        pool._dead = pool._size - len(pool._row_of)
+        pool._indexes = {}
+        pool._compactions = 0
+        if pool._dead:
+            # Duplicate ids: only the last row for each id is live
+            pool._alive[:] = False
+            pool._alive[list(pool._row_of.values())] = True
+        return pool
+    
+    def _allocate(self, capacity: int):
+        """Allocate empty columns with room for `capacity` rows"""
+        self._user_ids = np.empty(capacity, dtype=object)
+        self._names = np.empty(capacity, dtype=object)
+        self._preferences = np.empty(capacity, dtype=object)
+        self._values = np.zeros((capacity, len(SurveyData.CORE_VALUES)), dtype=np.int8)
+        self._goals = np.zeros(capacity, dtype=np.uint64)
+        self._styles = np.zeros(capacity, dtype=np.uint8)
+        self._timelines = np.zeros(capacity, dtype=np.uint8)
+        self._ages = np.zeros(capacity, dtype=np.int16)
+        self._locations = np.zeros(capacity, dtype=np.int32)
+        self._alive = np.zeros(capacity, dtype=bool)
+    
+    def _resize(self, capacity: int, rows: Optional[np.ndarray] = None):
+        """Move the columns into new arrays, keeping `rows` (default: all in use)"""
+        growing = rows is None
+        if growing:
+            rows = np.arange(self._size)
+        old = {name: getattr(self, name) for name in self.COLUMNS}
+        self._allocate(capacity)
+        for name, column in old.items():
+            if growing and hasattr(column, 'grown'):
+                # Snapshot-backed: its rows keep decoding lazily until a compaction copies them out
+                setattr(self, name, column.grown(capacity))
+            else:
+                getattr(self, name)[:len(rows)] = column[rows]
+    
+    def __len__(self):
+        """Number of live profiles"""
+        return self._size - self._dead
+    
+    def __contains__(self, user_id):
+        return user_id in self._row_of
+    
+    def add(self, profile: UserProfile) -> int:
+        """
+        Add or replace a profile and return its row
+        
+        Raises ValueError (leaving the pool unchanged) if the profile
+        can't be encoded.
+        """
+        return self.add_compact(CompactProfile.from_profile(profile))
+    
+    def add_compact(self, compact: CompactProfile) -> int:
+        """Add or replace an already-encoded profile and return its row"""
+        location_id = self.location_vocabulary.encode(compact.location)
+        with self._lock:
+            self._tombstone(compact.user_id)
+            if self._size == len(self._alive):
+                self._resize(max(self.MIN_CAPACITY, 2 * len(self._alive)))
+            
+            row = self._size
+            self._user_ids[row] = compact.user_id
+            self._names[row] = compact.name
+            self._preferences[row] = compact.preferences
+            self._values[row] = np.frombuffer(compact.values, dtype=np.int8)
+            self._goals[row] = compact.goals
+            self._styles[row] = compact.style
+            self._timelines[row] = compact.timeline
+            self._ages[row] = compact.age
+            self._locations[row] = location_id
+            self._alive[row] = True
+            if compact.extras:
+                self._extras[row] = compact.extras
+            for index in self._indexes.values():
+                index.add(row, compact)
+            
+            self._row_of[compact.user_id] = row
+            self._size += 1
+            self.generation += 1
+            if self._compact_if_sparse():
+                row = self._row_of[compact.user_id]
+            return row
+    
+    def extend(self, user_ids: np.ndarray, names: np.ndarray, preferences: np.ndarray, values: np.ndarray,
+               goals: np.ndarray, styles: np.ndarray, timelines: np.ndarray, ages: np.ndarray,
+               locations: np.ndarray) -> np.ndarray:
+        """
+        Add or replace a chunk of already-encoded profiles; returns their rows
+        
+        Columns are as in from_columns, except that locations holds city
+        strings. Within the chunk, the last row for a user id wins. Search
+        indexes are rebuilt on their next use rather than fed row by row.
+        """
+        count = len(user_ids)
+        labels, inverse = np.unique(np.asarray(locations, dtype=object), return_inverse=True)
+        location_ids = np.array([self.location_vocabulary.encode(label) for label in labels], dtype=np.int32)
+        with self._lock:
+            for user_id in user_ids:
+                self._tombstone(user_id)
+            if self._size + count > len(self._alive):
+                self._resize(max(self.MIN_CAPACITY, 2 * len(self._alive), self._size + count))
+            
+            start, end = self._size, self._size + count
+            self._user_ids[start:end] = user_ids
+            self._names[start:end] = names
+            self._preferences[start:end] = preferences
+            self._values[start:end] = values
+            self._goals[start:end] = goals
+            self._styles[start:end] = styles
+            self._timelines[start:end] = timelines
+            self._ages[start:end] = ages
+            self._locations[start:end] = location_ids[inverse.reshape(-1)] if count else 0
+            self._alive[start:end] = True
+            
+            rows = np.arange(start, end)
+            self._row_of.update(zip(user_ids, rows.tolist()))
+            if len(self._row_of) != len(self) + count:  # Repeated ids: earlier rows are replaced
+                latest = np.array([self._row_of[user_id] for user_id in user_ids])
+                replaced = rows[latest != rows]
+                self._alive[replaced] = False
+                self._dead += len(replaced)
+            
+            self._size = end
+            self._indexes = {}
+            self.generation += 1
+            if self._compact_if_sparse():
+                rows = np.array([self._row_of[user_id] for user_id in user_ids], dtype=np.int64)
+            return rows
+    
+    def remove(self, user_id: str) -> bool:
+        """Tombstone a profile; returns False if it wasn't in the pool"""
+        with self._lock:
+            if not self._tombstone(user_id):
+                return False
+            self.generation += 1
+            self._compact_if_sparse()
+            return True
+    
+    def _compact_if_sparse(self) -> bool:
+        """Compact once more than COMPACT_RATIO of the rows are dead; returns whether it did"""
+        if self._dead > self.COMPACT_RATIO * self._size:
+            self.compact()
+            return True
+        return False
+    
+    def _tombstone(self, user_id: str) -> bool:
+        """Mark a profile's row dead without bumping the generation"""
+        row = self._row_of.pop(user_id, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self._dead += 1
+        return True
+    
+    def compact(self):
+        """Drop tombstoned rows and renumber the live ones"""
+        with self._lock:
+            live_rows = np.flatnonzero(self._alive[:self._size])
+            extras = {int(np.searchsorted(live_rows, row)): labels
+                      for row, labels in self._extras.items() if self._alive[row]}
+            self._resize(max(self.MIN_CAPACITY, 2 * len(live_rows)), live_rows)
+            # Build a new map rather than mutating the one older views hold
+            self._row_of = {user_id: row for row, user_id in enumerate(self._user_ids[:len(live_rows)])}
+            self._size = len(live_rows)
+            self._dead = 0
+            self._extras = extras
+            self._indexes = {}
+            self._compactions += 1
+            self.generation += 1
+    
+    def index(self, index_class, compactions: int):
+        """
+        Index of index_class over the pool's rows, built on first use
+        
+        Indexes provide build(batch) and add(row, compact); appends are
+        fed to every index built so far, while extend() drops them to be
+        rebuilt. Returns None if the pool has compacted since
+        `compactions` was read, as row numbers from before then no
+        longer apply.
+        """
+        with self._lock:
+            if compactions != self._compactions:
+                return None
+            if index_class not in self._indexes:
+                self._indexes[index_class] = index_class.build(PoolView(self))
+            return self._indexes[index_class]
+    
+    def snapshot(self) -> PoolView:
+        """Consistent view of the current columns for scoring"""
+        with self._lock:
+            return PoolView(self)
+    
+    def get(self, user_id: str) -> Optional[UserProfile]:
+        """Return a profile by user id, or None if it isn't in the pool"""
+        compact = self.get_compact(user_id)
+        return compact.to_profile() if compact else None
+    
+    def get_compact(self, user_id: str) -> Optional[CompactProfile]:
+        """Return a profile by user id in compact form, or None"""
+        with self._lock:
+            row = self._row_of.get(user_id)
+            if row is None:
+                return None
+            return self.snapshot().compact_profile(row)
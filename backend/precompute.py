@@ -0,0 +1,462 @@
+"""
+Offline precompute of every profile's top matches
+
+Scores a profile store's pool against itself in tiles of the N x N score
+matrix, keeping only each row's top k, spread over a process pool. The
+result is a directory the webhook opens with RecommendationStore:
+
+    meta.json       Row count, k, and the snapshot that was scored
+    user_ids.txt    One escaped user id per row (same format as storage.py)
+    user_ids.off    int64 start offset of each row's line (plus end)
+    slots.bin       int64 open-addressing hash table of rows (-1 = empty)
+    matches.npy     N x k int32 rows of each row's matches, best first (-1 = none)
+    scores.npy      N x k uint8 overall scores in hundredths
+    values.npy, goals.npy, styles.npy, timelines.npy
+                    The scored columns, so later profiles can be merged in
+    extras.json     Those rows' answers outside SurveyData (see label_extras)
+    merges.log      Profiles merged in (or removed) since the run, one JSON record per line
+
+Usage (e.g. nightly):
+
+    python precompute.py STORE_DIR OUTPUT_DIR --top-k 20 --workers 8
+
+Between runs, RecommendationStore.add_profile merges each newly
+registered profile in with one row of scoring instead of a full rerun,
+and logs it so every worker process merges it too.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from multiprocessing import Pool
+from typing import List, Optional, Tuple
+from matching import CompatibilityEngine, CandidateBatch, _round_scores
+from models import UserProfile, CompactProfile
+from storage import ProfileStore, StringColumn, id_hash, _encode_lines
+
+QUERY_TILE = 128          # Query rows scored together
+CANDIDATE_TILE = 2048     # Candidate rows per tile; a tile's work arrays stay around 20 MB
+TASK_ROWS = 1024          # Query rows handed to a worker process at a time
+ROW_CHUNK = 262144        # Candidates scored per pass when merging in one new profile
+
+SCORED_COLUMNS = ('values', 'goals', 'styles', 'timelines')
+MERGES_LOG = 'merges.log'
+
+# Ranking keys pack the rounded score above the inverted candidate row, so
+# one integer order gives best score first and earlier rows first on ties
+_ROW_BITS = 32
+_ROW_MASK = (1 << _ROW_BITS) - 1
+
+def rank_keys(rounded: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Integer ranking keys for rounded scores of candidate rows"""
+    return (np.rint(rounded * 100).astype(np.int64) << _ROW_BITS) | (_ROW_MASK - rows.astype(np.int64))
+
+def unpack_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Candidate rows (-1 for empty keys) and scores in hundredths from ranking keys"""
+    valid = keys >= 0
+    rows = np.where(valid, _ROW_MASK - (keys & _ROW_MASK), -1).astype(np.int32)
+    cents = np.where(valid, keys >> _ROW_BITS, 0).astype(np.uint8)
+    return rows, cents
+
+def merge_top_k(best: np.ndarray, keys: np.ndarray, top_k: int) -> np.ndarray:
+    """Top k of each row's current best keys and new keys, in no particular order"""
+    merged = np.concatenate([best, keys], axis=1)
+    keep = np.argpartition(merged, merged.shape[1] - top_k, axis=1)[:, -top_k:]
+    return np.take_along_axis(merged, keep, axis=1)
+
+def rounded_scores(engine: CompatibilityEngine, queries: CandidateBatch, candidates: CandidateBatch) -> np.ndarray:
+    """Overall scores of a tile, rounded exactly as find_top_matches rounds them"""
+    scores = engine.score_tile(queries, candidates)
+    return _round_scores(scores.overall.ravel(), scores.values_averaged.ravel()).reshape(scores.overall.shape)
+
+def top_k_keys(engine: CompatibilityEngine, columns: CandidateBatch, query_rows: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Ranking keys of each query row's top k matches among all rows, best first
+    
+    Walks the candidate rows in tiles, merging each tile's keys into a
+    running per-row top k, so memory stays bounded by the tile sizes.
+    A row never matches itself; missing matches are -1.
+    """
+    count = len(columns.values)
+    queries = columns.take_columns(query_rows)
+    best = np.full((len(query_rows), top_k), -1, dtype=np.int64)
+    for start in range(0, count, CANDIDATE_TILE):
+        rows = np.arange(start, min(count, start + CANDIDATE_TILE))
+        keys = rank_keys(rounded_scores(engine, queries, columns.take_columns(slice(start, rows[-1] + 1))), rows[None, :])
+        keys[query_rows[:, None] == rows[None, :]] = -1
+        best = merge_top_k(best, keys, top_k)
+    return -np.sort(-best, axis=1)
+
+# Per-process state for pool workers, set by _init_worker
+_worker = {}
+
+def _init_worker(snapshot: str, values_mode: str, top_k: int):
+    """Map the snapshot's columns once per worker process"""
+    store = ProfileStore(os.path.dirname(snapshot))
+    _, columns = store.map_columns(snapshot)
+    _worker['columns'] = CandidateBatch.from_arrays(columns['values'], columns['goals'],
+                                                    columns['styles'], columns['timelines'],
+                                                    extras=store.read_extras(snapshot))
+    _worker['engine'] = CompatibilityEngine(values_mode=values_mode)
+    _worker['top_k'] = top_k
+
+def _run_task(bounds: Tuple[int, int]) -> Tuple[int, np.ndarray]:
+    """Top k keys for query rows [start, stop), in QUERY_TILE blocks"""
+    start, stop = bounds
+    blocks = [
+        top_k_keys(_worker['engine'], _worker['columns'], np.arange(block, min(stop, block + QUERY_TILE)), _worker['top_k'])
+        for block in range(start, stop, QUERY_TILE)
+    ]
+    return start, np.concatenate(blocks) if blocks else np.zeros((0, _worker['top_k']), dtype=np.int64)
+
+def compact_columns(compacts: List[CompactProfile]) -> CandidateBatch:
+    """Scoring columns for a list of CompactProfiles"""
+    return CandidateBatch.from_arrays(
+        np.array([compact.value_vector() for compact in compacts], dtype=np.int8).reshape(len(compacts), -1),
+        np.array([compact.goals for compact in compacts], dtype=np.uint64),
+        np.array([compact.style for compact in compacts], dtype=np.uint8),
+        np.array([compact.timeline for compact in compacts], dtype=np.uint8),
+        extras={row: compact.extras for row, compact in enumerate(compacts) if compact.extras}
+    )
+
+def _grown(array: np.ndarray, length: int) -> np.ndarray:
+    """Copy of an array padded with zero rows to `length` rows"""
+    grown = np.zeros((length,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+def build_slots(user_ids: List[str]) -> np.ndarray:
+    """Open-addressing (linear probing) table of rows by user id hash, at most half full"""
+    size = 8
+    while size < 2 * len(user_ids):
+        size *= 2
+    mask = size - 1
+    slots = [-1] * size
+    for row, user_id in enumerate(user_ids):
+        slot = id_hash(user_id) & mask
+        while slots[slot] != -1:
+            slot = (slot + 1) & mask
+        slots[slot] = row
+    return np.array(slots, dtype='<i8')
+
+def precompute(store_dir: str, output: str, top_k: int = 20, workers: int = 1, values_mode: str = 'aligned') -> dict:
+    """
+    Write every profile's top k matches from a profile store to `output`
+    
+    Folds any pending write log into a fresh snapshot first, so the
+    result covers every saved profile. The output directory is replaced
+    only once it is complete. Returns the written meta; raises ValueError
+    if top_k is below 1.
+    """
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1")
+    store = ProfileStore(store_dir)
+    with store.locked():
+        snapshot = store.current_snapshot()
+        if snapshot is None or os.path.getsize(os.path.join(snapshot, 'writes.log')):
+            store.checkpoint(store.load())
+            snapshot = store.current_snapshot()
+    
+    meta, columns = store.map_columns(snapshot)
+    rows = meta['rows']
+    user_ids = StringColumn(os.path.join(snapshot, 'user_ids.txt'), os.path.join(snapshot, 'user_ids.off'), rows)
+    user_ids = [user_ids[row] for row in range(rows)]
+    
+    staging = output.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    matches = np.lib.format.open_memmap(os.path.join(staging, 'matches.npy'), mode='w+', dtype='<i4', shape=(rows, top_k))
+    scores = np.lib.format.open_memmap(os.path.join(staging, 'scores.npy'), mode='w+', dtype='u1', shape=(rows, top_k))
+    
+    started = time.time()
+    tasks = [(start, min(rows, start + TASK_ROWS)) for start in range(0, rows, TASK_ROWS)]
+    if workers > 1:
+        with Pool(workers, initializer=_init_worker, initargs=(snapshot, values_mode, top_k)) as pool:
+            results = pool.imap_unordered(_run_task, tasks)
+            for start, keys in results:
+                matches[start:start + len(keys)], scores[start:start + len(keys)] = unpack_keys(keys)
+    else:
+        _init_worker(snapshot, values_mode, top_k)
+        for task in tasks:
+            start, keys = _run_task(task)
+            matches[start:start + len(keys)], scores[start:start + len(keys)] = unpack_keys(keys)
+    matches.flush()
+    scores.flush()
+    del matches, scores
+    for name in SCORED_COLUMNS:
+        np.save(os.path.join(staging, name + '.npy'), columns[name][:rows])
+    with open(os.path.join(staging, 'extras.json'), 'w') as f:
+        json.dump({str(row): extras for row, extras in store.read_extras(snapshot).items()}, f)
+    
+    data, offsets = _encode_lines(user_ids)
+    with open(os.path.join(staging, 'user_ids.txt'), 'wb') as f:
+        f.write(data)
+    offsets.tofile(os.path.join(staging, 'user_ids.off'))
+    build_slots(user_ids).tofile(os.path.join(staging, 'slots.bin'))
+    
+    result = {
+        'rows': rows,
+        'top_k': top_k,
+        'values_mode': values_mode,
+        'snapshot': os.path.basename(snapshot),
+        'seconds': round(time.time() - started, 3)
+    }
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump(result, f)
+    open(os.path.join(staging, MERGES_LOG), 'wb').close()
+    
+    # Swap the finished directory in; readers reopen when meta.json changes
+    retired = output.rstrip(os.sep) + '.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(output):
+        os.replace(output, retired)
+    os.replace(staging, output)
+    shutil.rmtree(retired, ignore_errors=True)
+    return result
+
+class RecommendationStore:
+    """
+    Read side of a precompute output directory
+    
+    Finds a user's row through the open-addressing table (an expected
+    O(1) probe) and reads their precomputed matches from memory-mapped
+    arrays. Profiles registered after the run are merged in through
+    add_profile, which appends them to the directory's merges.log; every
+    process replays that log before reading, so all workers serve the
+    same lists until the next run replaces the directory.
+    """
+    
+    def __init__(self, path: str):
+        """Open a directory written by precompute()"""
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self._meta_inode = os.stat(os.path.join(path, 'meta.json')).st_ino
+        rows = self.meta['rows']
+        self.user_ids = StringColumn(os.path.join(path, 'user_ids.txt'), os.path.join(path, 'user_ids.off'), rows)
+        self.slots = np.fromfile(os.path.join(path, 'slots.bin'), dtype='<i8')
+        self.matches = np.load(os.path.join(path, 'matches.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'extras.json')) as f:
+            extras = {int(row): labels for row, labels in json.load(f).items()}
+        self.columns = CandidateBatch.from_arrays(
+            *(np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in SCORED_COLUMNS), extras=extras
+        )
+        self._alive = np.ones(rows, dtype=bool)  # False once a row is removed or re-registered; grows by doubling
+        self._rows = rows                        # Rows in use, including merged-in profiles
+        self._lock = threading.RLock()
+        self._engine = None
+        self._kth = None          # Each row's k-th best score in hundredths (-1 while not full), built on first add
+        self._updated = {}        # Row -> (matches, scores) replacing its stored lists
+        self._added = []          # CompactProfiles registered since the run, as rows N, N+1, ...
+        self._added_rows = {}     # User id -> row, for those profiles
+        self._added_extras = {}   # Index into _added -> extras, for those outside SurveyData
+        self._added_columns = [np.zeros((0,) + column.shape[1:], dtype=column.dtype)
+                               for column in (self.columns.values, self.columns.goals,
+                                              self.columns.styles, self.columns.timelines)]
+        # Bound to this directory's log even after a new run is swapped in
+        self._log = open(os.path.join(path, MERGES_LOG), 'a+b')
+        self._log_offset = 0      # Bytes of the log merged so far
+    
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[:self._rows]
+    
+    def __len__(self):
+        self.refresh()
+        return int(self.alive.sum())
+    
+    def __contains__(self, user_id):
+        self.refresh()
+        return self.row(user_id) is not None
+    
+    def is_stale(self) -> bool:
+        """True once precompute() has replaced the directory since it was opened"""
+        try:
+            return os.stat(os.path.join(self.path, 'meta.json')).st_ino != self._meta_inode
+        except FileNotFoundError:
+            return True
+    
+    def row(self, user_id: str) -> Optional[int]:
+        """Row of a user id, or None"""
+        row = self._added_rows.get(user_id)
+        if row is not None:
+            return row
+        mask = len(self.slots) - 1
+        slot = id_hash(user_id) & mask
+        while self.slots[slot] != -1:
+            row = int(self.slots[slot])
+            if self.user_ids[row] == user_id:
+                return row if self._alive[row] else None
+            slot = (slot + 1) & mask
+        return None
+    
+    def _user_id(self, row: int) -> str:
+        rows = self.meta['rows']
+        return self.user_ids[row] if row < rows else self._added[row - rows].user_id
+    
+    def _lists(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """A row's current (matches, scores) arrays"""
+        updated = self._updated.get(row)
+        return updated if updated is not None else (self.matches[row], self.scores[row])
+    
+    def get(self, user_id: str) -> Optional[List[Tuple[str, float]]]:
+        """A user's precomputed (candidate id, overall score) pairs, best first, or None"""
+        with self._lock:
+            self.refresh()
+            row = self.row(user_id)
+            if row is None:
+                return None
+            matches, scores = self._lists(row)
+            alive = self.alive
+            return [
+                (self._user_id(match), int(cents) / 100)
+                for match, cents in zip(matches, scores) if match >= 0 and alive[match]
+            ]
+    
+    def remove(self, user_id: str) -> bool:
+        """
+        Drop a user's row in every process; returns False if it wasn't there
+        
+        Lists that included them just show one match fewer until the
+        next run.
+        """
+        with self._lock:
+            self.refresh()
+            if self.row(user_id) is None:
+                return False
+            self._publish({'op': 'remove', 'user_id': user_id})
+            return True
+    
+    def add_profile(self, profile: UserProfile):
+        """
+        Merge a newly registered (or re-registered) profile into the lists
+        
+        Logs the profile and merges it in; other processes merge it on
+        their next read. Raises ValueError, logging nothing, if the
+        profile can't be encoded.
+        """
+        CompactProfile.from_profile(profile)
+        self._publish({'op': 'add', 'profile': profile.to_dict()})
+    
+    def _publish(self, record: dict):
+        """Append a record to the merges log, then catch up to it"""
+        with self._lock:
+            # One write to an O_APPEND file, so records from concurrent processes don't interleave
+            os.write(self._log.fileno(), (json.dumps(record) + '\n').encode('utf-8'))
+            self.refresh()
+    
+    def refresh(self):
+        """Apply merges logged by any process since the last call, in log order"""
+        with self._lock:
+            size = os.fstat(self._log.fileno()).st_size
+            if size <= self._log_offset:
+                return
+            self._log.seek(self._log_offset)
+            for line in self._log.read(size - self._log_offset).splitlines(keepends=True):
+                if not line.endswith(b'\n'):
+                    break  # Write still in progress; pick it up next time
+                self._log_offset += len(line)
+                record = json.loads(line)
+                if record['op'] == 'add':
+                    self._merge(CompactProfile.from_dict(record['profile']))
+                elif record['op'] == 'remove':
+                    self._drop(record['user_id'])
+    
+    def _drop(self, user_id: str):
+        row = self.row(user_id)
+        if row is not None:
+            self._alive[row] = False
+            self._added_rows.pop(user_id, None)
+    
+    def _reserve(self, rows: int):
+        """Grow the per-row arrays by doubling to hold at least `rows` rows"""
+        if rows <= len(self._alive):
+            return
+        capacity = max(2 * len(self._alive), rows, 16)
+        self._alive = _grown(self._alive, capacity)
+        self._kth = _grown(self._kth, capacity)
+        self._added_columns = [_grown(column, capacity - self.meta['rows']) for column in self._added_columns]
+    
+    def _merge(self, compact: CompactProfile):
+        """
+        Merge one profile in with a single row of scoring
+        
+        Scores the profile once against every row, a chunk at a time.
+        Scores are symmetric, so that one pass gives both the profile's
+        own top k and the rows whose top k it now enters, which are
+        updated in place. The profile takes the next row number, so like
+        a row appended to the pool it loses ties.
+        """
+        query = compact_columns([compact])
+        top_k = self.meta['top_k']
+        if self._engine is None:
+            self._engine = CompatibilityEngine(values_mode=self.meta['values_mode'])
+            kth = np.where(self.matches[:, -1] >= 0, self.scores[:, -1], -1).astype(np.int16)
+            self._kth = _grown(kth, len(self._alive))
+        old = self.row(compact.user_id)
+        if old is not None:
+            self._alive[old] = False
+        row = self._rows
+        self._reserve(row + 1)
+        added = len(self._added)
+        for column, value in zip(self._added_columns, (compact.value_vector(), compact.goals,
+                                                       compact.style, compact.timeline)):
+            column[added] = value
+        self._added.append(compact)
+        if compact.extras:
+            self._added_extras[added] = compact.extras
+        self._alive[row] = True
+        self._rows += 1
+        
+        added_batch = CandidateBatch.from_arrays(*(column[:added + 1] for column in self._added_columns),
+                                                 extras=self._added_extras)
+        rounded = np.concatenate([
+            rounded_scores(self._engine, query, batch.take_columns(slice(start, start + ROW_CHUNK)))[0]
+            for batch in (self.columns, added_batch)
+            for start in range(0, len(batch.values), ROW_CHUNK)
+        ])
+        eligible = np.flatnonzero(self._alive[:row])
+        
+        # Rows whose current k-th best it beats (ties go to their existing matches)
+        cents = np.rint(rounded[eligible] * 100).astype(np.int16)
+        entering = eligible[cents > self._kth[eligible]]
+        if len(entering):
+            lists = [self._lists(other) for other in entering]
+            stored_matches = np.array([stored for stored, _ in lists])
+            stored_scores = np.array([stored for _, stored in lists])
+            stored = np.where(stored_matches >= 0, rank_keys(stored_scores / 100, stored_matches), -1)
+            best = merge_top_k(stored, rank_keys(rounded[entering], np.full(len(entering), row))[:, None], top_k)
+            matches, scores = unpack_keys(-np.sort(-best, axis=1))
+            for other, other_matches, other_scores in zip(entering, matches, scores):
+                self._updated[other] = (other_matches, other_scores)
+            self._kth[entering] = np.where(matches[:, -1] >= 0, scores[:, -1], -1)
+        
+        # The new profile's own list
+        best = merge_top_k(np.full((1, top_k), -1, dtype=np.int64), rank_keys(rounded[eligible], eligible)[None, :], top_k)
+        matches, scores = unpack_keys(-np.sort(-best, axis=1))
+        self._updated[row] = (matches[0], scores[0])
+        self._kth[row] = scores[0, -1] if matches[0, -1] >= 0 else -1
+        self._added_rows[compact.user_id] = row
+
+def main():
+    """Run the precompute job from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('store', help='ProfileStore directory')
+    parser.add_argument('output', help='Directory to write recommendations to (replaced when done)')
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--values-mode', default='aligned', choices=CompatibilityEngine.VALUES_MODES)
+    args = parser.parse_args()
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    
+    meta = precompute(args.store, args.output, args.top_k, args.workers, args.values_mode)
+    print(f"Wrote top {meta['top_k']} matches for {meta['rows']} profiles in {meta['seconds']}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+JSON encoding of scores, profiles and API responses
+
+Field layouts are read once from the dataclasses, so a CompatibilityScore
+becomes a plain tuple (score_record) or dict (score_dict) with one
+attrgetter call instead of dataclasses.asdict's recursive copy. Encoding
+uses orjson when it is installed and the stdlib json module otherwise.
+Both give the same data: the stdlib output is byte-for-byte what
+json.dumps gives today, while orjson's output is compact (no spaces after
+separators) and UTF-8 rather than ASCII-escaped.
+"""
+
+import dataclasses
+import json
+from operator import attrgetter
+from typing import List, Optional
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+from models import UserProfile, CompatibilityScore
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder is used instead
+    orjson = None
+
+SCORE_FIELDS = tuple(field.name for field in dataclasses.fields(CompatibilityScore))
+PROFILE_FIELDS = tuple(field.name for field in dataclasses.fields(UserProfile))  # Same order as UserProfile.to_dict
+
+_score_record = attrgetter(*SCORE_FIELDS)
+_profile_record = attrgetter(*PROFILE_FIELDS)
+
+def encoder_name() -> str:
+    """The JSON encoder in use: 'orjson' or 'json'"""
+    return 'orjson' if orjson is not None else 'json'
+
+def score_record(score: CompatibilityScore) -> tuple:
+    """A score's fields as a tuple, in SCORE_FIELDS order"""
+    return _score_record(score)
+
+def score_from_record(record: tuple) -> CompatibilityScore:
+    return CompatibilityScore(*record)
+
+def score_dict(score: CompatibilityScore) -> dict:
+    """Same dict as dataclasses.asdict(score), without the deep copy"""
+    return dict(zip(SCORE_FIELDS, _score_record(score)))
+
+def profile_record(profile: UserProfile) -> tuple:
+    """A profile's fields as a tuple, in PROFILE_FIELDS order (nested values are shared, as with to_dict)"""
+    return _profile_record(profile)
+
+def profile_dict(profile: UserProfile) -> dict:
+    """Same dict as profile.to_dict()"""
+    return dict(zip(PROFILE_FIELDS, _profile_record(profile)))
+
+def _default(obj):
+    """Types the stdlib encoder doesn't handle that orjson does (with the options below)"""
+    if isinstance(obj, CompatibilityScore):
+        return score_dict(obj)
+    if isinstance(obj, UserProfile):
+        return profile_dict(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def dumps(obj, sort_keys: bool = False, default=None) -> bytes:
+    """
+    Encode obj as JSON bytes
+    
+    Scores, profiles and numpy values are encoded as their dicts and
+    plain numbers; `default` converts anything else (as for json.dumps).
+    """
+    if orjson is not None:
+        option = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, sort_keys=sort_keys, default=_chain(default) if default else _default).encode()
+
+def _chain(default):
+    """_default, then the caller's default for anything it can't encode"""
+    def chained(obj):
+        try:
+            return _default(obj)
+        except TypeError:
+            return default(obj)
+    return chained
+
+def loads(data):
+    """Decode JSON bytes or text"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def match_line(user_id, matches: List[CompatibilityScore], details: Optional[List[dict]] = None) -> bytes:
+    """
+    One NDJSON line of ranked matches for a user: {"user_id", "matches"}
+    
+    With details (one explanation per match), each match dict also
+    gets a 'details' key.
+    """
+    lines = [score_dict(match) for match in matches]
+    if details is not None:
+        for line, detail in zip(lines, details):
+            line['details'] = detail
+    return dumps({'user_id': user_id, 'matches': lines}) + b'\n'
+
+def error_line(user_id, error: str) -> bytes:
+    """One NDJSON line reporting a query that couldn't be ranked"""
+    return dumps({'user_id': user_id, 'error': error}) + b'\n'
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider encoding jsonify() responses with dumps()
+    
+    Keeps Flask's defaults (sorted keys, a trailing newline, Flask's
+    conversion of dates and other types); pretty-printed debug responses
+    and the stdlib fallback go through Flask's own encoder.
+    """
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        return self._app.response_class(dumps(obj, sort_keys=self.sort_keys, default=self.default) + b'\n',
+                                        mimetype=self.mimetype)
@@ -0,0 +1,240 @@
+"""
+Conversation session storage
+
+SessionStore holds each session's survey answers in memory, bounded by
+an idle time-to-live and a maximum entry count (least recently used
+sessions are evicted first), and keeps a running estimate of the memory
+they use. A SessionBackend underneath can persist sessions so they
+survive restarts and are shared between worker processes; SQLiteBackend
+stores them in a local SQLite file.
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Optional
+
+def estimate_size(obj) -> int:
+    """Approximate bytes used by a session value (containers, strings and numbers)"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key) + estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+class SessionBackend:
+    """
+    Persistence for a SessionStore; this base class keeps nothing
+    
+    Subclasses save each session's data with an expiry time (seconds
+    since the epoch) and must be safe to call from several threads.
+    """
+    
+    persistent = False  # Whether sessions outlive the process
+    
+    def load(self, session_id: str) -> Optional[dict]:
+        """A session's saved data, or None if it is missing or expired"""
+        return None
+    
+    def save(self, session_id: str, data: dict, expires: float):
+        """Save a session's data until `expires`"""
+    
+    def delete(self, session_id: str):
+        """Forget a session"""
+    
+    def purge(self, now: float) -> int:
+        """Drop sessions that expired before `now`; returns how many"""
+        return 0
+    
+    def close(self):
+        """Release any resources"""
+
+class SQLiteBackend(SessionBackend):
+    """
+    Sessions in a local SQLite file, one JSON row per session
+    
+    Uses write-ahead logging, so worker processes sharing the file can
+    read while another writes.
+    """
+    
+    persistent = True
+    
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        """Open (creating if needed) the session database at path; clock gives seconds since the epoch"""
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions '
+                         '(session_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+    
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute('SELECT data FROM sessions WHERE session_id = ? AND expires > ?',
+                                   (session_id, self._clock())).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save(self, session_id: str, data: dict, expires: float):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO sessions (session_id, data, expires) VALUES (?, ?, ?)',
+                             (session_id, json.dumps(data), expires))
+    
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+    
+    def purge(self, now: float) -> int:
+        with self._lock:
+            return self._db.execute('DELETE FROM sessions WHERE expires <= ?', (now,)).rowcount
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class SessionStore(MutableMapping):
+    """
+    Bounded in-memory session dict over an optional persistent backend
+    
+    Behaves like the plain dict it replaces: handlers read and update
+    session dicts in place. Sessions idle for longer than `ttl` seconds
+    expire, and beyond `max_entries` the least recently used are evicted,
+    so memory stays flat however many sessions come and go. Iteration
+    and len() cover the sessions held in memory.
+    
+    With a persistent backend, call refresh() before handling a request
+    and save() after it: the backend is then the source of truth and the
+    in-memory copy only serves the request in between.
+    """
+    
+    PURGE_INTERVAL = 60.0   # Seconds between sweeps of expired sessions from the backend
+    
+    def __init__(self, max_entries: int = 10000, ttl: float = 1800.0, backend: Optional[SessionBackend] = None,
+                 clock: Callable[[], float] = time.time):
+        """Create an empty store; sessions live in memory only unless a backend is given"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend or SessionBackend()
+        self._clock = clock     # Seconds since the epoch; the backend's expiry times use the same clock
+        self.memory_bytes = 0   # Estimated size of the sessions held in memory
+        self.evictions = 0      # Sessions dropped to stay within max_entries
+        self.expirations = 0    # Sessions dropped after ttl idle seconds
+        self._entries = OrderedDict()   # session_id -> [data, last used, estimated size], least recent first
+        self._lock = threading.RLock()
+        self._next_purge = 0.0
+    
+    def __getitem__(self, session_id: str) -> dict:
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                data = self.backend.load(session_id)
+                if data is None:
+                    raise KeyError(session_id)
+                entry = self._insert(session_id, data, now)
+            else:
+                entry[1] = now
+                self._entries.move_to_end(session_id)
+            return entry[0]
+    
+    def __setitem__(self, session_id: str, data: dict):
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            self._insert(session_id, data, now)
+    
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.memory_bytes -= entry[2]
+            elif self.backend.load(session_id) is None:
+                raise KeyError(session_id)
+            self.backend.delete(session_id)
+    
+    def __contains__(self, session_id):
+        try:
+            self[session_id]
+        except KeyError:
+            return False
+        return True
+    
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _insert(self, session_id: str, data: dict, now: float) -> list:
+        """Hold a session in memory as the most recently used, evicting the least recently used if full"""
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self.memory_bytes -= old[2]
+        entry = self._entries[session_id] = [data, now, estimate_size(data)]
+        self.memory_bytes += entry[2]
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.memory_bytes -= evicted[2]
+            self.evictions += 1
+        return entry
+    
+    def _expire(self, now: float):
+        """Drop sessions idle for longer than the TTL (they sit at the front of the LRU order)"""
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if entry[1] + self.ttl > now:
+                break
+            del self._entries[session_id]
+            self.memory_bytes -= entry[2]
+            self.expirations += 1
+    
+    def refresh(self, session_id: str):
+        """Reload a session from a persistent backend, which another process may have updated"""
+        if not self.backend.persistent:
+            return
+        data = self.backend.load(session_id)
+        with self._lock:
+            if data is not None:
+                self._insert(session_id, data, self._clock())
+            else:
+                entry = self._entries.pop(session_id, None)
+                if entry is not None:
+                    self.memory_bytes -= entry[2]
+    
+    def save(self, session_id: str):
+        """Write a session's current data through to the backend and update its size estimate"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            size = estimate_size(entry[0])
+            self.memory_bytes += size - entry[2]
+            entry[2] = size
+            now = self._clock()
+            if self.backend.persistent:
+                self.backend.save(session_id, entry[0], now + self.ttl)
+                if now >= self._next_purge:
+                    self._next_purge = now + self.PURGE_INTERVAL
+                    self.backend.purge(now)
+    
+    def stats(self) -> dict:
+        """Session counts and memory use, for monitoring"""
+        with self._lock:
+            self._expire(self._clock())
+            return {
+                'sessions': len(self._entries),
+                'max_sessions': self.max_entries,
+                'memory_bytes': self.memory_bytes,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'backend': type(self.backend).__name__
+            }
@@ -0,0 +1,170 @@
+"""
+Candidate pool shared by several worker processes
+
+Every worker maps the current ProfileStore snapshot read-only, so the
+column pages are held once in the OS page cache no matter how many
+workers run. Writes go through the store's writer lock into the
+snapshot's append-only log; each worker tails that log into a small
+private overlay and switches over when a checkpoint publishes the next
+snapshot generation.
+"""
+
+import os
+import threading
+import numpy as np
+from typing import List, Optional
+from models import UserProfile, CompactProfile, Vocabulary
+from pool import CandidatePool, PoolView
+from storage import ProfileStore, StringColumn, RowIndex
+
+class MappedView(PoolView):
+    """
+    PoolView over a snapshot's memory-mapped files
+    
+    Numeric columns are read-only maps shared with other processes;
+    strings are decoded lazily per row and ids are found through the
+    snapshot's hash index. Only the alive mask (one byte per row) is
+    private to the process.
+    """
+    
+    def __init__(self, store: ProfileStore, snapshot: str):
+        """Map a snapshot; raises FileNotFoundError if it has been removed"""
+        meta, columns = store.map_columns(snapshot, mode='r')
+        rows = meta['rows']
+        self.user_ids = StringColumn(os.path.join(snapshot, 'user_ids.txt'),
+                                     os.path.join(snapshot, 'user_ids.off'), rows)
+        self.names = StringColumn(os.path.join(snapshot, 'names.txt'),
+                                  os.path.join(snapshot, 'names.off'), rows)
+        self.preferences = store.read_preferences(snapshot)
+        self.values = columns['values']
+        self.goals = columns['goals']
+        self.styles = columns['styles']
+        self.timelines = columns['timelines']
+        self.ages = columns['ages']
+        self.locations = columns['locations']
+        self.alive = np.ones(rows, dtype=bool)
+        self.location_vocabulary = Vocabulary(store.read_strings(snapshot, 'locations', meta['location_count']))
+        self.extras = store.read_extras(snapshot)
+        self.generation = os.path.basename(snapshot)
+        self._row_of = RowIndex(os.path.join(snapshot, 'index.bin'), self.user_ids)
+    
+    def __len__(self):
+        return len(self.alive)
+    
+    def live_row(self, user_id: str) -> Optional[int]:
+        """Row of a live profile, or None"""
+        row = self._row_of.get(user_id)
+        return row if row is not None and self.alive[row] else None
+
+class SharedPool:
+    """
+    Candidate pool backed by a ProfileStore shared between processes
+    
+    Reads see the mapped snapshot followed by an overlay holding writes
+    logged since that snapshot, in that row order. Every read first
+    refreshes from the store (two small file reads), so a profile saved
+    by one worker is visible to the next request on any other worker.
+    """
+    
+    def __init__(self, store: ProfileStore):
+        """Attach to a store, creating its first snapshot if needed"""
+        self.store = store
+        self._lock = threading.RLock()
+        self._snapshot = None                # Path of the mapped snapshot
+        self._base: Optional[MappedView] = None
+        self._overlay = CandidatePool()      # Writes logged since the snapshot
+        self._log_offset = 0                 # Bytes of the snapshot's log applied so far
+        with store.locked():
+            if store.current_snapshot() is None:
+                store.checkpoint(CandidatePool())
+        self.refresh()
+    
+    def refresh(self):
+        """Pick up new log records and newly published snapshots"""
+        with self._lock:
+            snapshot = self.store.current_snapshot()
+            if snapshot != self._snapshot:
+                try:
+                    base = MappedView(self.store, snapshot)
+                except FileNotFoundError:
+                    return  # Superseded while we were opening it; catch up next time
+                self._snapshot, self._base = snapshot, base
+                self._overlay, self._log_offset = CandidatePool(), 0
+            
+            log_path = os.path.join(snapshot, 'writes.log')
+            try:
+                if os.path.getsize(log_path) <= self._log_offset:
+                    return
+            except FileNotFoundError:
+                return
+            for record, offset in self.store.read_log(log_path, self._log_offset):
+                if record['op'] == 'add':
+                    profile = UserProfile.from_dict(record['profile'])
+                    self._tombstone_base(profile.user_id)
+                    self._overlay.add(profile)
+                elif record['op'] == 'remove':
+                    self._tombstone_base(record['user_id'])
+                    self._overlay.remove(record['user_id'])
+                self._log_offset = offset
+    
+    def _tombstone_base(self, user_id: str):
+        row = self._base.live_row(user_id)
+        if row is not None:
+            self._base.alive[row] = False
+    
+    @property
+    def generation(self):
+        """Changes whenever any process writes to or checkpoints the store"""
+        with self._lock:
+            self.refresh()
+            return (self._base.generation, self._log_offset)
+    
+    def segments(self) -> List[PoolView]:
+        """Views to score: the mapped snapshot, then the overlay"""
+        with self._lock:
+            self.refresh()
+            return [self._base, self._overlay.snapshot()]
+    
+    def __len__(self):
+        with self._lock:
+            self.refresh()
+            return int(self._base.alive.sum()) + len(self._overlay)
+    
+    def __contains__(self, user_id):
+        return self.get_compact(user_id) is not None
+    
+    def get(self, user_id: str) -> Optional[UserProfile]:
+        """Return a profile by user id, or None if it isn't in the pool"""
+        compact = self.get_compact(user_id)
+        return compact.to_profile() if compact else None
+    
+    def get_compact(self, user_id: str) -> Optional[CompactProfile]:
+        """Return a profile by user id in compact form, or None"""
+        with self._lock:
+            self.refresh()
+            compact = self._overlay.get_compact(user_id)
+            if compact is not None:
+                return compact
+            row = self._base.live_row(user_id)
+            return self._base.compact_profile(row) if row is not None else None
+    
+    def add(self, profile: UserProfile):
+        """Publish a new or updated profile to every process"""
+        CompactProfile.from_profile(profile)  # Raises ValueError before anything is logged
+        self._publish({'op': 'add', 'profile': profile.to_dict()})
+    
+    def remove(self, user_id: str) -> bool:
+        """Publish a profile removal; returns False if it wasn't in the pool"""
+        if user_id not in self:
+            return False
+        self._publish({'op': 'remove', 'user_id': user_id})
+        return True
+    
+    def _publish(self, record: dict):
+        """Log a record as the single writer, checkpointing a new generation when the log is large"""
+        with self.store.locked():
+            log_size = self.store.append_record(record)
+            self.refresh()
+            if log_size >= self.store.CHECKPOINT_LOG_BYTES:
+                self.store.checkpoint(self)
+                self.refresh()
@@ -0,0 +1,539 @@
+"""
+Persistent on-disk storage for the candidate pool
+
+Profiles are saved as snapshots of columnar binary files that are opened
+with numpy.memmap, so a restarted worker can serve matches without
+parsing JSON or rebuilding profile objects. Writes made after a snapshot
+go to an append-only log that is replayed on open and folded into the
+next snapshot by checkpoint().
+
+Layout of a store directory:
+
+    CURRENT                 Name of the active snapshot directory
+    snap-000001/
+        meta.json           Row count and the vocabulary labels used for codes
+        values.bin          N x 8 int8 ratings in CORE_VALUES order
+        goals.bin           uint64 family goal bitmasks
+        styles.bin          uint8 communication style codes
+        timelines.bin       uint8 timeline codes
+        ages.bin            int16 ages
+        locations.bin       int32 location ids
+        user_ids.txt        One escaped string per row
+        user_ids.off        int64 start offset of each row's line (plus end)
+        names.txt           One escaped string per row
+        names.off           int64 start offset of each row's line (plus end)
+        index.bin           (hash, row) pairs sorted by user id hash
+        locations.txt       Location labels, one per location id
+        preferences.json    Non-empty preferences by row
+        extras.json         Answers outside SurveyData by row (see label_extras)
+        writes.log          JSON lines of adds/removes since the snapshot
+
+Writers serialize on an exclusive lock on the LOCK file, so several
+processes can share one store; see shared.py for the reader side.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+from models import (UserProfile, SurveyData, GOAL_VOCABULARY, STYLE_VOCABULARY,
+                    TIMELINE_VOCABULARY)
+from pool import CandidatePool
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the store is then single-process only
+    fcntl = None
+
+# On-disk dtype of each numeric column (fixed little-endian)
+COLUMN_DTYPES = {
+    'values': '<i1',
+    'goals': '<u8',
+    'styles': 'u1',
+    'timelines': 'u1',
+    'ages': '<i2',
+    'locations': '<i4'
+}
+
+# Sorted id index entry: stable 64-bit hash of the user id, and its row
+INDEX_DTYPE = np.dtype([('hash', '<u8'), ('row', '<i8')])
+
+_ESCAPED = re.compile(r'\\(.)')
+
+def _escape(text) -> str:
+    """Escape backslashes and newlines so a string fits on one line"""
+    return str(text).replace('\\', '\\\\').replace('\n', '\\n')
+
+def _unescape(line: str) -> str:
+    """Reverse _escape"""
+    if '\\' not in line:
+        return line
+    return _ESCAPED.sub(lambda match: '\n' if match.group(1) == 'n' else match.group(1), line)
+
+def id_hash(user_id: str) -> int:
+    """Stable 64-bit hash of a user id (Python's hash() differs per process)"""
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode('utf-8'), digest_size=8).digest(), 'little')
+
+def _encode_lines(strings) -> Tuple[bytes, np.ndarray]:
+    """Join strings one per line; returns the bytes and each line's start offset plus the end"""
+    encoded = [_escape(text).encode('utf-8') for text in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(line) + 1 for line in encoded], out=offsets[1:])
+    return b'\n'.join(encoded), offsets
+
+def _decode_lines(data: bytes, count: int) -> List[str]:
+    """Split bytes written by _encode_lines back into `count` strings"""
+    if count == 0:
+        return []
+    text = data.decode('utf-8')
+    lines = text.split('\n')
+    if '\\' in text:
+        lines = [_unescape(line) for line in lines]
+    return lines
+
+def _remap_codes(codes: np.ndarray, labels: List[str], vocabulary) -> np.ndarray:
+    """Translate stored codes into this process's vocabulary codes"""
+    # The stored other_code follows the stored labels
+    mapping = np.array([vocabulary.encode(label) for label in labels] + [vocabulary.other_code], dtype=codes.dtype)
+    if np.array_equal(mapping, np.arange(len(labels) + 1)):
+        return codes
+    return mapping[codes]
+
+def _remap_goals(masks: np.ndarray, labels: List[str]) -> np.ndarray:
+    """Translate stored goal bitmasks into this process's goal vocabulary"""
+    bits = [GOAL_VOCABULARY.encode(label) for label in labels] + [GOAL_VOCABULARY.other_code]
+    if bits == list(range(len(labels) + 1)):
+        return masks
+    remapped = np.zeros_like(masks)
+    for stored_bit, bit in enumerate(bits):
+        remapped |= ((masks >> np.uint64(stored_bit)) & np.uint64(1)) << np.uint64(bit)
+    return remapped
+
+class StringColumn:
+    """Read-only string column decoded lazily, row by row, from a snapshot's .txt/.off files"""
+
+    def __init__(self, data_path: str, offsets_path: str, count: int):
+        self._offsets = np.memmap(offsets_path, dtype='<i8', mode='r', shape=(count + 1,))
+        if os.path.getsize(data_path):
+            self._data = np.memmap(data_path, dtype=np.uint8, mode='r')
+        else:
+            self._data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self._offsets[row], self._offsets[row + 1] - 1
+        return _unescape(self._data[start:end].tobytes().decode('utf-8'))
+
+class SparseColumn(dict):
+    """Row -> value mapping for mostly-empty columns; missing rows read as None"""
+
+    def __missing__(self, row):
+        return None
+
+class RowIndex:
+    """User id -> row lookup over a snapshot's memory-mapped index.bin"""
+
+    def __init__(self, path: str, user_ids: StringColumn):
+        if os.path.getsize(path):
+            self._index = np.memmap(path, dtype=INDEX_DTYPE, mode='r')
+        else:
+            self._index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._user_ids = user_ids
+
+    def get(self, user_id: str, default=None) -> Optional[int]:
+        """Row of user_id in the snapshot, or default"""
+        user_hash = np.uint64(id_hash(user_id))
+        hashes = self._index['hash']
+        first = np.searchsorted(hashes, user_hash, side='left')
+        last = np.searchsorted(hashes, user_hash, side='right')
+        for row in self._index['row'][first:last]:
+            if self._user_ids[row] == user_id:
+                return int(row)
+        return default
+
+class SnapshotColumn:
+    """
+    Pool object column whose first rows are read lazily from a snapshot
+
+    Rows below base_rows come from `base` (a StringColumn or
+    SparseColumn) and are decoded only when read; rows appended after
+    them live in an object array. Supports the indexing CandidatePool
+    and PoolView use: single rows, [:n] prefixes, slice assignment past
+    the snapshot rows, and == against a value.
+    """
+
+    def __init__(self, base, base_rows: int, tail: Optional[np.ndarray] = None, index: Optional['RowIndex'] = None):
+        self.base = base
+        self.base_rows = base_rows
+        self.tail = np.empty(0, dtype=object) if tail is None else tail  # Rows from base_rows on
+        self.index = index            # Finds a value's snapshot row (user ids only)
+
+    def __len__(self):
+        return self.base_rows + len(self.tail)
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice) and not rows.start and rows.step is None:
+            stop = len(self) if rows.stop is None else min(rows.stop, len(self))
+            return SnapshotColumn(self.base, min(self.base_rows, stop),
+                                  self.tail[:max(0, stop - self.base_rows)], self.index)
+        if isinstance(rows, (slice, np.ndarray, list)):
+            # Any other selection copies out (decodes) the rows it covers
+            return np.array([self[row] for row in range(len(self))[rows]] if isinstance(rows, slice)
+                            else [self[int(row)] for row in rows], dtype=object)
+        row = int(rows)
+        return self.base[row] if row < self.base_rows else self.tail[row - self.base_rows]
+
+    def __setitem__(self, rows, value):
+        if isinstance(rows, slice):
+            self.tail[rows.start - self.base_rows:rows.stop - self.base_rows] = value
+        else:
+            self.tail[rows - self.base_rows] = value
+
+    def __eq__(self, value) -> np.ndarray:
+        matches = np.zeros(len(self), dtype=bool)
+        matches[self.base_rows:] = self.tail == value
+        if self.index is not None:
+            row = self.index.get(value)
+            if row is not None and row < self.base_rows:
+                matches[row] = True
+        else:
+            matches[:self.base_rows] = [self.base[row] == value for row in range(self.base_rows)]
+        return matches
+
+    def grown(self, capacity: int) -> 'SnapshotColumn':
+        """Copy with room for `capacity` rows in all, still reading the snapshot rows lazily"""
+        tail = np.empty(capacity - self.base_rows, dtype=object)
+        tail[:len(self.tail)] = self.tail
+        return SnapshotColumn(self.base, self.base_rows, tail, self.index)
+
+class LiveRowIndex:
+    """
+    user_id -> live row for a pool loaded from a snapshot
+
+    Ids are looked up in the snapshot's RowIndex, under a dict of rows
+    assigned (or removed, as None) since; supports the dict operations
+    CandidatePool uses on its row map.
+    """
+
+    def __init__(self, base: RowIndex, count: int):
+        self._base = base
+        self._changes = {}
+        self._count = count           # Live ids
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def get(self, user_id: str, default=None) -> Optional[int]:
+        row = self._changes[user_id] if user_id in self._changes else self._base.get(user_id)
+        return default if row is None else row
+
+    def __getitem__(self, user_id: str) -> int:
+        row = self.get(user_id)
+        if row is None:
+            raise KeyError(user_id)
+        return row
+
+    def __setitem__(self, user_id: str, row: int):
+        if user_id not in self:
+            self._count += 1
+        self._changes[user_id] = row
+
+    def update(self, items):
+        for user_id, row in items:
+            self[user_id] = row
+
+    def pop(self, user_id: str, default=None) -> Optional[int]:
+        row = self.get(user_id)
+        if row is None:
+            return default
+        self._changes[user_id] = None
+        self._count -= 1
+        return row
+
+class ProfileStore:
+    """
+    File-backed profile storage for a CandidatePool
+
+    load() maps the current snapshot and replays its write log into a
+    pool. add() and remove() log the change and apply it to the caller's
+    pool; checkpoint() writes a new snapshot from the pool. The previous
+    snapshot is kept so readers that just resolved CURRENT can still
+    open it.
+    """
+
+    CHECKPOINT_LOG_BYTES = 8 * 1024 * 1024   # Log size that triggers an automatic checkpoint
+
+    def __init__(self, directory: str):
+        """Open (creating if needed) a store directory"""
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._lock_depth = 0         # Re-entrant holds of the process-wide file lock
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Hold the store's writer lock, across threads and processes"""
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                # flock locks a second descriptor even within one process, so only take it once
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(os.path.join(self.directory, 'LOCK'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current_snapshot(self) -> Optional[str]:
+        """Path of the active snapshot directory, or None for a new store"""
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.directory, name)
+
+    def load(self) -> CandidatePool:
+        """Build a pool from the current snapshot plus its write log"""
+        with self.locked():
+            snapshot = self.current_snapshot()
+            if snapshot is None:
+                pool = CandidatePool()
+                self._checkpoint(pool)
+                return pool
+
+            pool = self._map_snapshot(snapshot)
+            self.replay(pool, os.path.join(snapshot, 'writes.log'))
+            return pool
+
+    def read_meta(self, snapshot: str) -> dict:
+        """Read a snapshot's meta.json"""
+        with open(os.path.join(snapshot, 'meta.json')) as f:
+            return json.load(f)
+
+    def map_columns(self, snapshot: str, mode: str = 'r') -> Tuple[dict, dict]:
+        """
+        Memory-map a snapshot's numeric columns
+        
+        Returns the snapshot's meta and the columns by name, with codes
+        translated to this process's vocabularies.
+        """
+        meta = self.read_meta(snapshot)
+        rows = meta['rows']
+
+        columns = {}
+        for name, dtype in COLUMN_DTYPES.items():
+            shape = (rows, len(SurveyData.CORE_VALUES)) if name == 'values' else (rows,)
+            if rows:
+                columns[name] = np.memmap(os.path.join(snapshot, name + '.bin'), dtype=dtype, mode=mode, shape=shape)
+            else:
+                columns[name] = np.zeros(shape, dtype=dtype)
+
+        vocabularies = meta['vocabularies']
+        columns['goals'] = _remap_goals(columns['goals'], vocabularies['goals'])
+        columns['styles'] = _remap_codes(columns['styles'], vocabularies['styles'], STYLE_VOCABULARY)
+        columns['timelines'] = _remap_codes(columns['timelines'], vocabularies['timelines'], TIMELINE_VOCABULARY)
+        return meta, columns
+
+    def read_strings(self, snapshot: str, name: str, count: int) -> List[str]:
+        """Decode one of a snapshot's string files in full"""
+        with open(os.path.join(snapshot, name + '.txt'), 'rb') as f:
+            return _decode_lines(f.read(), count)
+
+    def read_preferences(self, snapshot: str) -> SparseColumn:
+        """Read a snapshot's non-empty preferences by row"""
+        with open(os.path.join(snapshot, 'preferences.json')) as f:
+            return SparseColumn((int(row), prefs) for row, prefs in json.load(f).items())
+
+    def read_extras(self, snapshot: str) -> dict:
+        """Read a snapshot's answers outside SurveyData by row"""
+        path = os.path.join(snapshot, 'extras.json')
+        if not os.path.exists(path):  # Snapshots written before extras were kept
+            return {}
+        with open(path) as f:
+            return {int(row): extras for row, extras in json.load(f).items()}
+
+    def _map_snapshot(self, snapshot: str) -> CandidatePool:
+        """Memory-map a snapshot's columns into a pool"""
+        # Copy-on-write: the pool may tombstone rows in place without touching the files
+        meta, columns = self.map_columns(snapshot, mode='c')
+        rows = meta['rows']
+
+        # Strings stay in the files and are decoded per row read, as in shared.MappedView
+        user_ids = StringColumn(os.path.join(snapshot, 'user_ids.txt'), os.path.join(snapshot, 'user_ids.off'), rows)
+        names = StringColumn(os.path.join(snapshot, 'names.txt'), os.path.join(snapshot, 'names.off'), rows)
+        index = RowIndex(os.path.join(snapshot, 'index.bin'), user_ids)
+
+        return CandidatePool.from_columns(
+            user_ids=SnapshotColumn(user_ids, rows, index=index),
+            names=SnapshotColumn(names, rows),
+            preferences=SnapshotColumn(self.read_preferences(snapshot), rows),
+            location_labels=self.read_strings(snapshot, 'locations', meta['location_count']),
+            extras=self.read_extras(snapshot),
+            row_of=LiveRowIndex(index, rows),
+            **columns
+        )
+
+    def read_log(self, log_path: str, offset: int = 0) -> Iterator[Tuple[dict, int]]:
+        """Yield complete log records from a byte offset, each with the offset just past it"""
+        try:
+            with open(log_path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # Write still in progress; pick it up next time
+                    offset += len(line)
+                    yield json.loads(line), offset
+        except FileNotFoundError:
+            return
+
+    def replay(self, pool: CandidatePool, log_path: str, offset: int = 0) -> int:
+        """Apply log records from a byte offset onwards; returns the offset reached"""
+        for record, offset in self.read_log(log_path, offset):
+            self.apply(pool, record)
+        return offset
+
+    def apply(self, pool: CandidatePool, record: dict):
+        """Apply a single log record to a pool"""
+        if record['op'] == 'add':
+            pool.add(UserProfile.from_dict(record['profile']))
+        elif record['op'] == 'remove':
+            pool.remove(record['user_id'])
+
+    def add(self, pool: CandidatePool, profile: UserProfile):
+        """Log a new or updated profile, then add it to the pool"""
+        pool.add(profile)  # Raises ValueError before anything is logged if it can't be encoded
+        self._write({'op': 'add', 'profile': profile.to_dict()}, pool)
+
+    def remove(self, pool: CandidatePool, user_id: str):
+        """Log a profile removal, then remove it from the pool"""
+        if pool.remove(user_id):
+            self._write({'op': 'remove', 'user_id': user_id}, pool)
+
+    def _write(self, record: dict, pool):
+        """Append a record to the current log, checkpointing `pool` when the log grows large"""
+        with self.locked():
+            if self.append_record(record) >= self.CHECKPOINT_LOG_BYTES:
+                self._checkpoint(pool)
+
+    def append_record(self, record: dict) -> int:
+        """Durably append a record to the current snapshot's log; returns the log size"""
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self.locked():
+            # Resolve the log on every write: another process may have checkpointed
+            with open(os.path.join(self.current_snapshot(), 'writes.log'), 'ab') as log:
+                log.write(line)
+                log.flush()
+                os.fsync(log.fileno())
+                return log.tell()
+
+    def checkpoint(self, pool):
+        """Write the pool's live rows as a new snapshot and start an empty log"""
+        with self.locked():
+            self._checkpoint(pool)
+
+    def _checkpoint(self, pool):
+        previous = self.current_snapshot()
+        number = int(os.path.basename(previous).split('-')[1]) + 1 if previous else 1
+        name = 'snap-%06d' % number
+        self.write_snapshot(pool, os.path.join(self.directory, name))
+
+        # Publish atomically: readers see either the old or the new snapshot
+        pointer = os.path.join(self.directory, 'CURRENT.tmp')
+        with open(pointer, 'w') as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer, os.path.join(self.directory, 'CURRENT'))
+
+        keep = {name, os.path.basename(previous) if previous else None}
+        for entry in os.listdir(self.directory):
+            if entry.startswith('snap-') and entry not in keep:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def write_snapshot(self, pool, path: str):
+        """
+        Write the pool's live rows as snapshot files in `path`
+        
+        Accepts a CandidatePool or anything with segments() (a SharedPool);
+        segments are written in order as one row sequence.
+        """
+        os.makedirs(path, exist_ok=True)
+        views = pool.segments() if hasattr(pool, 'segments') else [pool.snapshot()]
+        live_rows = [np.flatnonzero(view.alive) for view in views]
+
+        for name, dtype in COLUMN_DTYPES.items():
+            if name == 'locations':
+                continue
+            parts = [np.asarray(getattr(view, name))[live] for view, live in zip(views, live_rows)]
+            np.ascontiguousarray(np.concatenate(parts), dtype=dtype).tofile(os.path.join(path, name + '.bin'))
+
+        # Each segment numbers its own locations; merge them into one vocabulary
+        location_labels, location_ids, locations = [], {}, []
+        for view, live in zip(views, live_rows):
+            mapping = np.array([location_ids.setdefault(label, len(location_ids))
+                                for label in view.location_vocabulary.labels], dtype='<i4')
+            locations.append(mapping[view.locations[live]] if len(mapping) else np.zeros(0, dtype='<i4'))
+        location_labels = list(location_ids)
+        np.ascontiguousarray(np.concatenate(locations), dtype='<i4').tofile(os.path.join(path, 'locations.bin'))
+
+        user_ids = [view.user_ids[row] for view, live in zip(views, live_rows) for row in live]
+        names = [view.names[row] for view, live in zip(views, live_rows) for row in live]
+        preferences = [view.preferences[row] for view, live in zip(views, live_rows) for row in live]
+
+        # Only rows with answers outside SurveyData have extras; number them like the written rows
+        extras, offset = {}, 0
+        for view, live in zip(views, live_rows):
+            for row, labels in view.extras.items():
+                if row < len(view.alive) and view.alive[row]:
+                    extras[str(offset + int(np.searchsorted(live, row)))] = labels
+            offset += len(live)
+
+        for name, strings in (('user_ids', user_ids), ('names', names), ('locations', location_labels)):
+            data, offsets = _encode_lines(strings)
+            with open(os.path.join(path, name + '.txt'), 'wb') as f:
+                f.write(data)
+            if name != 'locations':
+                offsets.tofile(os.path.join(path, name + '.off'))
+
+        index = np.zeros(len(user_ids), dtype=INDEX_DTYPE)
+        index['hash'] = [id_hash(user_id) for user_id in user_ids]
+        index['row'] = np.arange(len(user_ids))
+        index.sort(order=['hash', 'row'])
+        index.tofile(os.path.join(path, 'index.bin'))
+
+        with open(os.path.join(path, 'preferences.json'), 'w') as f:
+            json.dump({str(row): prefs for row, prefs in enumerate(preferences) if prefs}, f)
+        with open(os.path.join(path, 'extras.json'), 'w') as f:
+            json.dump(extras, f)
+
+        open(os.path.join(path, 'writes.log'), 'wb').close()
+
+        meta = {
+            'rows': len(user_ids),
+            'location_count': len(location_labels),
+            'vocabularies': {
+                'goals': list(GOAL_VOCABULARY.labels),
+                'styles': list(STYLE_VOCABULARY.labels),
+                'timelines': list(TIMELINE_VOCABULARY.labels)
+            }
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of per-request webhook overhead
+
+Compares the original request parsing (nested .get calls and
+split('/')) and if/elif intent chain with parse_webhook_request and the
+INTENT_HANDLERS registry in backend/app.py. Handlers are swapped for
+stubs, so only parsing and dispatch are timed. Also times a full
+/webhook round trip through Flask's test client for scale.
+
+    python benchmarks/dispatch.py --requests 200000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import app as webhook  # noqa: E402
+
+INTENTS = ['welcome', 'collect.basic.info', 'collect.values', 'collect.family.goals',
+           'collect.communication.style', 'collect.timeline', 'find.matches',
+           'explain.match', 'more.matches', 'unknown.intent']
+
+def sample_request(intent_name, index):
+    """A Dialogflow request body shaped like the real ones (extra fields included)"""
+    session = f"projects/demo-project/agent/sessions/bench-{index}"
+    return {
+        'responseId': f'response-{index}',
+        'queryResult': {
+            'queryText': 'some user text',
+            'parameters': {'person': {'name': 'Alex'}, 'number': 30, 'geo-city': 'Seattle'},
+            'allRequiredParamsPresent': True,
+            'fulfillmentMessages': [{'text': {'text': ['']}}],
+            'outputContexts': [{'name': f'{session}/contexts/onboarding', 'lifespanCount': 5}],
+            'intent': {'name': f'projects/demo-project/agent/intents/{index}', 'displayName': intent_name},
+            'intentDetectionConfidence': 1,
+            'languageCode': 'en'
+        },
+        'originalDetectIntentRequest': {'source': 'DIALOGFLOW_CONSOLE', 'payload': {}},
+        'session': session
+    }
+
+def stub(*args):
+    return 'ok'
+
+def legacy_parse(req):
+    """Request parsing as dialogflow_webhook originally did it"""
+    intent_name = req.get('queryResult', {}).get('intent', {}).get('displayName', '')
+    parameters = req.get('queryResult', {}).get('parameters', {})
+    session_id = req.get('session', '').split('/')[-1]
+    return intent_name, parameters, session_id
+
+def legacy_dispatch(intent_name, parameters, session_id):
+    """The original if/elif chain, calling stubs"""
+    if intent_name == 'welcome':
+        return stub(session_id)
+    elif intent_name == 'collect.basic.info':
+        return stub(parameters, session_id)
+    elif intent_name == 'collect.values':
+        return stub(parameters, session_id)
+    elif intent_name == 'collect.family.goals':
+        return stub(parameters, session_id)
+    elif intent_name == 'collect.communication.style':
+        return stub(parameters, session_id)
+    elif intent_name == 'collect.timeline':
+        return stub(parameters, session_id)
+    elif intent_name == 'find.matches':
+        return stub(session_id)
+    elif intent_name == 'explain.match':
+        return stub(parameters, session_id)
+    elif intent_name == 'more.matches':
+        return stub(session_id)
+    else:
+        return "I'm sorry, I didn't understand that. Could you please rephrase?"
+
+def time_loop(function, requests):
+    """Nanoseconds per request of function over every request"""
+    started = time.perf_counter_ns()
+    for req in requests:
+        function(req)
+    return (time.perf_counter_ns() - started) / len(requests)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=200000, help='Requests per parse/dispatch run')
+    parser.add_argument('--flask-requests', type=int, default=2000, help='Requests through the Flask test client')
+    args = parser.parse_args()
+    
+    requests = [sample_request(INTENTS[i % len(INTENTS)], i) for i in range(args.requests)]
+    saved = dict(webhook.INTENT_HANDLERS)
+    webhook.INTENT_HANDLERS.update({name: stub for name in saved})
+    try:
+        results = {
+            'parse (before)': time_loop(legacy_parse, requests),
+            'parse (after)': time_loop(webhook.parse_webhook_request, requests),
+            'parse + dispatch (before)': time_loop(lambda req: legacy_dispatch(*legacy_parse(req)), requests),
+            'parse + dispatch (after)': time_loop(lambda req: webhook.handle_intent(*webhook.parse_webhook_request(req)),
+                                                  requests),
+        }
+        
+        client = webhook.app.test_client()
+        bodies = [json.dumps(req) for req in requests[:args.flask_requests]]
+        results['flask /webhook round trip'] = time_loop(
+            lambda body: client.post('/webhook', data=body, content_type='application/json'), bodies
+        )
+    finally:
+        webhook.INTENT_HANDLERS.clear()
+        webhook.INTENT_HANDLERS.update(saved)
+    
+    print(f"{'':28}{'ns/request':>12}{'requests/s':>14}")
+    for name, nanoseconds in results.items():
+        print(f"{name:28}{nanoseconds:12.0f}{1e9 / nanoseconds:14.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for matching, explanation and webhook throughput
+
+Builds synthetic candidate pools of each requested size with
+generator.py and measures:
+
+    calculate_compatibility   one pair of profiles
+    explain_match             one CompatibilityScore
+    find_top_matches          one user against the whole pool
+    webhook_onboarding        /webhook survey intents, through Flask's test client
+    webhook_find_matches      /webhook find.matches against the pool
+
+Results (p50/p99/mean latency, throughput, peak RSS) are written as
+JSON. Given a baseline file from an earlier run, any p50 more than
+--tolerance slower fails the run, so CI can catch regressions:
+
+    python benchmarks/suite.py --sizes 1000,100000 --output bench.json
+    python benchmarks/suite.py --sizes 1000,100000 --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from models import SurveyData  # noqa: E402
+from pool import CandidatePool  # noqa: E402
+from generator import ProfileGenerator  # noqa: E402
+from matching import CompatibilityEngine  # noqa: E402
+from explain import ExplainabilityEngine  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+def synthetic_pool(size: int, seed: int = 0) -> CandidatePool:
+    """A pool of `size` realistic synthetic profiles (see backend/generator.py)"""
+    return ProfileGenerator(seed).pool(size)
+
+def sample_users(pool: CandidatePool, count: int, seed: int):
+    """`count` distinct profiles from the pool, as UserProfiles"""
+    view = pool.snapshot()
+    rows = np.random.default_rng(seed).choice(len(view.alive), min(count, len(view.alive)), replace=False)
+    return [view.compact_profile(row).to_profile() for row in rows]
+
+def measure(name: str, pool_size, function, inputs, warmup: int = 2) -> dict:
+    """Time function on each input; returns latency percentiles, throughput and peak RSS so far"""
+    for item in inputs[:warmup]:
+        function(item)
+    timings = np.empty(len(inputs))
+    started = time.perf_counter()
+    for i, item in enumerate(inputs):
+        call_started = time.perf_counter()
+        function(item)
+        timings[i] = time.perf_counter() - call_started
+    elapsed = time.perf_counter() - started
+    return {
+        'benchmark': name,
+        'pool_size': pool_size,
+        'n': len(inputs),
+        'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 4),
+        'p99_ms': round(float(np.percentile(timings, 99)) * 1000, 4),
+        'mean_ms': round(float(timings.mean()) * 1000, 4),
+        'throughput_per_s': round(len(inputs) / elapsed, 1),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)  # Bytes on macOS, KB elsewhere
+
+def conversation(session_id: str, user):
+    """The /webhook requests that take one user through the survey"""
+    def request(intent_name, parameters=None):
+        return {'queryResult': {'intent': {'displayName': intent_name}, 'parameters': parameters or {}},
+                'session': f'projects/benchmark/agent/sessions/{session_id}'}
+    steps = [request('welcome'),
+             request('collect.basic.info', {'person': {'name': user.name}}),
+             request('collect.basic.info', {'age': user.age}),
+             request('collect.basic.info', {'location': user.location})]
+    steps += [request('collect.values', {'number': user.values.get(value) or 3}) for value in SurveyData.CORE_VALUES]
+    steps += [request('collect.family.goals', {'family-goals': user.family_goals}),
+              request('collect.communication.style', {'communication-style': user.communication_style}),
+              request('collect.timeline', {'timeline': user.timeline})]
+    return steps
+
+# Settings that would point the benchmarked webhook at a real deployment's
+# profile store, precomputed recommendations or session database
+DEPLOYMENT_ENV = ('PROFILE_STORE_DIR', 'SHARED_POOL', 'RECOMMENDATIONS_DIR', 'SESSION_DB')
+
+def isolated_webhook():
+    """The webhook module, detached from any store so benchmark sessions write nothing to disk"""
+    for name in DEPLOYMENT_ENV:
+        os.environ.pop(name, None)
+    import app as webhook
+    # In case it was imported (and attached) before the environment was cleared
+    webhook.profile_store = None
+    webhook.RECOMMENDATIONS_DIR = None
+    webhook.recommendations = None
+    if webhook.SESSION_DB:
+        webhook.current_session = SessionStore()
+    return webhook
+
+def run(sizes, queries: int, seed: int) -> dict:
+    """Run every benchmark; returns the report"""
+    webhook = isolated_webhook()
+    
+    engine = CompatibilityEngine()
+    explainer = ExplainabilityEngine()
+    client = webhook.app.test_client()
+    results = []
+    
+    users = sample_users(synthetic_pool(max(2 * queries, 1000), seed + 1), 2 * queries, seed)
+    pairs = list(zip(users[:queries], users[queries:]))
+    results.append(measure('calculate_compatibility', None, lambda pair: engine.calculate_compatibility(*pair), pairs))
+    scores = [engine.calculate_compatibility(*pair) for pair in pairs]
+    results.append(measure('explain_match', None, explainer.explain_match, scores))
+    
+    for size in sizes:
+        pool = synthetic_pool(size, seed)
+        queries_for_size = sample_users(pool, queries, seed)
+        results.append(measure('find_top_matches', size, lambda user: engine.find_top_matches(user, pool, 5),
+                               queries_for_size))
+        
+        # Full conversations through Flask, scored against this pool
+        webhook.candidate_pool = pool
+        webhook.match_cache.clear()
+        sessions = [(f'bench-{size}-{i}', user) for i, user in enumerate(queries_for_size)]
+        onboarding = [step for session_id, user in sessions for step in conversation(session_id, user)]
+        results.append(measure('webhook_onboarding', size,
+                               lambda body: client.post('/webhook', json=body), onboarding, warmup=0))
+        find_requests = [{'queryResult': {'intent': {'displayName': 'find.matches'}, 'parameters': {}},
+                          'session': f'projects/benchmark/agent/sessions/{session_id}'} for session_id, _ in sessions]
+        results.append(measure('webhook_find_matches', size,
+                               lambda body: client.post('/webhook', json=body), find_requests, warmup=0))
+    
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'queries': queries,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        },
+        'results': results,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def regressions(report: dict, baseline: dict, tolerance: float):
+    """Benchmarks whose p50 is more than `tolerance` slower than in the baseline"""
+    previous = {(row['benchmark'], row['pool_size']): row for row in baseline['results']}
+    slower = []
+    for row in report['results']:
+        before = previous.get((row['benchmark'], row['pool_size']))
+        if before and row['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            slower.append(f"{row['benchmark']} (pool {row['pool_size']}): "
+                          f"p50 {before['p50_ms']}ms -> {row['p50_ms']}ms")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma-separated pool sizes (up to 10000000 with enough memory)')
+    parser.add_argument('--queries', type=int, default=50, help='Calls timed per benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p50 slowdown against the baseline')
+    args = parser.parse_args()
+    
+    report = run([int(size) for size in args.sizes.split(',')], args.queries, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if slower else 0)
+
+if __name__ == '__main__':
+    main()
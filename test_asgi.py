@@ -0,0 +1,99 @@
+"""
+Tests for the ASGI serving mode (backend/asgi.py)
+
+    python -m pytest test_asgi.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+pytest.importorskip('uvicorn')
+
+import app as webhook  # noqa: E402
+import asgi  # noqa: E402
+
+def scope(method, path, headers=()):
+    return {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': b'',
+            'http_version': '1.1', 'scheme': 'http', 'server': ('test', 80), 'headers': list(headers)}
+
+async def call(server, request_scope, chunks=(b'',)):
+    """Run one request; returns (status, list of body messages)"""
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+    
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+    
+    async def send(message):
+        sent.append(message)
+    await server(request_scope, receive, send)
+    return sent[0]['status'], [message for message in sent[1:] if message['body']]
+
+def webhook_body(intent, session, parameters=None):
+    return json.dumps({'session': f'projects/test/agent/sessions/{session}',
+                       'queryResult': {'intent': {'displayName': intent}, 'parameters': parameters or {}}}).encode()
+
+@pytest.fixture
+def server():
+    return asgi.WebhookServer(webhook.app, threads=2, max_pending=2, deadline=0.3)
+
+def test_pass_through(server):
+    status, body = asyncio.run(call(server, scope('GET', '/api/test')))
+    assert status == 200
+    assert json.loads(b''.join(message['body'] for message in body))['status'] == 'API is working'
+
+def test_chunked_request_body(server):
+    request = json.dumps({'user_ids': ['candidate_1'], 'top_n': 1}).encode()
+    headers = [(b'content-type', b'application/json'), (b'transfer-encoding', b'chunked')]
+    status, body = asyncio.run(call(server, scope('POST', '/api/matches/batch', headers), [request[:10], request[10:]]))
+    assert status == 200
+    line = json.loads(b''.join(message['body'] for message in body))
+    assert line['user_id'] == 'candidate_1' and len(line['matches']) == 1
+
+def test_batch_response_streams(server):
+    user_ids = [f'candidate_{i}' for i in range(1, 4)]
+    request = json.dumps({'user_ids': user_ids + ['nobody'], 'top_n': 2}).encode()
+    status, body = asyncio.run(call(server, scope('POST', '/api/matches/batch', [(b'content-type', b'application/json')]),
+                                    [request]))
+    assert status == 200
+    assert len(body) > 1  # Sent as it was produced, not as one buffered body
+    lines = b''.join(message['body'] for message in body).splitlines()
+    assert [json.loads(line)['user_id'] for line in lines] == user_ids + ['nobody']
+
+def webhook_calls_timed():
+    return sum(sum(counts[:-1]) for counts in webhook.WEBHOOK_SECONDS.collect().values())
+
+@pytest.mark.skipif(not webhook.REGISTRY.enabled, reason='METRICS=0')
+def test_webhook_is_timed(server):
+    before = webhook_calls_timed()
+    status, body = asyncio.run(call(server, scope('POST', '/webhook'), [webhook_body('welcome', 'timed')]))
+    assert status == 200 and 'fulfillmentText' in json.loads(body[0]['body'])
+    assert webhook_calls_timed() == before + 1
+
+def test_read_only_intent_gets_fallback(server, monkeypatch):
+    monkeypatch.setattr(asgi, 'handle_intent', lambda *args: time.sleep(0.6) or 'late')
+    status, body = asyncio.run(call(server, scope('POST', '/webhook'), [webhook_body('find.matches', 'slow')]))
+    assert json.loads(body[0]['body'])['fulfillmentText'] == asgi.SEARCHING_REPLY
+    assert server.timeouts == 1
+
+def test_recording_intent_is_never_cut_short(server, monkeypatch):
+    calls = []
+    lock = threading.Lock()
+    
+    def record(intent, parameters, session_id):
+        time.sleep(0.6)
+        with lock:
+            calls.append(intent)
+        return 'recorded'
+    monkeypatch.setattr(asgi, 'handle_intent', record)
+    status, body = asyncio.run(call(server, scope('POST', '/webhook'), [webhook_body('collect.values', 'slow')]))
+    assert json.loads(body[0]['body'])['fulfillmentText'] == 'recorded'
+    assert calls == ['collect.values'] and server.timeouts == 0
@@ -0,0 +1,109 @@
+"""
+Tests for the per-session match cache and its use by the webhook
+
+    python -m pytest test_cache.py
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import app as webhook  # noqa: E402
+from cache import MatchCache  # noqa: E402
+from generator import ProfileGenerator  # noqa: E402
+from pool import CandidatePool  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+class FakeClock:
+    """Monotonic seconds that only move when told to"""
+    
+    def __init__(self):
+        self.now = 100.0
+    
+    def __call__(self):
+        return self.now
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = MatchCache(ttl=10, clock=clock)
+    cache.put('a', 1, ['match'])
+    clock.now += 10
+    assert cache.get('a', 1) == ['match']
+    clock.now += 0.5
+    assert cache.get('a', 1) is None and len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_other_versions_miss_and_drop_the_entry():
+    cache = MatchCache(clock=FakeClock())
+    cache.put('a', (1, 7), ['old'])
+    assert cache.get('a', (1, 8)) is None
+    assert cache.get('a', (1, 7)) is None  # Dropped by the first miss
+    cache.put('a', (1, 8), ['new'])
+    assert cache.get('a', (1, 8)) == ['new']
+
+def test_least_recently_used_are_evicted():
+    cache = MatchCache(max_entries=2, clock=FakeClock())
+    cache.put('a', 0, ['a'])
+    cache.put('b', 0, ['b'])
+    assert cache.get('a', 0) == ['a']
+    cache.put('c', 0, ['c'])
+    assert len(cache) == 2 and cache.get('b', 0) is None
+    assert cache.get('a', 0) == ['a'] and cache.get('c', 0) == ['c']
+    cache.put('a', 1, ['a1'])  # Replacing an entry doesn't evict another
+    assert len(cache) == 2 and cache.get('c', 0) == ['c']
+
+@pytest.fixture
+def client(monkeypatch):
+    """The webhook with an in-memory pool of a few profiles, and no store or recommendations"""
+    pool = CandidatePool()
+    for profile in ProfileGenerator(seed=3, location_count=2).pool(4).snapshot().to_profiles():
+        pool.add(profile)
+    monkeypatch.setattr(webhook, 'candidate_pool', pool)
+    monkeypatch.setattr(webhook, 'profile_store', None)
+    monkeypatch.setattr(webhook, 'RECOMMENDATIONS_DIR', None)
+    monkeypatch.setattr(webhook, 'recommendations', None)
+    monkeypatch.setattr(webhook, 'current_session', SessionStore())
+    monkeypatch.setattr(webhook, 'match_cache', MatchCache())
+    monkeypatch.setattr(webhook, 'users_db', {})
+    monkeypatch.setattr(webhook, 'profile_versions', {})
+    return webhook.app.test_client()
+
+def say(client, session_id, intent, parameters=None):
+    body = {'queryResult': {'intent': {'displayName': intent}, 'parameters': parameters or {}},
+            'session': f'projects/test/agent/sessions/{session_id}'}
+    return client.post('/webhook', json=body).get_json()['fulfillmentText']
+
+def register(client, session_id, name):
+    say(client, session_id, 'welcome')
+    say(client, session_id, 'collect.basic.info', {'person': {'name': name}})
+    say(client, session_id, 'collect.timeline', {'timeline': 'flexible'})
+
+def test_pool_changes_invalidate_cached_matches(client):
+    cache = webhook.match_cache
+    register(client, 'ann', 'Ann')
+    first = say(client, 'ann', 'find.matches')
+    assert say(client, 'ann', 'find.matches') == first
+    assert (cache.hits, cache.misses) == (1, 1)
+    
+    # Another user completing the survey joins the pool: the cached list is stale
+    register(client, 'bob', 'Bob')
+    assert 'Bob' in say(client, 'ann', 'find.matches')
+    assert (cache.hits, cache.misses) == (1, 2)
+    
+    # So is it once they leave
+    assert webhook.candidate_pool.remove('bob')
+    assert say(client, 'ann', 'find.matches') == first
+    assert (cache.hits, cache.misses) == (1, 3)
+
+def test_retaking_the_survey_invalidates_own_matches(client):
+    cache = webhook.match_cache
+    register(client, 'ann', 'Ann')
+    say(client, 'ann', 'find.matches')
+    generation = webhook.candidate_pool.generation
+    say(client, 'ann', 'collect.timeline', {'timeline': 'asap'})
+    assert len(cache) == 0
+    say(client, 'ann', 'find.matches')
+    assert cache.misses == 2 and webhook.candidate_pool.generation > generation
+    assert webhook.get_user_profile('ann').timeline == 'within_1_year'
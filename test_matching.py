@@ -0,0 +1,236 @@
+"""
+Tests for CompatibilityEngine scoring paths
+
+The vectorized paths (score_batch, score_tile, pool search, pruning)
+must give exactly the CompatibilityScores of the pairwise reference,
+in the same order.
+
+    python -m pytest test_matching.py
+"""
+
+import itertools
+import json
+import os
+import random
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from matching import CompatibilityEngine, CandidateBatch, load_values_kernel, scoring_kernel  # noqa: E402
+from models import (UserProfile, CompatibilityScore, SurveyData, CompactProfile, GOAL_VOCABULARY, STYLE_VOCABULARY,  # noqa: E402
+                    encode_goals, label_extras)
+from pool import CandidatePool  # noqa: E402
+from bulk import rank_many  # noqa: E402
+from explain import ExplainabilityEngine  # noqa: E402
+from shared import SharedPool  # noqa: E402
+from storage import ProfileStore  # noqa: E402
+
+def random_profile(i, rng):
+    """A profile with a random subset of rated values and some answers outside the survey"""
+    keys = rng.sample(SurveyData.CORE_VALUES, rng.choice([0, 3, 8, 8, 8]))
+    goals = rng.sample(SurveyData.FAMILY_GOALS + ['odd goal'], rng.choice([0, 1, 2, 3]))
+    return UserProfile(
+        user_id=f'u{i}', name=f'N{i}', age=rng.randint(18, 65), location=rng.choice(['Austin, TX', 'Boston, MA']),
+        values={key: rng.randint(1, 5) for key in keys}, preferences={},
+        communication_style=rng.choice(SurveyData.COMMUNICATION_STYLES + ['weird']),
+        family_goals=goals, timeline=rng.choice(SurveyData.TIMELINES + ['someday']))
+
+@pytest.fixture(scope='module')
+def profiles():
+    rng = random.Random(4)
+    return [random_profile(i, rng) for i in range(1500)]
+
+@pytest.fixture(scope='module')
+def cross_engine():
+    return CompatibilityEngine(values_mode='cross')
+
+def test_scoring_kernel_is_psd():
+    raw = load_values_kernel()
+    assert np.linalg.eigvalsh(raw).min() < 0  # The shipped matrix isn't PSD
+    kernel = scoring_kernel(raw)
+    assert np.allclose(kernel, kernel.T) and np.linalg.eigvalsh(kernel).min() > -1e-9
+    assert np.abs(kernel - raw).max() < 0.1
+    assert np.array_equal(kernel, np.round(kernel * 2 ** 20) / 2 ** 20)
+
+def test_cross_neutral_ratings_score_half(cross_engine):
+    values = np.array([[3] * 8, [0] * 8, [5, 4, 3, 2, 1, 0, 3, 5]], dtype=np.int8)
+    scores, _ = cross_engine._batch_cross_values_scores(values[2], values)
+    assert scores[0] == scores[1] == 0.5 and scores[2] == 1.0
+    scores, _ = cross_engine._batch_cross_values_scores(values[0], values)
+    assert (scores == 0.5).all()
+
+def test_cross_scores_discriminate(cross_engine):
+    ratings = np.random.default_rng(0).integers(1, 6, (4000, 8)).astype(np.int8)
+    scores = cross_engine.score_tile(CandidateBatch.from_arrays(ratings[:100], *[np.zeros(100, dtype=dtype)
+                                                                                 for dtype in (np.uint64, np.uint8, np.uint8)]),
+                                     CandidateBatch.from_arrays(ratings, *[np.zeros(4000, dtype=dtype)
+                                                                           for dtype in (np.uint64, np.uint8, np.uint8)])).values
+    assert scores.min() >= 0 and scores.max() <= 1
+    assert 0.3 < np.median(scores) < 0.7
+    assert (scores > 0.8).mean() < 0.3
+    # Opposite ratings around the midpoint are as far apart as it gets
+    opposite, _ = cross_engine._batch_cross_values_scores(ratings[0], (6 - ratings[:1]).astype(np.int8))
+    assert opposite[0] == 0.0
+
+def test_cross_tile_batch_and_pairwise_agree(cross_engine, profiles):
+    batch = CandidateBatch(profiles)
+    queries = batch.take_columns(np.arange(40))
+    tile = cross_engine.score_tile(queries, batch)
+    for row, user in enumerate(profiles[:40]):
+        scores = cross_engine.score_batch(user, batch)
+        assert np.array_equal(tile.values[row], scores.values)
+        assert np.array_equal(tile.overall[row], scores.overall)
+        single = [cross_engine.score_batch(user, batch.take_columns([i])).values[0] for i in range(0, 1500, 97)]
+        assert np.array_equal(single, scores.values[::97])
+
+@pytest.mark.parametrize('values_mode', CompatibilityEngine.VALUES_MODES)
+def test_batch_scores_match_pairwise(values_mode, profiles):
+    engine = CompatibilityEngine(values_mode=values_mode)
+    batch = CandidateBatch(profiles[:300])
+    for user in profiles[:20]:
+        scores = engine.score_batch(user, batch)
+        for row, candidate in enumerate(profiles[:300]):
+            assert engine._score_from_batch(user.user_id, candidate.user_id, scores, row) == \
+                engine.calculate_compatibility(user, candidate)
+
+@pytest.mark.parametrize('values_mode', CompatibilityEngine.VALUES_MODES)
+def test_search_matches_pairwise(values_mode, profiles, tmp_path):
+    engine = CompatibilityEngine(values_mode=values_mode)
+    pool = CandidatePool()
+    for profile in profiles:
+        pool.add(profile)
+    shared = SharedPool(ProfileStore(str(tmp_path)))
+    for profile in profiles[:1000]:
+        shared.add(profile)
+    shared.store.checkpoint(shared)
+    for profile in profiles[1000:]:
+        shared.add(profile)
+    for user in profiles[:30]:
+        for top_n in (1, 5, 40):
+            expected = engine._find_top_matches_pairwise(user, profiles, top_n)
+            assert engine.find_top_matches(user, pool, top_n) == expected
+            assert engine.find_top_matches(user, profiles, top_n) == expected
+            assert engine.find_top_matches(user, shared, top_n) == expected
+        expected = engine._find_top_matches_pairwise(user, profiles, 5, location='boston, ma')
+        assert engine.find_top_matches(user, pool, 5, location='boston, ma') == expected
+
+@pytest.mark.parametrize('values_mode', CompatibilityEngine.VALUES_MODES)
+def test_pruned_search_matches_pairwise(values_mode, profiles, monkeypatch):
+    monkeypatch.setattr(CompatibilityEngine, 'PRUNE_MIN_ROWS', 1)
+    engine = CompatibilityEngine(values_mode=values_mode)
+    # Copies under new ids tie with their originals on every score
+    candidates = profiles[:500] + [UserProfile.from_dict(dict(profile.to_dict(), user_id=f'copy-{i}'))
+                                   for i, profile in enumerate(profiles[:500:3])]
+    pool = CandidatePool()
+    for profile in candidates:
+        pool.add(profile)
+    for user in profiles[:25] + profiles[1000:1005]:
+        for top_n in (1, 3, 10, 60):
+            expected = engine._find_top_matches_pairwise(user, candidates, top_n)
+            assert engine.find_top_matches(user, pool, top_n) == expected
+            assert engine.find_top_matches(user, candidates, top_n) == expected
+    assert any(a.overall_score == b.overall_score for a, b in zip(expected, expected[1:]))
+
+@pytest.mark.parametrize('values_mode', CompatibilityEngine.VALUES_MODES)
+def test_rank_many_matches_search(values_mode, profiles):
+    engine = CompatibilityEngine(values_mode=values_mode)
+    pool = CandidatePool()
+    for profile in profiles:
+        pool.add(profile)
+    users = profiles[:150] + [random_profile(9999, random.Random(9))]
+    ranked = list(rank_many(engine, users, pool, top_n=7))
+    assert [user for user, _ in ranked] == users
+    for user, matches in ranked:
+        assert matches == engine.find_top_matches(user, pool, 7)
+
+def as_saved(profile):
+    """A profile's dict as encoding keeps it: family goals are a set"""
+    data = profile.to_dict()
+    return dict(data, family_goals=sorted(set(data['family_goals'])))
+
+def test_unknown_labels_share_one_code():
+    labels = len(GOAL_VOCABULARY.labels), len(STYLE_VOCABULARY.labels)
+    unknown = [random_profile(0, random.Random(0)) for _ in range(3)]
+    for i, profile in enumerate(unknown):
+        profile.family_goals = [f'goal {j}' for j in range(100 * i, 100 * i + 100)] + ['adoption']
+        profile.communication_style = f'style {i}'
+    batch = CandidateBatch(unknown * 200)
+    assert (len(GOAL_VOCABULARY.labels), len(STYLE_VOCABULARY.labels)) == labels
+    assert (batch.styles == STYLE_VOCABULARY.other_code).all()
+    assert encode_goals(unknown[0].family_goals) == encode_goals(['adoption', 'anything else'])
+    assert STYLE_VOCABULARY.lookup('style 0') is None
+    # The labels themselves are kept next to the shared code
+    for profile in unknown:
+        assert as_saved(CompactProfile.from_profile(profile)) == as_saved(profile)
+    assert batch.extras[400]['communication_style'] == 'style 1'
+
+def test_snapshots_keep_unknown_labels(profiles, tmp_path):
+    store = ProfileStore(str(tmp_path))
+    pool = CandidatePool()
+    for profile in profiles[:200]:
+        pool.add(profile)
+    pool.remove(profiles[0].user_id)
+    pool.compact()
+    store.checkpoint(pool)
+    reloaded = store.load()
+    assert len(reloaded.snapshot().extras) == sum(1 for profile in profiles[1:200] if label_extras(profile))
+    for profile in profiles[1:200]:
+        assert as_saved(reloaded.get(profile.user_id)) == as_saved(profile)
+    shared = SharedPool(store)
+    for profile in profiles[1:200:7]:
+        assert as_saved(shared.get(profile.user_id)) == as_saved(profile)
+
+def test_communication_scores_match_pairwise_for_every_style_pair():
+    engine = CompatibilityEngine()
+    rng = random.Random(2)
+    styles = SurveyData.COMMUNICATION_STYLES + ['weird', 'odd', 'weird']
+    users = [random_profile(i, rng) for i in range(len(styles))]
+    for user, style in zip(users, styles):
+        user.communication_style = style
+    expected = np.array([[engine._calculate_communication_score(user, other) for other in users] for user in users])
+    assert expected[-3, -1] == 1.0 and expected[-3, -2] == 0.4
+    batch = CandidateBatch(users)
+    for row, user in enumerate(users):
+        assert np.array_equal(engine.score_batch(user, batch).communication, expected[row])
+    assert np.array_equal(engine.score_tile(batch.take_columns(np.arange(len(users))), batch).communication, expected)
+
+def test_unknown_labels_score_as_strings_on_every_path():
+    engine = CompatibilityEngine()
+    rng = random.Random(1)
+    user, other = random_profile(0, rng), random_profile(1, rng)
+    user.communication_style, other.communication_style = 'one', 'two'
+    user.family_goals, other.family_goals = ['odd'], ['odder']
+    score = engine.calculate_compatibility(user, other)
+    assert score.communication_score == 0.4 and score.goals_score == 0.0
+    assert engine.find_top_matches(user, [other], 1) == [score]
+    # Shared and distinct unlisted goals count one by one, as strings
+    pairs = [(['adoption', 'odd', 'odder'], ['adoption', 'odd', 'x', 'y']), (['odd', 'odd'], ['odd']), (['odd'], [])]
+    batch = CandidateBatch([other] * len(pairs))
+    for row, (goals, other_goals) in enumerate(pairs):
+        batch.goals[row] = encode_goals(other_goals)
+        batch.extras[row] = dict(batch.extras[row], family_goals=[goal for goal in other_goals if goal != 'adoption'])
+    queries = [UserProfile.from_dict(dict(user.to_dict(), family_goals=goals)) for goals, _ in pairs]
+    tile = engine.score_tile(CandidateBatch(queries), batch)
+    for row, query in enumerate(queries):
+        expected = [engine._calculate_goals_score(query, UserProfile.from_dict(dict(other.to_dict(), family_goals=goals)))
+                    for _, goals in pairs]
+        assert np.array_equal(engine.score_batch(query, batch).goals, expected)
+        assert np.array_equal(tile.goals[row], expected)
+    assert expected == [0.25, 1.0, 0.5] and tile.goals[0, 0] == 0.4
+
+def test_cached_explanations_match_uncached():
+    cached = ExplainabilityEngine()
+    # Two scores per band, and repeats, so every band and best-area combination shows up with ties
+    dimension_scores = (0.2, 0.45, 0.5, 0.6, 0.7, 0.95)
+    keys = set()
+    for dimensions in itertools.product(dimension_scores, repeat=4):
+        for overall in (0.3, 0.5, 0.6, 0.65, 0.7, 0.75, 0.8, 0.9):
+            score = CompatibilityScore('a', 'b', overall, *dimensions, explanation='')
+            keys.add(cached._band_key(score))
+            # A fresh engine builds the text from this very score
+            assert json.dumps(cached.explain_match(score)) == json.dumps(ExplainabilityEngine().explain_match(score))
+    assert {key[:4] for key in keys} == set(itertools.product(range(3), repeat=4))
+    assert {key[4] for key in keys} == set(range(5)) and {key[5] for key in keys} == {None, 0, 1, 2, 3}
+    assert len(cached._templates) == len(keys)
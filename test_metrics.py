@@ -0,0 +1,111 @@
+"""
+Tests for the latency histograms, their text rendering and GET /metrics
+
+    python -m pytest test_metrics.py
+"""
+
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import app as webhook  # noqa: E402
+from metrics import CONTENT_TYPE, Histogram, Registry, instrument, timed  # noqa: E402
+
+def sample(text, line_prefix):
+    """Value of the one sample line starting with line_prefix (0 if absent)"""
+    values = [float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_prefix + ' ')]
+    assert len(values) <= 1
+    return values[0] if values else 0.0
+
+@pytest.mark.skipif(not webhook.REGISTRY.enabled, reason='METRICS=0')
+def test_scrape_after_webhook_call():
+    client = webhook.app.test_client()
+    before = client.get('/metrics').get_data(as_text=True)
+    body = {'queryResult': {'intent': {'displayName': 'welcome'}, 'parameters': {}},
+            'session': 'projects/test/agent/sessions/metrics'}
+    assert client.post('/webhook', json=body).status_code == 200
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.content_type == CONTENT_TYPE
+    after = response.get_data(as_text=True)
+    assert '# TYPE webhook_request_seconds histogram' in after
+    assert sample(after, 'webhook_request_seconds_count') == sample(before, 'webhook_request_seconds_count') + 1
+    welcome = 'intent_handler_seconds_count{intent="welcome"}'
+    assert sample(after, welcome) == sample(before, welcome) + 1
+    assert sample(after, 'webhook_request_seconds_bucket{le="+Inf"}') == sample(after, 'webhook_request_seconds_count')
+    assert sample(after, 'sessions_in_memory') >= 1
+
+def test_text_rendering():
+    registry = Registry(enabled=True)
+    registry.gauge('pool_profiles', 'Profiles', lambda: 3)
+    registry.gauge('hits_total', 'Hits', lambda: 1.5, kind='counter')
+    registry.gauge('by_kind', 'By kind', lambda: {'a"b': 2}, label='kind')
+    histogram = registry.histogram('call_seconds', 'Call time', label='path', buckets=(0.1, 1.0))
+    histogram.observe(0.05, 'x\\y')
+    histogram.observe(0.5, 'x\\y')
+    histogram.observe(3.0, 'x\\y')
+    assert registry.render() == '\n'.join([
+        '# HELP pool_profiles Profiles', '# TYPE pool_profiles gauge', 'pool_profiles 3',
+        '# HELP hits_total Hits', '# TYPE hits_total counter', 'hits_total 1.5',
+        '# HELP by_kind By kind', '# TYPE by_kind gauge', 'by_kind{kind="a\\"b"} 2',
+        '# HELP call_seconds Call time', '# TYPE call_seconds histogram',
+        'call_seconds_bucket{path="x\\\\y",le="0.1"} 1',
+        'call_seconds_bucket{path="x\\\\y",le="1.0"} 2',
+        'call_seconds_bucket{path="x\\\\y",le="+Inf"} 3',
+        'call_seconds_sum{path="x\\\\y"} 3.55',
+        'call_seconds_count{path="x\\\\y"} 3',
+    ]) + '\n'
+
+def test_thread_shards_are_merged():
+    histogram = Histogram('h', 'h', buckets=(1.0,))
+    release = threading.Event()
+    
+    def observe_then_wait(count, wait):
+        for _ in range(count):
+            histogram.observe(0.5)
+        histogram.observe(2.0, 'slow')
+        if wait:
+            release.wait()
+    
+    finished = [threading.Thread(target=observe_then_wait, args=(count, False)) for count in (1, 2, 3)]
+    running = threading.Thread(target=observe_then_wait, args=(10, True))
+    for thread in finished + [running]:
+        thread.start()
+    for thread in finished:
+        thread.join()
+    histogram.observe(0.25)
+    
+    expected = {'': [17, 0, 7.75], 'slow': [0, 4, 8.0]}
+    assert histogram.collect() == expected
+    assert histogram.collect() == expected  # Exited threads' shards are folded in once
+    assert len(histogram._shards) == 2
+    release.set()
+    running.join()
+    assert histogram.collect() == expected and len(histogram._shards) == 1
+
+def test_disabled_registry_leaves_functions_alone():
+    registry = Registry(enabled=False)
+    histogram = registry.histogram('h', 'h')
+    
+    def function():
+        return 'result'
+    
+    assert timed(histogram, registry=registry)(function) is function
+    
+    class Engine:
+        def score(self):
+            return 1
+    
+    engine = Engine()
+    instrument(engine, 'score', histogram, registry=registry)
+    assert 'score' not in vars(engine) and engine.score() == 1
+    assert histogram.collect() == {}
+    assert registry.render() == '# HELP h h\n# TYPE h histogram\n'
+    
+    enabled = Registry(enabled=True)
+    timed_function = timed(histogram, 'on', registry=enabled)(function)
+    assert timed_function is not function and timed_function() == 'result'
+    assert histogram.collect()['on'][-2] == 0 and sum(histogram.collect()['on'][:-1]) == 1
@@ -0,0 +1,67 @@
+"""
+Tests for extracting survey vocabulary codes from Dialogflow parameters
+
+    python -m pytest test_normalize.py
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from models import GOAL_VOCABULARY, STYLE_VOCABULARY, TIMELINE_VOCABULARY  # noqa: E402
+from normalize import EntityNormalizer, load_synonyms  # noqa: E402
+
+@pytest.fixture(scope='module')
+def normalizer():
+    return EntityNormalizer.from_agent()
+
+def goals(codes):
+    return [GOAL_VOCABULARY.decode(code) for code in codes]
+
+def timelines(codes):
+    return [TIMELINE_VOCABULARY.decode(code) for code in codes]
+
+def test_labels_and_agent_synonyms_hit(normalizer):
+    assert goals(normalizer.extract({'family-goals': 'We want to adopt'}, 'family_goals')) == ['adoption']
+    assert goals(normalizer.extract({'family-goals': ['blended_family', 'bio children']}, 'family_goals')) == \
+        ['blended_family', 'biological_children']
+    assert normalizer.extract({'communication-style': 'pretty blunt'}, 'communication_style') == \
+        [STYLE_VOCABULARY.encode('direct_honest')]
+    assert timelines(normalizer.extract({'timeline': 'asap'}, 'timeline')) == ['within_1_year']
+
+def test_longest_overlapping_synonym_wins(normalizer):
+    # "within 1 year" also contains "1 year"; "extended family close" contains "extended family" and "close family"
+    assert timelines(normalizer.find('timeline', 'within 1 year')) == ['within_1_year']
+    assert timelines(normalizer.find('timeline', '3-5 years or 5+ years')) == ['3_to_5_years', '5_plus_years']
+    assert goals(normalizer.find('family_goals', 'extended family close')) == ['extended_family_close']
+    assert goals(normalizer.find('family_goals', 'single parent support, then single parenting')) == \
+        ['single_parent_support']
+    # Whole words only: "opening" is not "open"
+    assert normalizer.find('timeline', 'reopening soon') == [TIMELINE_VOCABULARY.encode('within_1_year')]
+
+def test_case_and_punctuation_are_ignored(normalizer):
+    assert goals(normalizer.find('family_goals', 'ADOPTION!')) == ['adoption']
+    assert goals(normalizer.find('family_goals', 'Co-Parenting,  Blended   Family.')) == ['co_parenting', 'blended_family']
+    assert normalizer.find('communication_style', '(Analytical_Logical)') == [STYLE_VOCABULARY.encode('analytical_logical')]
+
+def test_unknown_text_yields_nothing(normalizer):
+    labels = len(GOAL_VOCABULARY.labels), len(STYLE_VOCABULARY.labels), len(TIMELINE_VOCABULARY.labels)
+    assert normalizer.extract({'family-goals': 'a sailboat'}, 'family_goals') == []
+    assert normalizer.extract({'communication-style': ''}, 'communication_style') == []
+    assert normalizer.extract({'timeline': ['someday', 'never']}, 'timeline') == []
+    # Another entity's phrase is not this entity's value
+    assert normalizer.find('timeline', 'adoption') == []
+    assert (len(GOAL_VOCABULARY.labels), len(STYLE_VOCABULARY.labels), len(TIMELINE_VOCABULARY.labels)) == labels
+
+def test_missing_field_searches_other_parameters(normalizer):
+    parameters = {'any': 'maybe within a year', 'number': 3}
+    assert timelines(normalizer.extract(parameters, 'timeline')) == ['within_1_year']
+    # A present but empty field is not searched around
+    assert normalizer.extract(dict(parameters, timeline=''), 'timeline') == []
+
+def test_without_agent_only_labels_and_legacy_keywords(tmp_path):
+    normalizer = EntityNormalizer(load_synonyms(str(tmp_path / 'missing.json')))
+    assert timelines(normalizer.find('timeline', '1-3 or flexible timing')) == ['1_to_3_years', 'flexible_timing']
+    assert normalizer.find('timeline', 'asap') == []
@@ -0,0 +1,199 @@
+"""
+Tests for the candidate pool, the profile store's write log and bulk import
+
+    python -m pytest test_pool.py
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from generator import ProfileGenerator  # noqa: E402
+from pool import CandidatePool  # noqa: E402
+from shared import SharedPool  # noqa: E402
+import storage  # noqa: E402
+from storage import ProfileStore  # noqa: E402
+
+@pytest.fixture(scope='module')
+def generator():
+    return ProfileGenerator(seed=5, location_count=8)
+
+@pytest.fixture(scope='module')
+def profiles(generator):
+    return generator.pool(200).snapshot().to_profiles()
+
+def import_columns(generator, count, start=0):
+    """Columns as CandidatePool.extend takes them (locations as city strings)"""
+    columns = generator.columns(start, count, np.random.default_rng(start))
+    columns['locations'] = np.array(generator.location_labels, dtype=object)[columns['locations']]
+    return columns
+
+def live_ids(pool):
+    return sorted(profile.user_id for profile in pool.snapshot().to_profiles())
+
+def test_add_get_and_replace(profiles):
+    pool = CandidatePool()
+    for profile in profiles[:10]:
+        pool.add(profile)
+    assert len(pool) == 10 and profiles[3].user_id in pool
+    assert pool.get(profiles[3].user_id) == profiles[3]
+    generation = pool.generation
+    replacement = profiles[10]
+    replacement.user_id, original_id = profiles[3].user_id, replacement.user_id
+    try:
+        pool.add(replacement)
+        assert len(pool) == 10 and pool.generation > generation
+        assert pool.get(profiles[3].user_id).name == replacement.name
+    finally:
+        replacement.user_id = original_id
+
+def test_remove(profiles):
+    pool = CandidatePool()
+    for profile in profiles[:10]:
+        pool.add(profile)
+    generation = pool.generation
+    assert pool.remove(profiles[0].user_id)
+    assert not pool.remove(profiles[0].user_id)
+    assert not pool.remove('nobody')
+    assert profiles[0].user_id not in pool and pool.get(profiles[0].user_id) is None
+    assert len(pool) == 9 and pool.generation == generation + 1
+    assert profiles[0].user_id not in live_ids(pool)
+
+def test_remove_compacts(profiles):
+    pool = CandidatePool()
+    for profile in profiles[:100]:
+        pool.add(profile)
+    for profile in profiles[:30]:
+        pool.remove(profile.user_id)
+    assert len(pool) == 70
+    assert pool._dead <= CandidatePool.COMPACT_RATIO * pool._size
+    assert pool._size < 100  # Compacted at least once
+    assert live_ids(pool) == sorted(profile.user_id for profile in profiles[30:100])
+    for profile in profiles[30:100]:
+        assert pool.get(profile.user_id) == profile
+
+def test_add_compacts_replaced_rows(profiles):
+    pool = CandidatePool()
+    for profile in profiles[:20]:
+        pool.add(profile)
+    for _ in range(3):
+        for profile in profiles[:20]:
+            row = pool.add(profile)
+            assert pool._row_of[profile.user_id] == row
+            assert pool.snapshot().user_ids[row] == profile.user_id
+    assert pool._compactions > 0
+    assert pool._dead <= CandidatePool.COMPACT_RATIO * pool._size
+    assert live_ids(pool) == sorted(profile.user_id for profile in profiles[:20])
+
+def test_compact_keeps_views_consistent(profiles):
+    pool = CandidatePool()
+    for profile in profiles[:20]:
+        pool.add(profile)
+    view = pool.snapshot()
+    pool.remove(profiles[0].user_id)
+    pool.compact()
+    assert view.alive.all() and len(view) == 20
+    assert view.compact_profile(0).to_profile() == profiles[0]
+    assert live_ids(pool) == sorted(profile.user_id for profile in profiles[1:20])
+
+def test_view_ignores_later_writes(profiles):
+    pool = CandidatePool()
+    for profile in profiles[:20]:
+        pool.add(profile)
+    view = pool.snapshot()
+    pool.remove(profiles[1].user_id)
+    pool.add(profiles[2])
+    assert view.alive.all()
+    # The re-added user's row in the view is still theirs to skip
+    assert 2 not in view.eligible_rows(profiles[2].user_id)
+    assert not view.eligible_mask(profiles[2].user_id, np.arange(20))[2]
+    assert len(view.eligible_rows('nobody')) == 20
+
+def test_extend_reimport_compacts(generator):
+    pool = CandidatePool()
+    columns = import_columns(generator, 500)
+    pool.extend(**columns)
+    first = live_ids(pool)
+    rows = pool.extend(**columns)
+    assert len(pool) == 500 and live_ids(pool) == first
+    assert pool._size == 500 and pool._dead == 0
+    assert [pool._row_of[user_id] for user_id in columns['user_ids']] == rows.tolist()
+    reference = CandidatePool.from_columns(location_labels=generator.location_labels,
+                                           **generator.columns(0, 500, np.random.default_rng(0)))
+    assert pool.snapshot().to_profiles() == reference.snapshot().to_profiles()
+
+def test_extend_last_duplicate_wins(generator):
+    pool = CandidatePool()
+    columns = import_columns(generator, 10)
+    columns['user_ids'][7] = columns['user_ids'][2]
+    pool.extend(**columns)
+    assert len(pool) == 9
+    assert pool.get(columns['user_ids'][2]).name == columns['names'][7]
+
+def test_store_replays_adds_and_removes(tmp_path, profiles):
+    store = ProfileStore(str(tmp_path))
+    pool = store.load()
+    for profile in profiles[:10]:
+        store.add(pool, profile)
+    store.remove(pool, profiles[4].user_id)
+    store.remove(pool, 'nobody')
+    
+    reloaded = ProfileStore(str(tmp_path)).load()
+    assert live_ids(reloaded) == live_ids(pool)
+    assert profiles[4].user_id not in reloaded
+    assert reloaded.get(profiles[5].user_id) == profiles[5]
+
+def test_store_replays_after_checkpoint_and_import(tmp_path, generator, profiles):
+    store = ProfileStore(str(tmp_path))
+    pool = store.load()
+    pool.extend(**import_columns(generator, 300, start=1000))
+    store.checkpoint(pool)
+    store.remove(pool, 'synthetic-1007')
+    store.add(pool, profiles[0])
+    
+    reloaded = ProfileStore(str(tmp_path)).load()
+    assert len(reloaded) == 300
+    assert 'synthetic-1007' not in reloaded and profiles[0].user_id in reloaded
+    assert live_ids(reloaded) == live_ids(pool)
+
+def test_loaded_pool_decodes_only_rows_read(tmp_path, profiles, monkeypatch):
+    store = ProfileStore(str(tmp_path))
+    expected = CandidatePool()
+    for profile in profiles[:150]:
+        expected.add(profile)
+    store.checkpoint(expected)
+    decoded = []
+    unescape = storage._unescape
+    monkeypatch.setattr(storage, '_unescape', lambda line: decoded.append(line) or unescape(line))
+    pool = store.load()
+    assert decoded == []
+    assert pool.get(profiles[3].user_id) == profiles[3] and len(decoded) < 10
+    
+    # Writes on top of the lazy rows behave as on an in-memory pool
+    view = pool.snapshot()
+    for target in (pool, expected):
+        target.add(profiles[160])
+        target.add(profiles[3])
+        target.remove(profiles[10].user_id)
+        assert not target.remove(profiles[10].user_id)
+    assert len(decoded) < 20
+    assert live_ids(pool) == live_ids(expected) and len(pool) == len(expected) == 150
+    assert view.eligible_rows(profiles[3].user_id).tolist() == [row for row in range(150) if row != 3]
+    for profile in profiles[:40]:
+        pool.remove(profile.user_id)
+        expected.remove(profile.user_id)
+    assert live_ids(pool) == live_ids(expected) and pool.get(profiles[160].user_id) == profiles[160]
+
+def test_shared_pool_refresh_applies_removes(tmp_path, profiles):
+    writer = SharedPool(ProfileStore(str(tmp_path)))
+    reader = SharedPool(ProfileStore(str(tmp_path)))
+    for profile in profiles[:5]:
+        writer.add(profile)
+    assert len(reader) == 5
+    assert writer.remove(profiles[1].user_id)
+    assert len(reader) == 4 and profiles[1].user_id not in reader
+    writer.add(profiles[5])
+    assert len(reader) == 5 and reader.get(profiles[5].user_id) == profiles[5]
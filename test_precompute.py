@@ -0,0 +1,110 @@
+"""
+Tests for the offline precompute job and RecommendationStore
+
+    python -m pytest test_precompute.py
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from generator import ProfileGenerator  # noqa: E402
+from matching import CompatibilityEngine  # noqa: E402
+from models import UserProfile  # noqa: E402
+from precompute import RecommendationStore, precompute, main  # noqa: E402
+from storage import ProfileStore  # noqa: E402
+
+TOP_K = 5
+
+@pytest.fixture(scope='module')
+def generated():
+    """300 profiles to precompute plus 40 to register afterwards"""
+    profiles = ProfileGenerator(seed=11, location_count=6).pool(340).snapshot().to_profiles()
+    return profiles[:300], profiles[300:]
+
+def write_store(directory, profiles):
+    store = ProfileStore(directory)
+    pool = store.load()
+    for profile in profiles:
+        pool.add(profile)
+    store.checkpoint(pool)
+    return store
+
+def all_lists(recommendations, user_ids):
+    return {user_id: recommendations.get(user_id) for user_id in user_ids}
+
+@pytest.mark.parametrize('values_mode', ['aligned', 'cross'])
+def test_precomputed_lists_match_live_search(tmp_path, generated, values_mode):
+    base, _ = generated
+    store = write_store(str(tmp_path / 'store'), base)
+    precompute(str(tmp_path / 'store'), str(tmp_path / 'recs'), top_k=TOP_K, values_mode=values_mode)
+    recommendations = RecommendationStore(str(tmp_path / 'recs'))
+    engine = CompatibilityEngine(values_mode=values_mode)
+    pool = store.load()
+    for user in base:
+        live = engine.find_top_matches(user, pool, TOP_K)
+        assert recommendations.get(user.user_id) == [(match.user2_id, match.overall_score) for match in live]
+
+def test_merged_profiles_match_a_rerun(tmp_path, generated):
+    base, later = generated
+    write_store(str(tmp_path / 'store'), base)
+    precompute(str(tmp_path / 'store'), str(tmp_path / 'recs'), top_k=TOP_K)
+    recommendations = RecommendationStore(str(tmp_path / 'recs'))
+    for profile in later:
+        recommendations.add_profile(profile)
+    
+    write_store(str(tmp_path / 'rerun'), base + later)
+    precompute(str(tmp_path / 'rerun'), str(tmp_path / 'rerun-recs'), top_k=TOP_K)
+    rerun = RecommendationStore(str(tmp_path / 'rerun-recs'))
+    user_ids = [profile.user_id for profile in base + later]
+    assert len(recommendations) == len(rerun) == 340
+    assert all_lists(recommendations, user_ids) == all_lists(rerun, user_ids)
+
+def test_merges_reach_other_workers(tmp_path, generated):
+    base, later = generated
+    write_store(str(tmp_path / 'store'), base)
+    precompute(str(tmp_path / 'store'), str(tmp_path / 'recs'), top_k=TOP_K)
+    writer = RecommendationStore(str(tmp_path / 'recs'))
+    reader = RecommendationStore(str(tmp_path / 'recs'))
+    user_ids = [profile.user_id for profile in base + later]
+    
+    for profile in later[:20]:
+        writer.add_profile(profile)
+    assert writer.remove(base[0].user_id)
+    assert not reader.remove(base[0].user_id)
+    for profile in later[20:]:
+        reader.add_profile(profile)
+    assert len(writer) == len(reader) == 339
+    assert all_lists(writer, user_ids) == all_lists(reader, user_ids)
+    assert reader.get(base[0].user_id) is None and reader.get(later[0].user_id)
+    
+    # A worker that opens the directory later replays the same log
+    assert all_lists(RecommendationStore(str(tmp_path / 'recs')), user_ids) == all_lists(writer, user_ids)
+    # Per-row arrays grow by doubling rather than per registration
+    assert len(writer._alive) == 600 and len(writer._added_columns[0]) == 300
+
+def test_unencodable_profile_is_not_logged(tmp_path, generated):
+    base, later = generated
+    write_store(str(tmp_path / 'store'), base)
+    precompute(str(tmp_path / 'store'), str(tmp_path / 'recs'), top_k=TOP_K)
+    recommendations = RecommendationStore(str(tmp_path / 'recs'))
+    profile = UserProfile.from_dict(dict(later[0].to_dict(), values={'family_first': 500}))
+    with pytest.raises(ValueError):
+        recommendations.add_profile(profile)
+    assert os.path.getsize(tmp_path / 'recs' / 'merges.log') == 0
+    assert recommendations.get(profile.user_id) is None
+
+@pytest.mark.parametrize('top_k', [0, -3])
+def test_top_k_below_one_is_rejected(tmp_path, generated, monkeypatch, top_k):
+    base, _ = generated
+    write_store(str(tmp_path / 'store'), base[:20])
+    with pytest.raises(ValueError, match='top_k'):
+        precompute(str(tmp_path / 'store'), str(tmp_path / 'recs'), top_k=top_k)
+    assert not os.path.exists(tmp_path / 'recs')
+    monkeypatch.setattr(sys, 'argv', ['precompute.py', str(tmp_path / 'store'), str(tmp_path / 'recs'),
+                                      f'--top-k={top_k}'])
+    with pytest.raises(SystemExit):
+        main()
+    assert not os.path.exists(tmp_path / 'recs')
@@ -0,0 +1,49 @@
+"""
+Tests for the sampling profiler and POST /admin/profile
+
+    python -m pytest test_profiler.py
+"""
+
+import math
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import app as webhook  # noqa: E402
+from profiler import SamplingProfiler  # noqa: E402
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(webhook, 'PROFILER_TOKEN', 'secret')
+    return webhook.app.test_client()
+
+def test_profile_returns_after_seconds():
+    profiler = SamplingProfiler(interval=0.001, include_idle=True)
+    stacks = profiler.profile(0.05)
+    assert not profiler.running and profiler.samples > 0
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks.splitlines())
+
+@pytest.mark.parametrize('seconds', [math.nan, math.inf, -1.0, 0.0])
+def test_start_rejects_bad_durations(seconds):
+    profiler = SamplingProfiler()
+    with pytest.raises(ValueError):
+        profiler.start(seconds)
+    assert not profiler.running
+
+def test_endpoint_needs_token(client, monkeypatch):
+    assert client.post('/admin/profile?seconds=0.01').status_code == 403
+    monkeypatch.setattr(webhook, 'PROFILER_TOKEN', None)
+    assert client.post('/admin/profile?seconds=0.01', headers={'X-Profiler-Token': 'secret'}).status_code == 404
+
+@pytest.mark.parametrize('seconds', ['nan', 'NaN', 'inf', '-inf', '-1', '0', 'soon'])
+def test_endpoint_rejects_bad_durations(client, seconds):
+    response = client.post(f'/admin/profile?seconds={seconds}', headers={'X-Profiler-Token': 'secret'})
+    assert response.status_code == 400
+    assert not webhook.profiler.running
+
+def test_endpoint_profiles(client):
+    response = client.post('/admin/profile?seconds=0.05', headers={'X-Profiler-Token': 'secret'})
+    assert response.status_code == 200
+    assert int(response.headers['X-Profile-Samples']) > 0
@@ -0,0 +1,138 @@
+"""
+Round-trip tests for backend/serialization.py
+
+Every encoding must decode to exactly the data the code produced before
+(dataclasses.asdict, UserProfile.to_dict, json.dumps, Flask's jsonify),
+and the stdlib fallback must match it byte for byte.
+
+    python -m pytest test_serialization.py
+"""
+
+import dataclasses
+import datetime
+import json
+import os
+import sys
+import numpy as np
+import pytest
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import serialization  # noqa: E402
+from explain import ExplainabilityEngine  # noqa: E402
+from generator import ProfileGenerator  # noqa: E402
+from matching import CompatibilityEngine  # noqa: E402
+from models import CompatibilityScore  # noqa: E402
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    """Run a test with orjson and with the stdlib fallback"""
+    if request.param == 'json':
+        monkeypatch.setattr(serialization, 'orjson', None)
+    elif serialization.orjson is None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+@pytest.fixture(scope='module')
+def profiles():
+    return ProfileGenerator(seed=3, location_count=10).pool(300).snapshot().to_profiles()
+
+@pytest.fixture(scope='module')
+def matches(profiles):
+    engine = CompatibilityEngine()
+    return [engine.find_top_matches(user, profiles, top_n=5) for user in profiles[:20]]
+
+def test_score_records_round_trip(matches):
+    for score in (score for ranked in matches for score in ranked):
+        assert serialization.score_from_record(serialization.score_record(score)) == score
+        assert serialization.score_dict(score) == dataclasses.asdict(score)
+        assert list(serialization.score_dict(score)) == list(dataclasses.asdict(score))
+
+def test_profile_dict_matches_to_dict(profiles):
+    for profile in profiles:
+        assert serialization.profile_dict(profile) == profile.to_dict()
+        assert list(serialization.profile_dict(profile)) == list(profile.to_dict())
+
+def test_dumps_round_trip(encoder, matches, profiles):
+    scores = [score for ranked in matches for score in ranked]
+    assert serialization.encoder_name() == encoder
+    assert serialization.loads(serialization.dumps(scores)) == [dataclasses.asdict(score) for score in scores]
+    assert serialization.loads(serialization.dumps(profiles[:10])) == [profile.to_dict() for profile in profiles[:10]]
+    assert json.loads(serialization.dumps(scores)) == json.loads(json.dumps([dataclasses.asdict(score) for score in scores]))
+
+def test_dumps_numpy_values(encoder):
+    data = {'count': np.int64(3), 'score': np.float64(0.61), 'rows': np.arange(3, dtype=np.int32), 'ratio': np.float32(0.5)}
+    assert serialization.loads(serialization.dumps(data)) == {'count': 3, 'score': 0.61, 'rows': [0, 1, 2], 'ratio': 0.5}
+
+def test_dumps_sort_keys_and_default(encoder):
+    data = {'b': 1, 'a': {'d': 2, 'c': datetime.date(2024, 1, 2)}}
+    encoded = serialization.dumps(data, sort_keys=True, default=str)
+    assert json.loads(encoded) == {'a': {'c': '2024-01-02', 'd': 2}, 'b': 1}
+    assert encoded.index(b'"a"') < encoded.index(b'"b"')
+    with pytest.raises(TypeError):
+        serialization.dumps({'when': object()})
+
+def test_stdlib_lines_are_byte_identical(monkeypatch, matches, profiles):
+    monkeypatch.setattr(serialization, 'orjson', None)
+    explainer = ExplainabilityEngine()
+    for user, ranked in zip(profiles, matches):
+        lines = [dataclasses.asdict(score) for score in ranked]
+        assert serialization.match_line(user.user_id, ranked) == (json.dumps({'user_id': user.user_id, 'matches': lines}) + '\n').encode()
+        details = [explainer.explain_match(score) for score in ranked]
+        for line, detail in zip(lines, details):
+            line['details'] = detail
+        assert serialization.match_line(user.user_id, ranked, details) == (json.dumps({'user_id': user.user_id, 'matches': lines}) + '\n').encode()
+    assert serialization.error_line('nobody', 'Unknown user_id') == b'{"user_id": "nobody", "error": "Unknown user_id"}\n'
+
+def test_lines_decode_to_the_same_data(encoder, matches, profiles):
+    for user, ranked in zip(profiles, matches):
+        line = serialization.match_line(user.user_id, ranked)
+        assert line.endswith(b'\n') and line.count(b'\n') == 1
+        assert json.loads(line) == {'user_id': user.user_id, 'matches': [dataclasses.asdict(score) for score in ranked]}
+
+def test_non_ascii_text(encoder):
+    score = CompatibilityScore('zoë', 'иван', 0.5, 0.5, 0.5, 0.5, 0.5, 'Strong alignment — “family first”')
+    assert json.loads(serialization.match_line('zoë', [score])) == {'user_id': 'zoë', 'matches': [dataclasses.asdict(score)]}
+
+def flask_response(provider_class, data, debug=False):
+    app = Flask(__name__)
+    app.debug = debug
+    app.json = provider_class(app)
+    with app.app_context():
+        response = jsonify(data)
+    return response.mimetype, response.get_data()
+
+def test_jsonify_matches_flask(encoder, matches):
+    data = {
+        'matches': [dataclasses.asdict(score) for score in matches[0]],
+        'scores': matches[1],
+        'stats': {'sessions': 3, 'ratio': 0.25, 'zeta': None, 'alpha': [1, 'two']},
+        'when': datetime.datetime(2024, 1, 2, 3, 4, 5),
+    }
+    mimetype, body = flask_response(serialization.JSONProvider, data)
+    expected_mimetype, expected = flask_response(DefaultJSONProvider, data)
+    assert mimetype == expected_mimetype
+    assert body.endswith(b'\n')
+    assert json.loads(body) == json.loads(expected)
+    if encoder == 'json':
+        assert body == expected
+    # Sorted keys, as with Flask's encoder
+    assert list(json.loads(body)) == sorted(data)
+
+def test_jsonify_debug_is_pretty_printed(encoder):
+    data = {'b': [1, 2], 'a': 'x'}
+    assert flask_response(serialization.JSONProvider, data, debug=True) == flask_response(DefaultJSONProvider, data, debug=True)
+
+def test_batch_endpoint_lines():
+    from app import app, candidate_pool, compatibility_engine
+    user_ids = ['candidate_1', 'candidate_2', 'nobody']
+    response = app.test_client().post('/api/matches/batch', json={'user_ids': user_ids, 'top_n': 2})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data().splitlines()]
+    assert [line['user_id'] for line in lines] == user_ids
+    for user_id, line in zip(user_ids[:2], lines):
+        ranked = compatibility_engine.find_top_matches(candidate_pool.get(user_id), candidate_pool, 2)
+        assert line['matches'] == [dataclasses.asdict(score) for score in ranked]
+    assert lines[2] == {'user_id': 'nobody', 'error': 'Unknown user_id'}
@@ -0,0 +1,78 @@
+"""
+Tests for the session store: idle expiry, LRU eviction and SQLite persistence
+
+A fake clock stands in for time.time, so expiry is tested without sleeping.
+
+    python -m pytest test_sessions.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from sessions import SessionStore, SQLiteBackend  # noqa: E402
+
+class FakeClock:
+    """Seconds since the epoch that only move when told to"""
+    
+    def __init__(self, now=1000000.0):
+        self.now = now
+    
+    def __call__(self):
+        return self.now
+    
+    def advance(self, seconds):
+        self.now += seconds
+
+def test_idle_sessions_expire():
+    clock = FakeClock()
+    sessions = SessionStore(ttl=60, clock=clock)
+    sessions['a'] = {'step': 1}
+    sessions['b'] = {'step': 1}
+    clock.advance(40)
+    assert sessions['a'] == {'step': 1}  # Reading counts as use
+    clock.advance(40)
+    assert 'a' in sessions and 'b' not in sessions
+    assert sessions.expirations == 1
+    clock.advance(60)
+    assert 'a' not in sessions and len(sessions) == 0
+    assert sessions.stats()['expirations'] == 2 and sessions.memory_bytes == 0
+
+def test_least_recently_used_are_evicted():
+    sessions = SessionStore(max_entries=3, clock=FakeClock())
+    for session_id in 'abc':
+        sessions[session_id] = {'id': session_id}
+    sessions['a']
+    sessions['d'] = {'id': 'd'}
+    assert sorted(sessions) == ['a', 'c', 'd'] and sessions.evictions == 1
+    sessions['c']['answer'] = 'yes'  # Updated in place, as handlers do
+    sessions['e'] = {'id': 'e'}
+    assert sorted(sessions) == ['c', 'd', 'e'] and sessions['c']['answer'] == 'yes'
+    assert sessions.evictions == 2 and sessions.stats()['sessions'] == 3
+
+def test_sqlite_sessions_survive_a_restart(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / 'sessions.db')
+    sessions = SessionStore(max_entries=2, ttl=60, backend=SQLiteBackend(path, clock=clock), clock=clock)
+    sessions['a'] = {'answers': ['x']}
+    sessions.save('a')
+    sessions['b'] = {'answers': []}
+    sessions.save('b')
+    sessions['c'] = {'answers': []}  # Evicts 'a' from memory only
+    sessions.save('c')
+    assert 'a' not in list(sessions) and sessions['a'] == {'answers': ['x']}
+    sessions.backend.close()
+    
+    # Another process opening the same file sees the saved sessions
+    reopened = SessionStore(ttl=60, backend=SQLiteBackend(path, clock=clock), clock=clock)
+    assert reopened['a'] == {'answers': ['x']} and 'b' in reopened
+    reopened['a']['answers'].append('y')
+    reopened.save('a')
+    del reopened['b']
+    assert 'b' not in reopened
+    
+    other = SessionStore(ttl=60, backend=SQLiteBackend(path, clock=clock), clock=clock)
+    assert other['a'] == {'answers': ['x', 'y']} and 'b' not in other
+    clock.advance(61)
+    assert 'c' not in other and other.backend.load('a') is None